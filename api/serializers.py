@@ -1,25 +1,26 @@
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from videos.models import VideoInfo
+from videos.models import VideoInfo, VideoFormat
 from downloads.models import DownloadTask
 
-class VideoFormatSerializer(serializers.Serializer):
-    format_id = serializers.CharField()
-    quality = serializers.CharField()
-    ext = serializers.CharField()
-    filesize = serializers.IntegerField(allow_null=True)
-    has_video = serializers.BooleanField()
-    has_audio = serializers.BooleanField()
+class VideoFormatSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoFormat
+        fields = list(VideoFormat.FIELDS)
 
 class VideoInfoSerializer(serializers.ModelSerializer):
-    formats = serializers.SerializerMethodField()
+    formats = VideoFormatSerializer(many=True, read_only=True)
     
     class Meta:
         model = VideoInfo
         fields = ['youtube_id', 'title', 'duration', 'thumbnail_url', 'uploader', 'formats']
-        
-    def get_formats(self, obj):
-        # available_qualities is already JSON
-        return obj.available_qualities
+
+def download_url_for(task):
+    """Where a completed task's file is served (with Range support), see api.views.download_file"""
+    if task.status == 'completed' and task.output_file:
+        return reverse('download_file', args=[task.task_id])
+    return None
 
 class DownloadTaskSerializer(serializers.ModelSerializer):
     download_url = serializers.SerializerMethodField()
@@ -27,12 +28,10 @@ class DownloadTaskSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = DownloadTask
-        fields = ['task_id', 'status', 'progress', 'download_url', 'error_message', 'file_size']
+        fields = ['task_id', 'status', 'stage', 'progress', 'cut_mode', 'download_url', 'error_message', 'file_size']
         
     def get_download_url(self, obj):
-        if obj.status == 'completed' and obj.output_file:
-            return obj.output_file.url
-        return None
+        return download_url_for(obj)
         
     def get_file_size(self, obj):
         if obj.status == 'completed' and obj.output_file:
@@ -42,16 +41,61 @@ class DownloadTaskSerializer(serializers.ModelSerializer):
                 return None
         return None
 
+class TaskStatusSerializer(serializers.ModelSerializer):
+    """Lightweight task status for bulk responses: no file size, so no filesystem access per row"""
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DownloadTask
+        fields = ['task_id', 'status', 'progress', 'download_url', 'error_message']
+
+    def get_download_url(self, obj):
+        return download_url_for(obj)
+
+class BulkTaskStatusRequestSerializer(serializers.Serializer):
+    task_ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False)
+    batch_id = serializers.UUIDField(required=False)
+
+    def validate(self, data):
+        if not data.get('task_ids') and not data.get('batch_id'):
+            raise serializers.ValidationError("Provide task_ids or batch_id.")
+        limit = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('MAX_STATUS_TASK_IDS', 500)
+        if len(data.get('task_ids') or []) > limit:
+            raise serializers.ValidationError(f"At most {limit} task ids can be queried at once.")
+        return data
+
 class DownloadRequestSerializer(serializers.Serializer):
     youtube_url = serializers.URLField()
     start_time = serializers.IntegerField(min_value=0)
     end_time = serializers.IntegerField(min_value=0)
     quality = serializers.CharField()
+    cut_mode = serializers.ChoiceField(choices=DownloadTask.CUT_MODE_CHOICES, default='copy')
     
     def validate(self, data):
         if data['start_time'] >= data['end_time']:
             raise serializers.ValidationError("End time must be greater than start time.")
         return data
 
+class SegmentRangeSerializer(serializers.Serializer):
+    start_time = serializers.IntegerField(min_value=0)
+    end_time = serializers.IntegerField(min_value=0)
+
+    def validate(self, data):
+        if data['start_time'] >= data['end_time']:
+            raise serializers.ValidationError("End time must be greater than start time.")
+        return data
+
+class DownloadBatchRequestSerializer(serializers.Serializer):
+    youtube_url = serializers.URLField()
+    quality = serializers.CharField()
+    cut_mode = serializers.ChoiceField(choices=DownloadTask.CUT_MODE_CHOICES, default='copy')
+    segments = SegmentRangeSerializer(many=True, allow_empty=False)
+
+    def validate_segments(self, segments):
+        limit = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('MAX_BATCH_SEGMENTS', 50)
+        if len(segments) > limit:
+            raise serializers.ValidationError(f"A batch can contain at most {limit} segments.")
+        return segments
+
 class ExtractInfoRequestSerializer(serializers.Serializer):
     youtube_url = serializers.URLField()
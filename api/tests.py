@@ -1,3 +1,438 @@
+import shutil
+import tempfile
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+import json
+import os
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from unittest.mock import patch
+from videos.models import VideoInfo
+from downloads.models import DownloadTask, Profile
+from downloads.progress import ProgressTracker
+
+
+class DownloadSegmentViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.video = VideoInfo.objects.create(
+            youtube_id="dQw4w9WgXcQ",
+            title="Test Video",
+            duration=300
+        )
+        self.video.formats.create(format_id='22', quality='720p', ext='mp4')
+        self.payload = {
+            'youtube_url': "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            'start_time': 10,
+            'end_time': 20,
+            'quality': '720p',
+        }
+        self.video_data = {
+            'youtube_id': "dQw4w9WgXcQ",
+            'duration': 300,
+            'formats': [fmt.to_dict() for fmt in self.video.formats.all()],
+        }
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_queues_new_task(self, mock_info, mock_process):
+        mock_info.return_value = self.video_data
+
+        response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        mock_process.apply_async.assert_called_once()
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_profile_header_profiles_request_and_task(self, mock_info, mock_process):
+        mock_info.return_value = self.video_data
+
+        self.client.post('/api/download-segment/', self.payload, format='json', HTTP_X_PROFILE='1')
+        self.assertFalse(Profile.objects.exists())
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, PROFILE_TOKEN='secret')
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post(
+                '/api/download-segment/', dict(self.payload, end_time=30), format='json', HTTP_X_PROFILE='secret'
+            )
+
+        self.assertEqual(response.status_code, 202)
+        profile = Profile.objects.get()
+        self.assertEqual(profile.name, 'DownloadSegmentView.post')
+        self.assertEqual(str(profile.task_id), str(response.data['task_id']))
+        self.assertEqual(mock_process.apply_async.call_args.kwargs['kwargs'], {'profile': True})
+
+        # Split stages pass the flag down the chain
+        downloader_settings['SPLIT_STAGES'] = True
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings), \
+                patch('downloads.tasks.queue_segment_stages') as mock_queue_stages:
+            response = self.client.post(
+                '/api/download-segment/', dict(self.payload, end_time=40), format='json', HTTP_X_PROFILE='secret'
+            )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Profile.objects.filter(task_id=response.data['task_id']).count(), 1)
+        mock_queue_stages.assert_called_once_with(response.data['task_id'], profile=True)
+
+    @patch('downloads.tasks.queue_segment_stages')
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_split_stages_queue_a_chain(self, mock_info, mock_process, mock_queue_stages):
+        mock_info.return_value = self.video_data
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SPLIT_STAGES=True)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        mock_queue_stages.assert_called_once_with(response.data['task_id'])
+        mock_process.apply_async.assert_not_called()
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.ResultCache.lookup')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_returns_cached_result(self, mock_info, mock_lookup, mock_process):
+        mock_info.return_value = self.video_data
+        mock_lookup.return_value = DownloadTask.objects.create(
+            video=self.video, start_time=10, end_time=20, quality='720p', status='completed'
+        )
+
+        response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['cached'])
+        self.assertEqual(response.data['status'], 'completed')
+        mock_process.apply_async.assert_not_called()
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('videos.cache.YouTubeExtractor.get_video_info')
+    def test_fresh_metadata_skips_extraction(self, mock_info, mock_process):
+        response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        mock_info.assert_not_called()
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('videos.cache.YouTubeExtractor.get_video_info')
+    def test_stale_metadata_is_extracted_again(self, mock_info, mock_process):
+        mock_info.return_value = self.video_data
+        VideoInfo.objects.filter(pk=self.video.pk).update(updated_at=timezone.now() - timedelta(days=1))
+
+        response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        mock_info.assert_called_once_with(self.payload['youtube_url'])
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_full_queue_is_refused(self, mock_info, mock_process):
+        mock_info.return_value = self.video_data
+        DownloadTask.objects.create(video=self.video, start_time=0, end_time=5, quality='720p', client_id='ip:other')
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, MAX_QUEUE_DEPTH=1, ADMISSION_RETRY_AFTER=15)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '15')
+        self.assertEqual(DownloadTask.objects.count(), 1)
+        mock_process.apply_async.assert_not_called()
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_client_limit_is_refused(self, mock_info, mock_process):
+        mock_info.return_value = self.video_data
+        DownloadTask.objects.create(video=self.video, start_time=0, end_time=5, quality='720p', client_id='ip:127.0.0.1')
+        DownloadTask.objects.create(
+            video=self.video, start_time=5, end_time=9, quality='720p', client_id='ip:127.0.0.1', status='completed'
+        )
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, MAX_CLIENT_IN_FLIGHT=1)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post('/api/download-segment/', self.payload, format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+
+            response = self.client.post('/api/download-segment/', self.payload, format='json', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, 202)
+
+    @patch('downloads.tasks.process_download_segment')
+    @patch('downloads.admission.AdmissionController.free_disk_bytes')
+    @patch('api.views.YouTubeExtractor.get_video_info')
+    def test_low_disk_is_refused(self, mock_info, mock_free, mock_process):
+        mock_info.return_value = self.video_data
+        DownloadTask.objects.create(
+            video=self.video, start_time=0, end_time=5, quality='720p', estimated_size=400 * 1024 * 1024
+        )
+        mock_free.return_value = 1024 * 1024 * 1024
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, MIN_FREE_DISK_BYTES=256 * 1024 * 1024)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post('/api/download-segment/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        mock_process.apply_async.assert_not_called()
+
+
+class DownloadBatchViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.video = VideoInfo.objects.create(
+            youtube_id="dQw4w9WgXcQ",
+            title="Test Video",
+            duration=300
+        )
+        self.video.formats.create(format_id='22', quality='720p', ext='mp4')
+        self.payload = {
+            'youtube_url': "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            'quality': '720p',
+            'segments': [
+                {'start_time': 10, 'end_time': 20},
+                {'start_time': 30, 'end_time': 40},
+                {'start_time': 10, 'end_time': 20},
+            ],
+        }
+
+    @patch('downloads.tasks.process_download_batch')
+    def test_queues_one_job_with_a_task_per_segment(self, mock_batch):
+        response = self.client.post('/api/download-batch/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.data['tasks']), 2)
+        self.assertEqual(DownloadTask.objects.filter(batch_id=response.data['batch_id']).count(), 2)
+        mock_batch.apply_async.assert_called_once()
+        self.assertEqual(len(mock_batch.apply_async.call_args[1]['args'][0]), 2)
+
+    @patch('downloads.tasks.process_download_batch')
+    def test_rejects_out_of_range_segment(self, mock_batch):
+        self.payload['segments'].append({'start_time': 10, 'end_time': 900})
+
+        response = self.client.post('/api/download-batch/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DownloadTask.objects.count(), 0)
+        mock_batch.apply_async.assert_not_called()
+
+    @patch('downloads.tasks.process_download_batch')
+    def test_batch_is_admitted_as_a_whole(self, mock_batch):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, MAX_CLIENT_IN_FLIGHT=1)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.post('/api/download-batch/', self.payload, format='json')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(DownloadTask.objects.count(), 0)
+        mock_batch.apply_async.assert_not_called()
+
+
+class TaskStatusViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        video = VideoInfo.objects.create(youtube_id="dQw4w9WgXcQ", title="Test Video", duration=300)
+        self.task = DownloadTask.objects.create(
+            video=video, start_time=10, end_time=20, quality='720p', status='processing', progress=5
+        )
+
+    def test_reads_hot_progress_from_cache(self):
+        ProgressTracker.publish([self.task.task_id], 42)
+
+        response = self.client.get(f'/api/task-status/{self.task.task_id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['progress'], 42)
+
+
+class TaskEventsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        video = VideoInfo.objects.create(youtube_id="dQw4w9WgXcQ", title="Test Video", duration=300)
+        self.task = DownloadTask.objects.create(
+            video=video, start_time=10, end_time=20, quality='720p', status='processing', progress=5
+        )
+
+    def test_requires_asgi(self):
+        response = self.client.get(f'/api/task-events/{self.task.task_id}/')
+
+        self.assertEqual(response.status_code, 501)
+
+    async def test_streams_progress_until_completed(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SSE_POLL_INTERVAL=0.01)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = await self.async_client.get(f'/api/task-events/?ids={self.task.task_id}')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+            events = []
+            async for chunk in response.streaming_content:
+                chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+                if not chunk.startswith('event:'):
+                    continue
+                events.append(json.loads(chunk.split('data: ', 1)[1]))
+                if len(events) == 1:
+                    ProgressTracker.publish([self.task.task_id], 40)
+                elif len(events) == 2:
+                    await DownloadTask.objects.filter(pk=self.task.pk).aupdate(status='completed', progress=100)
+                    ProgressTracker.publish([self.task.task_id], 100, status='completed')
+
+        self.assertEqual([event['progress'] for event in events], [5, 40, 100])
+        self.assertEqual(events[-1]['status'], 'completed')
+        self.assertIn('download_url', events[-1])
+
+
+class BulkTaskStatusViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        video = VideoInfo.objects.create(youtube_id="dQw4w9WgXcQ", title="Test Video", duration=300)
+        self.batch_id = uuid.uuid4()
+        self.tasks = [
+            DownloadTask.objects.create(
+                video=video, start_time=start, end_time=start + 10, quality='720p', batch_id=self.batch_id
+            )
+            for start in (0, 20, 40)
+        ]
+        self.ids = ','.join(str(task.task_id) for task in self.tasks)
+
+    def test_single_query_for_all_tasks(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/task-status/?ids={self.ids}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['tasks']), 3)
+        self.assertNotIn('file_size', response.data['tasks'][0])
+
+    def test_by_batch_id(self):
+        response = self.client.post('/api/task-status/', {'batch_id': str(self.batch_id)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {task['task_id'] for task in response.data['tasks']},
+            {str(task.task_id) for task in self.tasks}
+        )
+
+    def test_unchanged_tasks_return_304(self):
+        etag = self.client.get(f'/api/task-status/?ids={self.ids}')['ETag']
+
+        response = self.client.get(f'/api/task-status/?ids={self.ids}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        ProgressTracker.publish([self.tasks[0].task_id], 30)
+        response = self.client.get(f'/api/task-status/?ids={self.ids}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tasks'][0]['progress'], 30)
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        video = VideoInfo.objects.create(youtube_id="dQw4w9WgXcQ", title="Test Video", duration=300)
+        DownloadTask.objects.create(video=video, start_time=0, end_time=10, quality='720p', status='pending')
+        DownloadTask.objects.create(video=video, start_time=0, end_time=20, quality='720p', status='processing')
+
+    def test_prometheus_text(self):
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('ysd_tasks_in_flight{status="pending"} 1', body)
+        self.assertIn('ysd_cache_hit_ratio{cache="result"} 0.0', body)
+        self.assertIn('ysd_ffmpeg_processes 0', body)
+        self.assertIn('# TYPE ysd_stage_seconds histogram', body)
+
+    def test_token_required_when_configured(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, METRICS_TOKEN='secret')
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_safe_methods(self):
+        self.assertEqual(self.client.post('/metrics').status_code, 405)
+        self.assertEqual(self.client.head('/metrics').status_code, 200)
+
+
+class DownloadFileViewTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.content = bytes(range(256)) * 40
+        os.makedirs(os.path.join(self.media_root, 'downloads'))
+        with open(os.path.join(self.media_root, 'downloads', 'clip.mp4'), 'wb') as f:
+            f.write(self.content)
+        video = VideoInfo.objects.create(youtube_id="dQw4w9WgXcQ", title="Test Video", duration=300)
+        self.task = DownloadTask.objects.create(
+            video=video, start_time=0, end_time=10, quality='720p', status='completed',
+            output_file='downloads/clip.mp4'
+        )
+        self.url = f'/api/download/{self.task.task_id}/'
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment; filename="clip.mp4"', response['Content-Disposition'])
+        self.assertTrue(response['ETag'])
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '100')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_validators(self):
+        etag = self.client.head(self.url)['ETag']
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+
+    def test_proxy_offload(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, DOWNLOAD_SERVE_MODE='x-accel')
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/downloads/clip.mp4')
+        self.assertEqual(response.content, b'')
+
+    def test_missing_file(self):
+        os.remove(os.path.join(self.media_root, 'downloads', 'clip.mp4'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_serializer_points_to_the_view(self):
+        response = self.client.get(f'/api/task-status/{self.task.task_id}/')
+        self.assertEqual(response.data['download_url'], self.url)
+
+    async def test_streams_asynchronously_under_asgi(self):
+        response = await self.async_client.get(self.url, headers={'Range': 'bytes=10-4000'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.content[10:4001])
 
-# Create your tests here.
@@ -1,8 +1,14 @@
 from django.urls import path
-from .views import VideoInfoView, DownloadSegmentView, TaskStatusView
+from .views import VideoInfoView, DownloadSegmentView, DownloadBatchView, TaskStatusView, BulkTaskStatusView, CacheStatsView, task_events, download_file
 
 urlpatterns = [
     path('extract-info/', VideoInfoView.as_view(), name='extract_info'),
     path('download-segment/', DownloadSegmentView.as_view(), name='download_segment'),
+    path('download-batch/', DownloadBatchView.as_view(), name='download_batch'),
+    path('task-status/', BulkTaskStatusView.as_view(), name='task_status_bulk'),
     path('task-status/<uuid:task_id>/', TaskStatusView.as_view(), name='task_status'),
+    path('task-events/', task_events, name='task_events'),
+    path('task-events/<uuid:task_id>/', task_events, name='task_events_single'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('download/<uuid:task_id>/', download_file, name='download_file'),
 ]
@@ -1,4 +1,14 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,20 +16,45 @@ from .serializers import (
     VideoInfoSerializer, 
     DownloadTaskSerializer, 
     DownloadRequestSerializer,
+    DownloadBatchRequestSerializer,
+    TaskStatusSerializer,
+    BulkTaskStatusRequestSerializer,
     ExtractInfoRequestSerializer
 )
 from videos.services import YouTubeExtractor
 from downloads.services import SegmentDownloader
-from downloads.tasks import process_download_segment
+from downloads.scheduler import TaskScheduler
+from downloads.admission import AdmissionController, AdmissionRejected
 from downloads.models import DownloadTask
 from downloads.validators import DownloadValidator
 from downloads.progress import ProgressTracker
+from downloads.estimation import ThroughputEstimator
+from downloads.cache import ResultCache
+from downloads.source_cache import SourceCache
+from downloads.monitoring import PrometheusExporter
+from downloads.profiling import ProfiledViewMixin
+from downloads.serving import FileServer
 from videos.models import VideoInfo
+from videos.cache import MetadataCache
 import logging
 
 logger = logging.getLogger(__name__)
 
-class VideoInfoView(APIView):
+def client_id_for(request):
+    """Identify who is asking, for fair scheduling: the user when authenticated, else the client address"""
+    if request.user and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+def rejected_response(rejection):
+    """429/503 answer for work refused by admission control"""
+    return Response(
+        {"error": str(rejection), "retry_after": rejection.retry_after},
+        status=rejection.status_code,
+        headers={'Retry-After': str(rejection.retry_after)}
+    )
+
+class VideoInfoView(ProfiledViewMixin, APIView):
     """
     POST /api/extract-info/
     Extract video metadata and formats
@@ -38,6 +73,8 @@ class VideoInfoView(APIView):
         try:
             # 2. Extract Info
             video_data = YouTubeExtractor.get_video_info(youtube_url)
+            # Download requests for this video can skip extraction while the entry is fresh
+            MetadataCache.store(video_data)
             
             # 3. Serialize Response
             # Since video_data is a dict but matches serializer structure OR we can use the model instance if saved
@@ -53,7 +90,7 @@ class VideoInfoView(APIView):
             logger.error(f"Extraction failed: {str(e)}")
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class DownloadSegmentView(APIView):
+class DownloadSegmentView(ProfiledViewMixin, APIView):
     """
     POST /api/download-segment/
     Start a background download task
@@ -68,18 +105,19 @@ class DownloadSegmentView(APIView):
         start_time = data['start_time']
         end_time = data['end_time']
         quality = data['quality']
+        cut_mode = data['cut_mode']
         
-        # 1. Get Video Info (Should be cached/stored from previous step, or extract now)
-        # We need the youtube_id to proceed. Extract 'v' param or similar from URL 
-        # OR re-extract info if not found? 
-        # A robust way is to just call extract_info again or parse ID.
-        # Let's parse ID for efficiency if possible, but we need the Duration to validate timestamps.
-        # So calling get_video_info is safest to ensure we have the record.
+        # 1. Get Video Info from the metadata cache (re-extracted only when stale)
+        # The ID is parsed locally so a fresh VideoInfo row can be used without calling yt-dlp
+        if not DownloadValidator.validate_youtube_url(youtube_url):
+            return Response({"error": "Invalid YouTube URL"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-             video_data = YouTubeExtractor.get_video_info(youtube_url)
+             started = time.monotonic()
+             video_data = MetadataCache.get(youtube_url, DownloadValidator.extract_video_id(youtube_url))
+             metadata_seconds = round(time.monotonic() - started, 3)
              youtube_id = video_data['youtube_id']
              duration = video_data['duration']
-             available_formats = video_data['formats']
+             video = VideoInfo.objects.get(youtube_id=youtube_id)
         except Exception:
              return Response({"error": "Could not retrieve video info"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -90,37 +128,159 @@ class DownloadSegmentView(APIView):
             return Response({"error": str(start)}, status=status.HTTP_400_BAD_REQUEST)
 
         # 3. Validate Quality
-        if not DownloadValidator.validate_quality(quality, available_formats):
+        if not DownloadValidator.validate_quality(quality, video):
              return Response({"error": "Invalid quality selected"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 4. Estimate Size (Optional check)
-        estimated_size = ProgressTracker.estimate_size(
-            VideoInfo.objects.get(youtube_id=youtube_id), 
-            start, 
-            end, 
-            quality
-        )
+        # 4. Reuse an identical completed segment if its file is still around
+        cached_task = ResultCache.lookup(youtube_id, start, end, quality, cut_mode)
+        if cached_task:
+            response_data = DownloadTaskSerializer(cached_task).data
+            response_data['cached'] = True
+            return Response(response_data, status=status.HTTP_200_OK)
+
+        # 5. Estimate Size (Optional check)
+        estimated_size = ProgressTracker.estimate_size(video, start, end, quality)
         if estimated_size > settings.YOUTUBE_DOWNLOADER_SETTINGS.get('MAX_SEGMENT_SIZE', 1073741824):
              return Response({"error": "Estimated file size too large"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 6. Admission control: refuse early when the queue, the client or the disk is saturated
+        client_id = client_id_for(request)
+        try:
+            AdmissionController.check(client_id, estimated_size)
+        except AdmissionRejected as e:
+            return rejected_response(e)
         
-        # 5. Create Task
+        # 7. Create Task
         try:
-            task = SegmentDownloader.create_download_task(youtube_id, start, end, quality)
+            task = SegmentDownloader.create_download_task(
+                youtube_id, start, end, quality, cut_mode=cut_mode,
+                client_id=client_id, estimated_size=estimated_size,
+                stage_timings={'metadata': metadata_seconds}
+            )
             
-            # 6. Queue Celery Task
-            process_download_segment.delay(task.task_id)
+            # 8. Queue Celery Task, prioritized by the scheduler (shortest job first, fair share per client)
+            # A profiled request profiles its task too, both stored under the task's id
+            if request.profile is not None:
+                request.profile['task_id'] = task.task_id
+            TaskScheduler.submit(task, profile=request.profile is not None)
             
             return Response({
                 "task_id": task.task_id,
                 "status": "pending",
                 "estimated_size": estimated_size,
-                "estimated_duration": end - start
+                "estimated_duration": end - start,
+                "estimated_time": round(ThroughputEstimator.predict(estimated_size, end - start, cut_mode), 1)
             }, status=status.HTTP_202_ACCEPTED)
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class TaskStatusView(APIView):
+class DownloadBatchView(ProfiledViewMixin, APIView):
+    """
+    POST /api/download-batch/
+    Cut many segments of one video in a single background job
+    (one source download, one ffmpeg pass), with a task per segment
+    """
+    def post(self, request):
+        serializer = DownloadBatchRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        youtube_url = data['youtube_url']
+        quality = data['quality']
+        cut_mode = data['cut_mode']
+
+        # 1. Get Video Info from the metadata cache
+        if not DownloadValidator.validate_youtube_url(youtube_url):
+            return Response({"error": "Invalid YouTube URL"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            started = time.monotonic()
+            video_data = MetadataCache.get(youtube_url, DownloadValidator.extract_video_id(youtube_url))
+            metadata_seconds = round(time.monotonic() - started, 3)
+            youtube_id = video_data['youtube_id']
+            video = VideoInfo.objects.get(youtube_id=youtube_id)
+        except Exception:
+            return Response({"error": "Could not retrieve video info"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 2. Validate Quality
+        if not DownloadValidator.validate_quality(quality, video):
+            return Response({"error": "Invalid quality selected"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 3. Validate every range before creating anything; duplicates share one task
+        ranges = []
+        for index, segment in enumerate(data['segments']):
+            valid_time, start, end = DownloadValidator.validate_timestamps(
+                segment['start_time'], segment['end_time'], video_data['duration']
+            )
+            if not valid_time:
+                return Response({"error": f"Segment {index}: {start}"}, status=status.HTTP_400_BAD_REQUEST)
+            if (start, end) not in ranges:
+                ranges.append((start, end))
+
+        max_size = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('MAX_SEGMENT_SIZE', 1073741824)
+        estimated_size = 0
+        segment_sizes = {}
+        for start, end in ranges:
+            segment_size = ProgressTracker.estimate_size(video, start, end, quality)
+            if segment_size > max_size:
+                return Response({"error": "Estimated file size too large"}, status=status.HTTP_400_BAD_REQUEST)
+            segment_sizes[(start, end)] = segment_size
+            estimated_size += segment_size
+
+        # 4. Reuse completed segments, admit and create tasks for the rest
+        cached_tasks = {
+            (start, end): ResultCache.lookup(youtube_id, start, end, quality, cut_mode)
+            for start, end in ranges
+        }
+        new_ranges = [segment for segment, cached_task in cached_tasks.items() if not cached_task]
+        client_id = client_id_for(request)
+        if new_ranges:
+            try:
+                AdmissionController.check(
+                    client_id, sum(segment_sizes[segment] for segment in new_ranges), count=len(new_ranges)
+                )
+            except AdmissionRejected as e:
+                return rejected_response(e)
+
+        batch_id = uuid.uuid4()
+        try:
+            results = []
+            pending_tasks = []
+            for start, end in ranges:
+                cached_task = cached_tasks[(start, end)]
+                if cached_task:
+                    results.append(dict(DownloadTaskSerializer(cached_task).data, cached=True))
+                    continue
+                task = SegmentDownloader.create_download_task(
+                    youtube_id, start, end, quality, batch_id=batch_id, cut_mode=cut_mode,
+                    client_id=client_id, estimated_size=segment_sizes[(start, end)],
+                    stage_timings={'metadata': metadata_seconds}
+                )
+                pending_tasks.append(task)
+                results.append({"task_id": task.task_id, "status": "pending"})
+
+            # 5. Queue a single Celery job for all new segments
+            if pending_tasks:
+                TaskScheduler.submit_batch(pending_tasks)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        for result, (start, end) in zip(results, ranges):
+            result['start_time'] = start
+            result['end_time'] = end
+
+        return Response({
+            "batch_id": batch_id if pending_tasks else None,
+            "tasks": results,
+            "estimated_size": estimated_size,
+            "estimated_time": round(sum(
+                ThroughputEstimator.predict(segment_sizes[segment], segment[1] - segment[0], cut_mode)
+                for segment in new_ranges
+            ), 1),
+        }, status=status.HTTP_202_ACCEPTED if pending_tasks else status.HTTP_200_OK)
+
+class TaskStatusView(ProfiledViewMixin, APIView):
     """
     GET /api/task-status/{task_id}/
     Check status of download task
@@ -128,9 +288,201 @@ class TaskStatusView(APIView):
     def get(self, request, task_id):
         try:
             task = DownloadTask.objects.get(task_id=task_id)
-            # Refresh from DB to get latest progress updates
-            task.refresh_from_db()
+            # Workers publish hot progress to the cache and only persist milestones
+            if task.status in ('pending', 'processing'):
+                cached_progress = ProgressTracker.get_cached_progress(task_id)
+                if cached_progress is not None:
+                    task.progress = max(task.progress, cached_progress)
             serializer = DownloadTaskSerializer(task)
             return Response(serializer.data)
         except DownloadTask.DoesNotExist:
             return Response({"error": "Task not found"}, status=status.HTTP_404_NOT_FOUND)
+
+class BulkTaskStatusView(ProfiledViewMixin, APIView):
+    """
+    GET /api/task-status/?ids=<id>,<id>,... or ?batch_id=<id>
+    POST /api/task-status/ {"task_ids": [...]} or {"batch_id": "..."}
+    Status of many tasks from a single query; answers 304 when nothing changed since the ETag sent
+    """
+    def get(self, request):
+        data = {}
+        if request.query_params.get('ids'):
+            data['task_ids'] = [raw_id.strip() for raw_id in request.query_params['ids'].split(',') if raw_id.strip()]
+        if request.query_params.get('batch_id'):
+            data['batch_id'] = request.query_params['batch_id']
+        return self._respond(request, data)
+
+    def post(self, request):
+        return self._respond(request, request.data)
+
+    def _respond(self, request, data):
+        serializer = BulkTaskStatusRequestSerializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = DownloadTask.objects.only(
+            'task_id', 'status', 'progress', 'output_file', 'error_message', 'completed_at'
+        )
+        if serializer.validated_data.get('task_ids'):
+            tasks = tasks.filter(task_id__in=serializer.validated_data['task_ids'])
+        else:
+            tasks = tasks.filter(batch_id=serializer.validated_data['batch_id'])
+        tasks = list(tasks.order_by('created_at'))
+
+        # Running tasks report their hot progress from the cache, like TaskStatusView
+        running = [str(task.task_id) for task in tasks if task.status in ('pending', 'processing')]
+        if running:
+            cached = ProgressTracker.get_cached_states(running)
+            for task in tasks:
+                _, cached_progress = cached.get(str(task.task_id), (None, None))
+                if cached_progress is not None:
+                    task.progress = max(task.progress, cached_progress)
+
+        etag = '"{}"'.format(hashlib.sha1('|'.join(
+            f"{task.task_id}:{task.status}:{task.progress}:{task.completed_at}" for task in tasks
+        ).encode()).hexdigest())
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response({"tasks": TaskStatusSerializer(tasks, many=True).data}, headers=headers)
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+def _load_task_events(task_ids):
+    """Full status payload of the given tasks, as returned by the task status endpoint"""
+    tasks = DownloadTask.objects.filter(task_id__in=task_ids)
+    return {str(task.task_id): dict(DownloadTaskSerializer(task).data) for task in tasks}
+
+def _format_event(data):
+    return f"event: status\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def _task_event_stream(events):
+    """
+    Yield Server-Sent Events until every task is completed or failed.
+
+    Running tasks are followed through the progress and status the workers
+    publish in the cache (see ProgressTracker), which is cheap to read every
+    SSE_POLL_INTERVAL seconds. The database is only queried to send the
+    final payload of a finished task, and every SSE_DB_REFRESH_INTERVAL
+    seconds as a safety net when the cache isn't shared with the workers.
+    The stream ends after SSE_MAX_DURATION seconds; EventSource reconnects.
+    """
+    downloader_settings = settings.YOUTUBE_DOWNLOADER_SETTINGS
+    poll_interval = downloader_settings.get('SSE_POLL_INTERVAL', 0.5)
+    db_refresh_interval = downloader_settings.get('SSE_DB_REFRESH_INTERVAL', 10)
+    keepalive_interval = downloader_settings.get('SSE_KEEPALIVE_INTERVAL', 15)
+    deadline = time.monotonic() + downloader_settings.get('SSE_MAX_DURATION', 300)
+
+    # Ask the browser to wait a little before reconnecting once the stream ends
+    yield "retry: 2000\n\n"
+
+    states = {}
+    for task_id, data in events.items():
+        states[task_id] = (data['status'], data['progress'])
+        yield _format_event(data)
+    running = [task_id for task_id, (task_status, _) in states.items() if task_status not in TERMINAL_STATUSES]
+
+    last_sent = last_db_refresh = time.monotonic()
+    while running and time.monotonic() < deadline:
+        await asyncio.sleep(poll_interval)
+
+        cached = await sync_to_async(ProgressTracker.get_cached_states)(running)
+        finished = []
+        for task_id in running:
+            old_status, old_progress = states[task_id]
+            cached_status, cached_progress = cached[task_id]
+            task_status = cached_status or old_status
+            progress = max(old_progress, cached_progress or 0)
+            if task_status in TERMINAL_STATUSES:
+                finished.append(task_id)
+            elif (task_status, progress) != (old_status, old_progress):
+                states[task_id] = (task_status, progress)
+                yield _format_event({'task_id': task_id, 'status': task_status, 'progress': progress})
+                last_sent = time.monotonic()
+
+        if time.monotonic() - last_db_refresh >= db_refresh_interval:
+            last_db_refresh = time.monotonic()
+            persisted = await sync_to_async(_load_task_events)(running)
+            finished += [
+                task_id for task_id, data in persisted.items()
+                if data['status'] in TERMINAL_STATUSES and task_id not in finished
+            ]
+
+        if finished:
+            for data in (await sync_to_async(_load_task_events)(finished)).values():
+                yield _format_event(data)
+            running = [task_id for task_id in running if task_id not in finished]
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= keepalive_interval:
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+
+async def task_events(request, task_id=None):
+    """
+    GET /api/task-events/{task_id}/ or /api/task-events/?ids=<id>,<id>,...
+    Server-Sent Events stream of status and progress updates for one or many tasks
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the response would be buffered until the stream ends, clients should poll instead
+        return JsonResponse({"error": "Event streams require the ASGI server"}, status=501)
+
+    raw_ids = [str(task_id)] if task_id else request.GET.get('ids', '').split(',')
+    try:
+        task_ids = list(dict.fromkeys(str(uuid.UUID(raw_id.strip())) for raw_id in raw_ids if raw_id.strip()))
+    except ValueError:
+        return JsonResponse({"error": "Invalid task id"}, status=400)
+    if not task_ids or len(task_ids) > settings.YOUTUBE_DOWNLOADER_SETTINGS.get('MAX_BATCH_SEGMENTS', 50):
+        return JsonResponse({"error": "Invalid number of task ids"}, status=400)
+
+    events = await sync_to_async(_load_task_events)(task_ids)
+    if not events:
+        return JsonResponse({"error": "Task not found"}, status=404)
+
+    response = StreamingHttpResponse(_task_event_stream(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+class CacheStatsView(ProfiledViewMixin, APIView):
+    """
+    GET /api/cache-stats/
+    Hit ratios, bytes saved and eviction counts of the result, source and metadata caches
+    """
+    def get(self, request):
+        return Response({
+            "metadata": MetadataCache.stats(),
+            "results": ResultCache.stats(),
+            "sources": SourceCache.stats(),
+        })
+
+@require_safe
+def metrics(request):
+    """
+    GET/HEAD /metrics
+    Queue depth, cache hit ratios, running ffmpeg processes, throughput and stage
+    histograms in the Prometheus text format. Requires `Authorization: Bearer <METRICS_TOKEN>`
+    when METRICS_TOKEN is set.
+    """
+    token = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('METRICS_TOKEN')
+    # Constant-time comparison, the token is a secret
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse("Unauthorized\n", status=401, content_type='text/plain')
+    return HttpResponse(PrometheusExporter.render(), content_type=PrometheusExporter.CONTENT_TYPE)
+
+@require_safe
+def download_file(request, task_id):
+    """
+    GET/HEAD /api/download/{task_id}/
+    The completed segment, with ETag/If-None-Match, Range/If-Range and Content-Length,
+    sent by sendfile or a front proxy depending on DOWNLOAD_SERVE_MODE (see FileServer)
+    """
+    task = DownloadTask.objects.filter(task_id=task_id, status='completed').only('output_file').first()
+    if not task or not task.output_file:
+        return JsonResponse({"error": "File not found"}, status=404)
+    try:
+        return FileServer.serve(request, task.output_file.path, task.output_file.name)
+    except FileNotFoundError:
+        return JsonResponse({"error": "File not found"}, status=404)
+
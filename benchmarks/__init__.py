@@ -0,0 +1,15 @@
+"""
+Offline benchmarks, run as modules from the project root, e.g.
+
+    python -m benchmarks.db_queries
+
+They configure Django themselves (DJANGO_SETTINGS_MODULE defaults to core.settings)
+and never touch the development database.
+"""
+import os
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
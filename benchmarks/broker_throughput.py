@@ -0,0 +1,149 @@
+"""
+Throughput of Celery brokers and result backends, measured locally.
+
+    python -m benchmarks.broker_throughput [--messages 2000] [--redis-url redis://...] [--json]
+
+Brokers: task-sized messages are published to and consumed (and acked) from a
+queue on each transport. Result backends: a result is stored and polled back
+for each task id, like a client waiting on AsyncResult would. No Redis is
+needed: `memory://` stands in for a network broker/backend without the network
+and `filesystem://` for file-backed transports, next to the SQLAlchemy/SQLite
+broker and the django-db backend (in a throwaway database) that are used by
+default. Pass --redis-url to include a real Redis server. Transports whose
+client library isn't installed are reported as errors.
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from . import setup
+
+
+# Roughly the body of a process_download_segment message
+PAYLOAD = [[str(uuid.uuid4())], {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}]
+
+
+def brokers(workdir, redis_url=None):
+    """{name: (url, transport_options)}"""
+    folder = Path(workdir) / 'broker'
+    folder.mkdir(parents=True, exist_ok=True)
+    found = {
+        'memory': ('memory://', {}),
+        'filesystem': ('filesystem://', {
+            'data_folder_in': str(folder),
+            'data_folder_out': str(folder),
+            # Exchange bindings, written to ./control/ by default
+            'control_folder': str(folder / 'control'),
+            'store_processed': False,
+        }),
+        'sqla+sqlite (default)': (f"sqla+sqlite:///{Path(workdir) / 'celerydb.sqlite'}", {}),
+    }
+    if redis_url:
+        found['redis'] = (redis_url, {})
+    return found
+
+
+def result_backends(redis_url=None):
+    """{name: url}"""
+    found = {
+        'cache+memory': 'cache+memory://',
+        'django-db (default)': 'django-db',
+    }
+    if redis_url:
+        found['redis'] = redis_url
+    return found
+
+
+def measure_broker(url, transport_options, count):
+    from kombu import Connection
+
+    with Connection(url, transport_options=transport_options) as connection:
+        queue = connection.SimpleQueue(f"ysd-bench-{uuid.uuid4().hex[:8]}")
+        try:
+            started = time.perf_counter()
+            for _ in range(count):
+                queue.put(PAYLOAD, serializer='json')
+            published = time.perf_counter()
+            for _ in range(count):
+                queue.get(timeout=10).ack()
+            consumed = time.perf_counter()
+        finally:
+            queue.clear()
+            queue.close()
+    return {
+        'publish_per_second': round(count / (published - started), 1),
+        'consume_per_second': round(count / (consumed - published), 1),
+    }
+
+
+def measure_backend(url, count):
+    from celery import Celery
+
+    app = Celery('benchmark', backend=url, set_as_current=False)
+    backend = app.backend
+    task_ids = [str(uuid.uuid4()) for _ in range(count)]
+
+    started = time.perf_counter()
+    for task_id in task_ids:
+        backend.store_result(task_id, "Completed", 'SUCCESS')
+    stored = time.perf_counter()
+    for task_id in task_ids:
+        backend.get_task_meta(task_id)
+    polled = time.perf_counter()
+    return {
+        'writes_per_second': round(count / (stored - started), 1),
+        'polls_per_second': round(count / (polled - stored), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000, help="messages / results per measurement")
+    parser.add_argument('--redis-url', help="also measure a Redis server, e.g. redis://localhost:6379/15")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+    from django.test.utils import setup_databases, teardown_databases
+
+    workdir = tempfile.mkdtemp(prefix='ysd-broker-bench-')
+    # django-db results go to a throwaway database, a file like the real one when it's SQLite
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = str(Path(workdir) / 'results.sqlite3')
+    databases = setup_databases(verbosity=0, interactive=False)
+    report = {'messages': args.messages, 'brokers': {}, 'result_backends': {}}
+
+    def record(section, name, measure):
+        try:
+            result = measure()
+        except Exception as e:
+            result = {'error': f"{type(e).__name__}: {e}"}
+        report[section][name] = result
+        if not args.json:
+            print(f"  {name:<24} {result}", flush=True)
+
+    try:
+        if not args.json:
+            print(f"Brokers ({args.messages} messages)")
+        for name, (url, options) in brokers(workdir, args.redis_url).items():
+            record('brokers', name, lambda: measure_broker(url, options, args.messages))
+
+        if not args.json:
+            print(f"Result backends ({args.messages} results; with CELERY_TASK_IGNORE_RESULT none are written)")
+        for name, url in result_backends(args.redis_url).items():
+            record('result_backends', name, lambda: measure_backend(url, args.messages))
+    finally:
+        teardown_databases(databases, verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Query plans and timings of the hot DownloadTask queries, without and with the indexes.
+
+    python -m benchmarks.db_queries [--tasks 50000] [--repeat 20] [--json]
+
+Runs against a throwaway test database of the configured backend (SQLite, or
+PostgreSQL with DB_ENGINE=postgresql), seeded with synthetic tasks. Each query
+is explained and timed with the DownloadTask indexes dropped ("before") and
+then recreated ("after").
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from . import setup
+
+
+def seed(task_count, video_count=200):
+    from django.utils import timezone
+    from videos.models import VideoInfo
+    from downloads.models import DownloadTask
+
+    rng = random.Random(0)
+    videos = VideoInfo.objects.bulk_create([
+        VideoInfo(youtube_id=f"bench{index:06d}", title=f"Benchmark {index}", duration=3600)
+        for index in range(video_count)
+    ])
+    now = timezone.now()
+    statuses = ['completed'] * 90 + ['failed'] * 6 + ['pending'] * 2 + ['processing'] * 2
+    tasks = []
+    for index in range(task_count):
+        start = rng.randrange(0, 3000)
+        tasks.append(DownloadTask(
+            video=rng.choice(videos),
+            start_time=start,
+            end_time=start + rng.randrange(5, 600),
+            quality=rng.choice(['360p', '720p', '1080p']),
+            status=rng.choice(statuses),
+            client_id=f"ip:10.0.{index % 50}.1",
+            estimated_size=rng.randrange(1, 100) * 1024 * 1024,
+        ))
+    DownloadTask.objects.bulk_create(tasks, batch_size=2000)
+    # auto_now_add can't be overridden on create, spread the tasks over 90 days afterwards
+    created = [
+        DownloadTask(pk=pk, created_at=now - timedelta(seconds=rng.randrange(0, 90 * 86400)))
+        for pk in DownloadTask.objects.values_list('pk', flat=True)
+    ]
+    DownloadTask.objects.bulk_update(created, ['created_at'], batch_size=2000)
+    return DownloadTask.objects.filter(status='completed').select_related('video').first()
+
+
+def queries(sample):
+    """{name: queryset} of the queries run on hot paths"""
+    from django.utils import timezone
+    from downloads.models import DownloadTask
+
+    return {
+        # Admission control / scheduler: tasks in flight
+        'in_flight': DownloadTask.objects.filter(status__in=('pending', 'processing')).order_by('created_at'),
+        # Admin changelist filtered by status, newest first
+        'admin_status_filter': DownloadTask.objects.filter(status='failed').order_by('-created_at')[:100],
+        # Cleanup scan of old failed tasks
+        'cleanup_scan': DownloadTask.objects.filter(
+            status='failed', created_at__lt=timezone.now() - timedelta(days=30)
+        ),
+        # Result cache: a completed task for the same segment
+        'result_lookup': DownloadTask.objects.filter(
+            video=sample.video,
+            start_time=sample.start_time,
+            end_time=sample.end_time,
+            quality=sample.quality,
+            cut_mode=sample.cut_mode,
+            status='completed',
+        ).order_by('-completed_at')[:1],
+    }
+
+
+def analyze():
+    from django.db import connection
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(querysets, repeat):
+    results = {}
+    for name, queryset in querysets.items():
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset._chain())
+            durations.append(time.perf_counter() - started)
+        results[name] = {
+            'plan': queryset.explain(),
+            'median_ms': round(statistics.median(durations) * 1000, 3),
+        }
+    return results
+
+
+def run(task_count, repeat):
+    from django.db import connection
+    from downloads.models import DownloadTask
+
+    sample = seed(task_count)
+    querysets = queries(sample)
+    indexes = DownloadTask._meta.indexes
+
+    with connection.schema_editor() as schema_editor:
+        for index in indexes:
+            schema_editor.remove_index(DownloadTask, index)
+    analyze()
+    before = measure(querysets, repeat)
+
+    with connection.schema_editor() as schema_editor:
+        for index in indexes:
+            schema_editor.add_index(DownloadTask, index)
+    analyze()
+    after = measure(querysets, repeat)
+
+    return {
+        'backend': connection.vendor,
+        'tasks': task_count,
+        'repeat': repeat,
+        'queries': {name: {'before': before[name], 'after': after[name]} for name in querysets},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=50000, help="synthetic tasks to seed")
+    parser.add_argument('--repeat', type=int, default=20, help="runs per query, the median is reported")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+
+    setup()
+    from django.test.utils import setup_databases, teardown_databases
+
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        report = run(args.tasks, args.repeat)
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['tasks']} tasks on {report['backend']}, median of {report['repeat']} runs\n")
+    for name, phases in report['queries'].items():
+        before, after = phases['before'], phases['after']
+        print(f"== {name}: {before['median_ms']} ms -> {after['median_ms']} ms")
+        for phase, result in (('before', before), ('after', after)):
+            plan = result['plan'].replace('\n', '\n' + ' ' * 11)
+            print(f"   {phase + ':':<7} {plan}")
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Throughput of serving completed clips: the /media/ static route against /api/download/<task_id>/.
+
+    python -m benchmarks.download_serving [--size-mb 100] [--requests 20] [--concurrency 4]
+                                          [--range-kb 1024] [--json]
+
+A clip of --size-mb random bytes is registered as a completed task in a
+throwaway database and served by uvicorn (the ASGI server the app runs on)
+in this process. For each path the benchmark measures full downloads
+(MB/s, latency percentiles) and Range requests of --range-kb at random
+offsets (what video players and resumed downloads send), plus the peak RSS
+of the process after each scenario: under ASGI, Django's FileResponse
+(used by the static route) reads the whole file into memory before sending.
+The x-accel scenario times the Django side of DOWNLOAD_SERVE_MODE='x-accel',
+where nginx would send the bytes.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import setup
+from .pipeline import percentiles
+
+
+# URLconf of the served app with the /media/ route that core.urls only adds under DEBUG
+urlpatterns = []
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def start_server():
+    import uvicorn
+    from core.asgi import application
+
+    server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=0, log_level='warning', lifespan='off'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def fetch(session, url, headers=None):
+    started = time.perf_counter()
+    received = 0
+    with session.get(url, headers=headers or {}, stream=True) as response:
+        for chunk in response.iter_content(1024 * 1024):
+            received += len(chunk)
+    return response.status_code, received, time.perf_counter() - started
+
+
+def run_scenario(url, count, concurrency, headers_for=lambda: None):
+    import requests
+
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return fetch(local.session, url, headers_for())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    wall = time.perf_counter() - started
+    received = sum(result[1] for result in results)
+    return {
+        'requests': count,
+        'statuses': sorted({result[0] for result in results}),
+        'bytes_per_request': received // count,
+        'requests_per_second': round(count / wall, 1),
+        'mb_per_second': round(received / wall / 1024 / 1024, 1),
+        'latency_seconds': percentiles([result[2] for result in results]),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=100, help="size of the served clip")
+    parser.add_argument('--requests', type=int, default=20, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=4, help="parallel clients")
+    parser.add_argument('--range-kb', type=int, default=1024, help="size of each Range request")
+    parser.add_argument('--json', action='store_true', help="print machine-readable results")
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import override_settings, setup_databases, teardown_databases
+    from django.urls import include, path, re_path
+    from django.views.static import serve
+
+    workdir = tempfile.mkdtemp(prefix='ysd-serving-bench-')
+    media_root = Path(workdir) / 'media'
+    (media_root / 'downloads').mkdir(parents=True)
+    with open(media_root / 'downloads' / 'clip.mp4', 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+    size = args.size_mb * 1024 * 1024
+    range_size = args.range_kb * 1024
+
+    def random_range():
+        start = random.randrange(0, max(size - range_size, 1))
+        return {'Range': f"bytes={start}-{start + range_size - 1}"}
+
+    urlpatterns[:] = [
+        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': media_root}),
+        path('', include('core.urls')),
+    ]
+
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = str(Path(workdir) / 'bench.sqlite3')
+    databases = setup_databases(verbosity=0, interactive=False)
+    report = {'size_bytes': size, 'range_bytes': range_size, 'concurrency': args.concurrency, 'scenarios': {}}
+    try:
+        from videos.models import VideoInfo
+        from downloads.models import DownloadTask
+
+        video = VideoInfo.objects.create(youtube_id='bench', title='bench', duration=600)
+        task = DownloadTask.objects.create(
+            video=video, start_time=0, end_time=600, quality='720p', status='completed',
+            output_file='downloads/clip.mp4', task_id=uuid.uuid4()
+        )
+
+        with override_settings(MEDIA_ROOT=media_root, ROOT_URLCONF=__name__):
+            server, thread, base_url = start_server()
+            static_url = f"{base_url}/media/downloads/clip.mp4"
+            view_url = f"{base_url}/api/download/{task.task_id}/"
+            scenarios = [
+                # The view first: the static route's buffering raises the peak RSS for good
+                ('view: full', view_url, args.requests, None),
+                ('view: range', view_url, args.requests * 5, random_range),
+                ('static (current): full', static_url, args.requests, None),
+                ('static (current): range', static_url, args.requests, random_range),
+            ]
+            try:
+                for name, url, count, headers_for in scenarios:
+                    result = run_scenario(url, count, args.concurrency, headers_for or (lambda: None))
+                    report['scenarios'][name] = result
+                    if not args.json:
+                        print(f"  {name:<26} {result}", flush=True)
+
+                accel_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, DOWNLOAD_SERVE_MODE='x-accel')
+                with override_settings(YOUTUBE_DOWNLOADER_SETTINGS=accel_settings):
+                    result = run_scenario(view_url, args.requests * 5, args.concurrency)
+                report['scenarios']['view: x-accel handoff'] = result
+                if not args.json:
+                    print(f"  {'view: x-accel handoff':<26} {result}", flush=True)
+            finally:
+                server.should_exit = True
+                thread.join(timeout=10)
+    finally:
+        teardown_databases(databases, verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
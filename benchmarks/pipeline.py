@@ -0,0 +1,347 @@
+"""
+End-to-end benchmark of segment processing, offline.
+
+    python -m benchmarks.pipeline [--clips 50] [--concurrency 4] [--sources 360p:120,720p:120,1080p:60]
+                                  [--clip-seconds 5-30] [--cut-mode copy] [--mode download]
+                                  [--range-fetch] [--bandwidth 0] [--output report.json]
+
+Synthetic sources (ffmpeg lavfi test patterns with a sine tone, H.264/AAC mp4)
+are generated once per resolution and duration and kept in --sources-dir.
+A fake extractor and fake downloader are plugged in behind YouTubeExtractor
+and SegmentDownloader: "downloads" copy the synthetic files (throttled to
+--bandwidth bytes/s per download when set), ranged fetches cut them with
+ffmpeg, and stream URLs resolve to the local files, so every extraction mode
+runs its real ffmpeg work without touching the network.
+
+process_download_segment is driven by --concurrency threads over a random
+(seeded) set of clips, against a throwaway database and media directory. The
+JSON report has latency percentiles (queued -> done and running -> done),
+clips and bytes per second, and per-stage breakdowns from the tasks' stage timings.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import patch
+
+from . import setup
+
+
+DEFAULT_SOURCES_DIR = Path(tempfile.gettempdir()) / 'ysd-bench-sources'
+RESOLUTIONS = {'144p': (256, 144), '240p': (426, 240), '360p': (640, 360), '480p': (854, 480),
+               '720p': (1280, 720), '1080p': (1920, 1080), '1440p': (2560, 1440), '2160p': (3840, 2160)}
+
+
+def ffmpeg_exe():
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+class SyntheticSource:
+    def __init__(self, quality, duration, directory):
+        self.quality = quality
+        self.duration = duration
+        self.youtube_id = f"synth_{quality}_{duration}"
+        self.path = Path(directory) / f"{self.youtube_id}.mp4"
+
+    def ensure(self):
+        """Generate the file unless an earlier run left it behind"""
+        if self.path.exists():
+            return self
+        width, height = RESOLUTIONS[self.quality]
+        part_path = self.path.with_suffix('.part.mp4')
+        subprocess.run([
+            ffmpeg_exe(), '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30",
+            '-f', 'lavfi', '-i', "sine=frequency=440:sample_rate=44100",
+            '-t', str(self.duration),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart',
+            str(part_path)
+        ], check=True, capture_output=True)
+        os.replace(part_path, self.path)
+        return self
+
+
+class FakeExtractor:
+    """YouTubeExtractor stand-in describing the synthetic sources"""
+
+    def __init__(self, sources):
+        self.sources = {source.youtube_id: source for source in sources}
+
+    def get_video_info(self, youtube_url):
+        from videos.models import VideoInfo, VideoFormat
+        from downloads.validators import DownloadValidator
+        from downloads.estimation import SizeEstimator
+
+        source = self.sources[DownloadValidator.extract_video_id(youtube_url) or youtube_url]
+        size = source.path.stat().st_size
+        fmt = {
+            'format_id': '18', 'quality': source.quality, 'ext': 'mp4', 'filesize': size,
+            'filesize_approx': None, 'tbr': None, 'vbr': None, 'abr': None,
+            'has_video': True, 'has_audio': True,
+        }
+        video, _ = VideoInfo.objects.update_or_create(
+            youtube_id=source.youtube_id,
+            defaults={
+                'title': source.path.name,
+                'duration': source.duration,
+                'bitrates': SizeEstimator.bitrate_table([fmt], source.duration),
+            }
+        )
+        video.formats.all().delete()
+        VideoFormat.objects.create(video=video, **fmt)
+        return {
+            'youtube_id': source.youtube_id, 'title': video.title, 'duration': source.duration,
+            'thumbnail': None, 'uploader': None, 'formats': [fmt],
+        }
+
+    def get_stream_urls(self, youtube_id, format_selector):
+        # ffmpeg reads local paths like URLs
+        return [str(self.sources[youtube_id].path)], {}
+
+
+class FakeDownloader:
+    """The network half of SegmentDownloader, served from the synthetic sources"""
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, sources, bandwidth=0):
+        self.sources = {source.youtube_id: source for source in sources}
+        self.bandwidth = bandwidth
+
+    def _throttle(self, started, transferred):
+        if self.bandwidth:
+            delay = transferred / self.bandwidth - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def download_full_video(self, youtube_id, quality, temp_path, progress_callback=None):
+        source = self.sources[youtube_id].path
+        total = source.stat().st_size
+        started = time.monotonic()
+        copied = 0
+        with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+            while True:
+                chunk = src.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                copied += len(chunk)
+                self._throttle(started, copied)
+                if progress_callback:
+                    progress_callback(10 + copied / total * 50)
+        return temp_path
+
+    def download_segment_range(self, youtube_id, quality, start_time, end_time, range_path,
+                               progress_callback=None, padding=5):
+        range_start = max(0, start_time - padding)
+        started = time.monotonic()
+        subprocess.run([
+            ffmpeg_exe(), '-y', '-v', 'error',
+            '-ss', str(range_start), '-i', str(self.sources[youtube_id].path),
+            '-t', str(end_time + padding - range_start), '-c', 'copy', str(range_path)
+        ], check=True, capture_output=True)
+        self._throttle(started, os.path.getsize(range_path))
+        return range_start
+
+
+def percentiles(values):
+    """p50/p95/p99 (nearest rank), mean and max of a list of seconds"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(percent):
+        return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+    return {
+        'p50': round(rank(50), 4),
+        'p95': round(rank(95), 4),
+        'p99': round(rank(99), 4),
+        'mean': round(sum(ordered) / len(ordered), 4),
+        'max': round(ordered[-1], 4),
+    }
+
+
+def parse_sources(spec, directory):
+    sources = []
+    for item in spec.split(','):
+        quality, duration = item.split(':')
+        if quality not in RESOLUTIONS:
+            raise SystemExit(f"Unknown resolution {quality}, use one of {', '.join(RESOLUTIONS)}")
+        sources.append(SyntheticSource(quality, int(duration), directory))
+    return sources
+
+
+def make_workload(sources, clip_count, clip_seconds, seed):
+    rng = random.Random(seed)
+    shortest, longest = clip_seconds
+    clips = []
+    for _ in range(clip_count):
+        source = rng.choice(sources)
+        length = min(rng.randint(shortest, longest), source.duration)
+        start = rng.randint(0, source.duration - length)
+        clips.append((source, start, start + length))
+    return clips
+
+
+def run(args, sources, workdir):
+    from django.conf import settings
+    from django.db import connections
+    from videos.services import YouTubeExtractor
+    from downloads.models import DownloadTask
+    from downloads.services import SegmentDownloader
+    from downloads.file_manager import FileManager
+    from downloads.tasks import process_download_segment
+
+    extractor = FakeExtractor(sources)
+    downloader = FakeDownloader(sources, args.bandwidth)
+    media_root = Path(workdir) / 'media'
+    downloader_settings = dict(
+        settings.YOUTUBE_DOWNLOADER_SETTINGS,
+        EXTRACTION_MODE=args.mode,
+        RANGE_FETCH=args.range_fetch,
+        SPLIT_STAGES=False,
+    )
+
+    with patch.object(YouTubeExtractor, 'get_video_info', extractor.get_video_info), \
+            patch.object(YouTubeExtractor, 'get_stream_urls', extractor.get_stream_urls), \
+            patch.object(SegmentDownloader, 'download_full_video', downloader.download_full_video), \
+            patch.object(SegmentDownloader, 'download_segment_range', downloader.download_segment_range), \
+            patch.object(FileManager, 'TEMP_DIR', media_root / 'temp'), \
+            patch.object(FileManager, 'DOWNLOAD_DIR', media_root / 'downloads'), \
+            patch.object(settings, 'MEDIA_ROOT', media_root), \
+            patch.object(settings, 'YOUTUBE_DOWNLOADER_SETTINGS', downloader_settings):
+        FileManager.ensure_directories()
+        for source in sources:
+            extractor.get_video_info(source.youtube_id)
+
+        tasks = [
+            SegmentDownloader.create_download_task(source.youtube_id, start, end, source.quality, cut_mode=args.cut_mode)
+            for source, start, end in make_workload(sources, args.clips, args.clip_seconds, args.seed)
+        ]
+
+        service_times = {}
+        lock = threading.Lock()
+
+        def work(task_id):
+            started = time.perf_counter()
+            try:
+                process_download_segment(task_id)
+            finally:
+                with lock:
+                    service_times[task_id] = (started, time.perf_counter())
+                connections.close_all()
+
+        queued = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(work, [task.task_id for task in tasks]))
+        wall = time.perf_counter() - queued
+
+        done = {task.task_id: task for task in DownloadTask.objects.filter(pk__in=[task.pk for task in tasks])}
+        completed = [task for task in done.values() if task.status == 'completed']
+        output_bytes = sum(
+            os.path.getsize(FileManager.get_output_path(os.path.basename(task.output_file.name)))
+            for task in completed
+        )
+        stages = {}
+        for task in completed:
+            for stage, seconds in (task.stage_timings or {}).items():
+                stages.setdefault(stage, []).append(seconds)
+
+        return {
+            'wall_seconds': round(wall, 3),
+            'clips': len(tasks),
+            'completed': len(completed),
+            'failed': len(tasks) - len(completed),
+            'errors': sorted({task.error_message for task in done.values() if task.error_message})[:5],
+            'clips_per_second': round(len(completed) / wall, 3),
+            'clip_seconds_per_second': round(sum(task.end_time - task.start_time for task in completed) / wall, 3),
+            'output_bytes': output_bytes,
+            'bytes_per_second': round(output_bytes / wall, 1),
+            'latency_seconds': percentiles([end - queued for _, end in service_times.values()]),
+            'service_seconds': percentiles([end - start for start, end in service_times.values()]),
+            'stages': {
+                stage: dict(percentiles(values), total=round(sum(values), 3))
+                for stage, values in sorted(stages.items())
+            },
+        }
+
+
+def environment():
+    version = subprocess.run([ffmpeg_exe(), '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                            cwd=Path(__file__).resolve().parent).stdout.strip()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': version,
+        'commit': commit or None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clips', type=int, default=50, help="segment tasks to process")
+    parser.add_argument('--concurrency', type=int, default=4, help="tasks processed in parallel (threads)")
+    parser.add_argument('--sources', default='360p:120,720p:120,1080p:60',
+                        help="synthetic sources as resolution:seconds, comma separated")
+    parser.add_argument('--sources-dir', default=str(DEFAULT_SOURCES_DIR), help="where generated sources are kept")
+    parser.add_argument('--clip-seconds', default='5-30', help="range of clip lengths, e.g. 5-30")
+    parser.add_argument('--cut-mode', choices=['copy', 'smart'], default='copy')
+    parser.add_argument('--mode', choices=['download', 'stream', 'pipeline'], default='download',
+                        help="EXTRACTION_MODE to run with")
+    parser.add_argument('--range-fetch', action='store_true', help="fetch only the clip's range (RANGE_FETCH)")
+    parser.add_argument('--bandwidth', type=int, default=0, help="simulated bytes/s per download (0 = disk speed)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random clip set")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    shortest, _, longest = args.clip_seconds.partition('-')
+    args.clip_seconds = (int(shortest), int(longest or shortest))
+
+    setup()
+    from django.db import connection
+    from django.test.utils import setup_databases, teardown_databases
+
+    os.makedirs(args.sources_dir, exist_ok=True)
+    sources = parse_sources(args.sources, args.sources_dir)
+    for source in sources:
+        print(f"Preparing {source.path}", file=sys.stderr)
+        source.ensure()
+
+    workdir = tempfile.mkdtemp(prefix='ysd-pipeline-bench-')
+    if connection.vendor == 'sqlite':
+        # A file shared by the worker threads, waiting on each other's writes
+        connection.settings_dict['TEST']['NAME'] = str(Path(workdir) / 'bench.sqlite3')
+        connection.settings_dict['OPTIONS']['timeout'] = 60
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        print(f"Processing {args.clips} clips with {args.concurrency} threads", file=sys.stderr)
+        results = run(args, sources, workdir)
+    finally:
+        teardown_databases(databases, verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'sources_dir')}
+    report = {'config': config, 'environment': environment(), 'results': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
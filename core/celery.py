@@ -5,4 +5,28 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 app = Celery('ysd')
 app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Stage tasks of split downloads (SPLIT_STAGES): network-bound work goes to the 'download'
+# queue, ffmpeg to the 'cut' queue, so each pool can be sized for its own bottleneck, e.g.
+#   celery -A core worker -Q download -P threads -c 32
+#   celery -A core worker -Q cut -c <number of CPUs>
+# Everything else stays on the default 'celery' queue.
+app.conf.task_routes = {
+    'downloads.tasks.fetch_segment_stage': {'queue': 'download'},
+    'downloads.tasks.finalize_segment_stage': {'queue': 'download'},
+    'downloads.tasks.cut_segment_stage': {'queue': 'cut'},
+}
+# Stages are long-running, don't let a busy worker reserve work another one could start
+app.conf.worker_prefetch_multiplier = 1
+
+# Message priorities set by downloads.scheduler.TaskScheduler (levels 0-9):
+# Redis keeps a list per priority step (0 is consumed first), RabbitMQ needs queues declared with
+# a max priority (the highest number is consumed first). The SQLAlchemy broker ignores both.
+app.conf.broker_transport_options = {
+    **app.conf.broker_transport_options,
+    'priority_steps': list(range(10)),
+    'queue_order_strategy': 'priority',
+}
+app.conf.task_queue_max_priority = 10
+
 app.autodiscover_tasks()
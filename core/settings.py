@@ -70,24 +70,35 @@ TEMPLATES = [
 WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default. DB_ENGINE=postgresql switches to PostgreSQL configured by the DB_* variables
+# (the production profile), with persistent connections reused for DB_CONN_MAX_AGE seconds
+# and checked before reuse so a restarted server doesn't break requests
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'youtube_downloader'),
+            'USER': os.getenv('DB_USER', 'postgres'),
+            'PASSWORD': os.getenv('DB_PASSWORD', 'password'),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            # Behind a transaction-pooling PgBouncer, server-side cursors don't survive between transactions
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER', 'False') == 'True',
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
-
-# For PostgreSQL (uncomment when ready for production)
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': os.getenv('DB_NAME', 'youtube_downloader'),
-#         'USER': os.getenv('DB_USER', 'postgres'),
-#         'PASSWORD': os.getenv('DB_PASSWORD', 'password'),
-#         'HOST': os.getenv('DB_HOST', 'localhost'),
-#         'PORT': os.getenv('DB_PORT', '5432'),
-#     }
-# }
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -144,11 +155,34 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Cache shared by the web process and the Celery workers (progress, counters, lookups).
+# Point CACHE_URL at Redis in any multi-process setup; the local-memory fallback is per process.
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Celery Configuration
-# Use SQLAlchemy (SQLite) broker since redis-server is not running
-CELERY_BROKER_URL = 'sqla+sqlite:///celerydb.sqlite'
-# CELERY_BROKER_TRANSPORT_OPTIONS = {}  # Not needed for SQLA
-CELERY_RESULT_BACKEND = 'django-db'
+# Without CELERY_BROKER_URL the SQLAlchemy (SQLite) broker lets a single machine run without Redis,
+# but every enqueue and poll then hits a SQLite file: use Redis (redis://...) or RabbitMQ
+# (amqp://...) for anything beyond a few tasks per second (python -m benchmarks.broker_throughput)
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'sqla+sqlite:///celerydb.sqlite')
+# Task state and progress live in DownloadTask, so Celery results are only stored when asked for:
+# CELERY_STORE_RESULTS=True for every task, apply_async(..., ignore_result=False) for a single one.
+# 'django-db' keeps them in the database, redis://... next to the broker
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'django-db')
+CELERY_TASK_IGNORE_RESULT = os.getenv('CELERY_STORE_RESULTS', 'False') != 'True'
+CELERY_RESULT_EXPIRES = int(os.getenv('CELERY_RESULT_EXPIRES', 86400))  # seconds
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -164,6 +198,90 @@ YOUTUBE_DOWNLOADER_SETTINGS = {
     'TEMP_VIDEO_DIR': BASE_DIR / 'media/temp_videos',
     'DOWNLOAD_DIR': BASE_DIR / 'media/downloads',
     'MAX_SEGMENT_SIZE': 1024 * 1024 * 1024 * 10,  # 10GB - greatly increased
+    # Admission control: new tasks are refused (503, or 429 for the per-client limit, with
+    # Retry-After) instead of failing late. 0 disables a limit.
+    'MAX_QUEUE_DEPTH': int(os.getenv('MAX_QUEUE_DEPTH', '1000')),  # pending + processing tasks
+    'MAX_CLIENT_IN_FLIGHT': int(os.getenv('MAX_CLIENT_IN_FLIGHT', '20')),  # pending + processing tasks per client
+    'MIN_FREE_DISK_BYTES': 1024 * 1024 * 1024 * 2,  # 2GB left on MEDIA_ROOT after all in-flight work
+    'ADMISSION_DISK_FACTOR': 2,  # disk used per estimated byte (fetched source + output)
+    'ADMISSION_RETRY_AFTER': 30,  # seconds
     'ALLOWED_FORMATS': ['mp4', 'webm', 'mp3'],
     'MAX_DURATION': 7200,  # 2 hours in seconds
+    # Fetch only the part of the source covering the requested segment
+    # (falls back to a full download for formats that can't be partially fetched)
+    'RANGE_FETCH': os.getenv('RANGE_FETCH', 'True') == 'True',
+    'RANGE_FETCH_PADDING': 5,  # seconds added on each side to include the preceding keyframe
+    # 'download': fetch the source to media/temp, then cut it
+    # 'stream': let ffmpeg cut directly from the resolved media URLs (no temp file)
+    # 'pipeline': download the full source, but cut as soon as the segment is on disk
+    'EXTRACTION_MODE': os.getenv('EXTRACTION_MODE', 'download'),
+    # Pipelined mode: keep downloading the rest of the source into the source cache once the clip
+    # is done (False stops the download), and seconds past end_time to wait for before cutting
+    'PIPELINE_CONTINUE_DOWNLOAD': os.getenv('PIPELINE_CONTINUE_DOWNLOAD', 'True') == 'True',
+    'PIPELINE_READY_MARGIN': 2,
+    # Run each download as chained fetch -> cut -> finalize tasks on the 'download' and 'cut' queues
+    # (see core/celery.py) instead of one task; needs workers consuming both queues
+    'SPLIT_STAGES': os.getenv('SPLIT_STAGES', 'False') == 'True',
+    # x264 settings for the edges re-encoded by smart cuts (cut_mode='smart')
+    'SMART_CUT_PRESET': 'veryfast',
+    'SMART_CUT_CRF': 18,
+    # Fragments (DASH/HLS) a download fetches in parallel, and the budget shared by every download
+    # running on one worker host: total parallel fragments and total bandwidth (bytes/s, 0 = unlimited).
+    # ffmpeg transfers (pipelined downloads, stream cuts) hold a share but can't be rate-limited
+    'CONCURRENT_FRAGMENTS': int(os.getenv('CONCURRENT_FRAGMENTS', 4)),
+    'WORKER_MAX_FRAGMENTS': int(os.getenv('WORKER_MAX_FRAGMENTS', 16)),
+    'WORKER_MAX_BANDWIDTH': int(os.getenv('WORKER_MAX_BANDWIDTH', 0)),
+    # Plain HTTP formats are downloaded as range requests of this many bytes (0 = one request)
+    'HTTP_CHUNK_SIZE': 1024 * 1024 * 10,  # 10MB
+    # Scheduling of new tasks: shortest (estimated) job first, pushed back by the number of tasks the
+    # same client has in flight, with cached sources skipping the download cost. Priorities need a broker
+    # that supports them (Redis, RabbitMQ); None detects it from CELERY_BROKER_URL, other brokers stay FIFO
+    'SCHEDULER_PRIORITIES': None,
+    'SCHEDULER_BANDWIDTH': 1024 * 1024 * 5,  # download speed (bytes/s) assumed until workers observed one
+    'SCHEDULER_BYTES_PER_SECOND': 250000,  # bytes per clip second assumed when a task has no size estimate
+    # Weight of the latest observation in the moving averages of download speed and cut cost
+    # used to predict task durations
+    'ESTIMATE_SMOOTHING': 0.2,
+    # Serve identical segment requests from an already completed task's output
+    'RESULT_CACHE': os.getenv('RESULT_CACHE', 'True') == 'True',
+    'RESULT_CACHE_TTL': 86400,  # seconds a request key stays mapped to a completed task
+    # Max seconds a task waits for another worker that is downloading the same source
+    'SOURCE_LOCK_TIMEOUT': 3600,
+    # Byte budget for full source videos kept in media/temp and how to pick what to evict ('lru' or 'lfu')
+    'SOURCE_CACHE_MAX_BYTES': int(os.getenv('SOURCE_CACHE_MAX_BYTES', 1024 * 1024 * 1024 * 20)),  # 20GB
+    'SOURCE_CACHE_POLICY': os.getenv('SOURCE_CACHE_POLICY', 'lru'),
+    # Sources pinned by a task waiting to cut them are not evicted; after this many seconds
+    # the pin is considered left behind by a lost task
+    'SOURCE_PIN_TIMEOUT': int(os.getenv('SOURCE_PIN_TIMEOUT', 6 * 3600)),
+    # Seconds extracted video metadata (duration, formats) is reused before yt-dlp runs again
+    'METADATA_CACHE_TTL': int(os.getenv('METADATA_CACHE_TTL', 3600)),
+    # Max number of ranges accepted by a single /api/download-batch/ request
+    'MAX_BATCH_SEGMENTS': 50,
+    # Max number of task ids accepted by one bulk /api/task-status/ request
+    'MAX_STATUS_TASK_IDS': 500,
+    # Progress from yt-dlp hooks is published to the cache at most every PROGRESS_MIN_INTERVAL seconds
+    # unless it moved by PROGRESS_MIN_DELTA percent; only stage transitions are written to the database
+    'PROGRESS_MIN_INTERVAL': 1.0,
+    'PROGRESS_MIN_DELTA': 5,
+    'PROGRESS_CACHE_TTL': 3600,
+    # Server-Sent Events task stream (/api/task-events/): cache poll period, how often the database is
+    # re-checked in case the cache isn't shared with the workers, keep-alive period and stream lifetime
+    'SSE_POLL_INTERVAL': 0.5,
+    'SSE_DB_REFRESH_INTERVAL': 10,
+    'SSE_KEEPALIVE_INTERVAL': 15,
+    'SSE_MAX_DURATION': 300,
+    # Bearer token required to scrape /metrics (Prometheus); empty leaves the endpoint open
+    'METRICS_TOKEN': os.getenv('METRICS_TOKEN', ''),
+    # cProfile runs (stored as downloads.Profile, downloadable in the admin): the share of tasks, extractions
+    # and API requests profiled at random, the X-Profile header value that enables it for anyone (staff users
+    # can always send X-Profile: 1), and how long profiles are kept
+    'PROFILE_SAMPLE_RATE': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    'PROFILE_TOKEN': os.getenv('PROFILE_TOKEN', ''),
+    'PROFILE_RETENTION': 7 * 86400,  # seconds
+    # Who sends completed files from /api/download/<task_id>/: 'sendfile' (Django, with sendfile under
+    # WSGI servers that support it), 'x-accel' (nginx X-Accel-Redirect to an internal location at
+    # DOWNLOAD_ACCEL_PREFIX aliasing MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd X-Sendfile)
+    'DOWNLOAD_SERVE_MODE': os.getenv('DOWNLOAD_SERVE_MODE', 'sendfile'),
+    'DOWNLOAD_ACCEL_PREFIX': os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-media/'),
+    'DOWNLOAD_BLOCK_SIZE': 1024 * 1024,  # bytes read per chunk when Django streams the file itself
 }
\ No newline at end of file
@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
+from api.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -10,6 +11,8 @@ urlpatterns = [
     path('videos/', include('videos.urls')),
     path('downloads/', include('downloads.urls')),
     path('accounts/', include('accounts.urls')),
+    # Prometheus scrape target
+    path('metrics', metrics, name='metrics'),
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
 ]
 
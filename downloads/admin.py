@@ -1,9 +1,51 @@
 from django.contrib import admin
-from .models import DownloadTask
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from .models import DownloadTask, CachedSource, Profile
 
 @admin.register(DownloadTask)
 class DownloadTaskAdmin(admin.ModelAdmin):
     list_display = ('task_id', 'video', 'start_time', 'end_time', 'quality', 'status', 'progress', 'created_at')
     list_filter = ('status', 'quality')
     search_fields = ('task_id', 'video__title')
-    readonly_fields = ('task_id', 'created_at', 'completed_at')
+    readonly_fields = ('task_id', 'created_at', 'started_at', 'completed_at', 'stage_timings', 'downloaded_bytes', 'output_size')
+
+
+@admin.register(CachedSource)
+class CachedSourceAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'youtube_id', 'quality', 'size_bytes', 'hit_count', 'pins', 'last_accessed')
+    list_filter = ('quality',)
+    search_fields = ('filename', 'youtube_id')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'task_id', 'duration', 'path', 'created_at', 'download_link')
+    list_filter = ('name',)
+    search_fields = ('task_id', 'path')
+    readonly_fields = ('name', 'task_id', 'path', 'duration', 'created_at', 'download_link', 'summary')
+    exclude = ('stats',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download), name='downloads_profile_download'),
+        ] + super().get_urls()
+
+    @admin.display(description="Profile")
+    def download_link(self, obj):
+        return format_html('<a href="{}">.prof</a>', reverse('admin:downloads_profile_download', args=[obj.pk]))
+
+    def download(self, request, pk):
+        """The pstats dump, e.g. for `python -m pstats` or snakeviz"""
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(Profile, pk=pk)
+        response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile.name}-{profile.task_id or profile.pk}.prof"'
+        return response
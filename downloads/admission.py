@@ -0,0 +1,80 @@
+import shutil
+import logging
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from .models import DownloadTask
+from .metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """New work can't be accepted right now; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Refuse new tasks early instead of letting them fail late.
+
+    Checked before a task is created (one aggregate query over in-flight tasks):
+    - queue depth: pending + processing tasks against MAX_QUEUE_DEPTH (503);
+    - per client: the client's in-flight tasks against MAX_CLIENT_IN_FLIGHT (429);
+    - disk: free space on MEDIA_ROOT minus the estimated bytes of all in-flight
+      work (ADMISSION_DISK_FACTOR times their estimated size, for the fetched
+      source plus the output) must stay above MIN_FREE_DISK_BYTES (503).
+    A limit of 0 disables its check.
+    """
+
+    ACTIVE_STATUSES = ('pending', 'processing')
+
+    @staticmethod
+    def _settings():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS
+
+    @staticmethod
+    def free_disk_bytes():
+        path = Path(settings.MEDIA_ROOT)
+        # MEDIA_ROOT is only created with the first download
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        return shutil.disk_usage(path).free
+
+    @classmethod
+    def _reject(cls, reason, message, status_code):
+        Counters.incr(f'admission_rejected_{reason}')
+        logger.info(f"Rejected new work: {message}")
+        raise AdmissionRejected(message, status_code, cls._settings().get('ADMISSION_RETRY_AFTER', 30))
+
+    @classmethod
+    def check(cls, client_id, estimated_size=0, count=1):
+        """Raise AdmissionRejected unless `count` new tasks of `estimated_size` bytes in total can be accepted"""
+        limits = cls._settings()
+        max_depth = limits.get('MAX_QUEUE_DEPTH', 1000)
+        max_client = limits.get('MAX_CLIENT_IN_FLIGHT', 20)
+        min_free = limits.get('MIN_FREE_DISK_BYTES', 0)
+        disk_factor = limits.get('ADMISSION_DISK_FACTOR', 2)
+
+        in_flight = DownloadTask.objects.filter(status__in=cls.ACTIVE_STATUSES).aggregate(
+            total=Count('id'),
+            client=Count('id', filter=Q(client_id=client_id)),
+            reserved=Sum('estimated_size'),
+        )
+
+        if max_depth and in_flight['total'] + count > max_depth:
+            cls._reject('queue', f"Queue is full ({in_flight['total']} tasks in flight)", 503)
+
+        if max_client and client_id and in_flight['client'] + count > max_client:
+            cls._reject(
+                'client', f"Too many tasks in flight for this client (limit {max_client})", 429
+            )
+
+        if min_free:
+            needed = ((in_flight['reserved'] or 0) + estimated_size) * disk_factor
+            if cls.free_disk_bytes() - needed < min_free:
+                cls._reject('disk', "Not enough free disk space for new work", 503)
@@ -0,0 +1,126 @@
+import os
+import time
+import uuid
+import tempfile
+import logging
+from pathlib import Path
+from django.conf import settings
+from .locks import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadBudget:
+    """
+    Share fragment concurrency and bandwidth between the downloads running on one worker host.
+
+    Every running download holds a lease: a locked file in a host-local
+    directory, so every Celery process on the host sees it and a crashed
+    process' lease disappears with its lock. A download gets an equal share of
+    WORKER_MAX_FRAGMENTS (capped at CONCURRENT_FRAGMENTS) and of
+    WORKER_MAX_BANDWIDTH. Bandwidth shares of plain HTTP downloads are
+    rebalanced while they run, so a long job gives way to the ones started after it.
+    ffmpeg transfers hold a lease too, but only yt-dlp applies the shares.
+    """
+
+    LEASE_DIR = Path(tempfile.gettempdir()) / 'ysd-download-leases'
+    # An unlocked lease younger than this may be one whose process hasn't locked it yet
+    STALE_AFTER = 60
+
+    def __init__(self, lease_dir=None):
+        self.lease_dir = Path(lease_dir or self.LEASE_DIR)
+        self.lease_path = None
+        self._lease = None
+        self._rebalanced_at = 0.0
+
+    @staticmethod
+    def limits():
+        downloader_settings = settings.YOUTUBE_DOWNLOADER_SETTINGS
+        return (
+            downloader_settings.get('CONCURRENT_FRAGMENTS', 4),
+            downloader_settings.get('WORKER_MAX_FRAGMENTS', 16),
+            downloader_settings.get('WORKER_MAX_BANDWIDTH', 0),
+        )
+
+    def __enter__(self):
+        os.makedirs(self.lease_dir, exist_ok=True)
+        self.lease_path = self.lease_dir / f"{uuid.uuid4().hex}.lease"
+        self._lease = FileLock(self.lease_path)
+        self._lease.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lease.release()
+        try:
+            os.remove(self.lease_path)
+        except OSError:
+            pass
+
+    def active_downloads(self):
+        """Number of leases currently held on this host (ours included); stale leases are removed"""
+        active = 1
+        for filename in os.listdir(self.lease_dir):
+            path = self.lease_dir / filename
+            if path == self.lease_path:
+                continue
+            if FileLock.held(path):
+                active += 1
+                continue
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                # Released and removed meanwhile
+                continue
+            if age < self.STALE_AFTER:
+                # Just created (not locked yet) or just released, count it rather than removing a live lease
+                active += 1
+                continue
+            # Nobody holds it: left behind by a process that died
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return active
+
+    def shares(self):
+        """(fragment downloads, bandwidth in bytes/s or None) this download may use right now"""
+        per_download, max_fragments, max_bandwidth = self.limits()
+        active = self.active_downloads()
+        fragments = max(1, min(per_download, max_fragments // active))
+        bandwidth = max(1, max_bandwidth // active) if max_bandwidth else None
+        return fragments, bandwidth
+
+    def ydl_options(self):
+        """yt-dlp options applying this download's share"""
+        fragments, bandwidth = self.shares()
+        options = {'concurrent_fragment_downloads': fragments}
+        if bandwidth:
+            # yt-dlp applies the rate limit to each connection, fragments download in parallel
+            options['ratelimit'] = max(1, bandwidth // fragments)
+        chunk_size = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('HTTP_CHUNK_SIZE', 0)
+        if chunk_size:
+            # Plain HTTP formats are fetched as a sequence of range requests
+            options['http_chunk_size'] = chunk_size
+        return options
+
+    def rebalance_hook(self, params, interval=5.0):
+        """
+        yt-dlp progress hook updating the bandwidth share in `params` (the running YoutubeDL's params).
+
+        Plain HTTP downloads read 'ratelimit' from these params on every
+        throttling check, so they switch to the new share (all of it, being a
+        single connection) right away. Fragmented downloads work on a copy of
+        the params and keep the share they started with.
+        """
+        def hook(d):
+            if d.get('status') != 'downloading' or 'fragment_index' in d or not self.limits()[2]:
+                return
+            now = time.monotonic()
+            if now - self._rebalanced_at < interval:
+                return
+            self._rebalanced_at = now
+            _, bandwidth = self.shares()
+            if params.get('ratelimit') != bandwidth:
+                logger.debug(f"Bandwidth share changed to {bandwidth} B/s")
+                params['ratelimit'] = bandwidth
+        return hook
@@ -0,0 +1,118 @@
+import hashlib
+import os
+from django.conf import settings
+from django.core.cache import cache
+from .models import DownloadTask
+from .metrics import Counters
+
+
+class ResultCache:
+    """
+    Reuse completed segment outputs for identical requests.
+
+    A request is identified by (youtube_id, start_time, end_time, quality, cut_mode). The
+    cache maps that key to the task_id of a completed DownloadTask whose output
+    file is still on disk, with the database as the source of truth when the
+    key isn't cached yet.
+    """
+
+    KEY_PREFIX = 'ysd:result:'
+
+    @staticmethod
+    def make_key(youtube_id, start_time, end_time, quality, cut_mode='copy'):
+        """Content address of a segment request"""
+        raw = f"{youtube_id}:{int(start_time)}:{int(end_time)}:{quality}"
+        if cut_mode != 'copy':
+            # Copy-mode keys keep their original form so existing entries stay valid
+            raw += f":{cut_mode}"
+        return ResultCache.KEY_PREFIX + hashlib.sha1(raw.encode()).hexdigest()
+
+    @staticmethod
+    def is_enabled():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('RESULT_CACHE', True)
+
+    @staticmethod
+    def _output_exists(task):
+        return bool(task.output_file) and os.path.exists(task.output_file.path)
+
+    @classmethod
+    def _find_completed(cls, key, youtube_id, start_time, end_time, quality, cut_mode):
+        task_id = cache.get(key)
+        if task_id:
+            task = DownloadTask.objects.filter(task_id=task_id, status='completed').select_related('video').first()
+            if task:
+                return task
+
+        return (
+            DownloadTask.objects
+            .filter(
+                video__youtube_id=youtube_id,
+                start_time=start_time,
+                end_time=end_time,
+                quality=quality,
+                cut_mode=cut_mode,
+                status='completed',
+            )
+            .exclude(output_file='')
+            .exclude(output_file__isnull=True)
+            .select_related('video')
+            .order_by('-completed_at')
+            .first()
+        )
+
+    @classmethod
+    def lookup(cls, youtube_id, start_time, end_time, quality, cut_mode='copy'):
+        """Return a completed DownloadTask for the same segment whose file still exists, or None"""
+        if not cls.is_enabled():
+            return None
+
+        key = cls.make_key(youtube_id, start_time, end_time, quality, cut_mode)
+        task = cls._find_completed(key, youtube_id, start_time, end_time, quality, cut_mode)
+
+        if task and cls._output_exists(task):
+            cache.set(key, str(task.task_id), cls._timeout())
+            Counters.incr('result_cache_hits')
+            return task
+
+        if task:
+            # The output was cleaned up behind our back
+            cls.evict(youtube_id, start_time, end_time, quality, cut_mode)
+
+        Counters.incr('result_cache_misses')
+        return None
+
+    @classmethod
+    def store(cls, task):
+        """Remember a freshly completed task as the result for its segment"""
+        if not cls.is_enabled():
+            return
+        key = cls.make_key(task.video.youtube_id, task.start_time, task.end_time, task.quality, task.cut_mode)
+        cache.set(key, str(task.task_id), cls._timeout())
+
+    @classmethod
+    def evict(cls, youtube_id, start_time, end_time, quality, cut_mode='copy'):
+        """Drop the cache entry and unlink the missing output from the completed tasks that pointed at it"""
+        cache.delete(cls.make_key(youtube_id, start_time, end_time, quality, cut_mode))
+        DownloadTask.objects.filter(
+            video__youtube_id=youtube_id,
+            start_time=start_time,
+            end_time=end_time,
+            quality=quality,
+            cut_mode=cut_mode,
+            status='completed',
+        ).update(output_file=None)
+        Counters.incr('result_cache_evictions')
+
+    @staticmethod
+    def _timeout():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('RESULT_CACHE_TTL', 86400)
+
+    @staticmethod
+    def stats():
+        counters = Counters.get_many('result_cache_hits', 'result_cache_misses', 'result_cache_evictions')
+        return {
+            'hits': counters['result_cache_hits'],
+            'misses': counters['result_cache_misses'],
+            'evictions': counters['result_cache_evictions'],
+            'hit_ratio': Counters.ratio(counters['result_cache_hits'], counters['result_cache_misses']),
+        }
@@ -0,0 +1,159 @@
+import re
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class SizeEstimator:
+    """
+    Estimate the size of a segment from the bitrates of the streams it will be cut from.
+
+    At extraction time every quality of a video is resolved the way the
+    downloader's format selector resolves it (best mp4 video at or below the
+    height, plus the best m4a audio for video-only formats) and its total
+    bitrate in bytes/s is stored in VideoInfo.bitrates. Estimating a segment
+    is then a dict lookup times the clip length.
+
+    A format's bitrate comes from yt-dlp's tbr, vbr + abr, or filesize /
+    filesize_approx over the duration, in that order. Qualities without any
+    of these use typical bitrates for their height.
+    """
+
+    # Typical kbit/s of YouTube mp4 (H.264 video + 128k AAC audio) by height, for formats without bitrate info
+    TYPICAL_KBPS = {144: 230, 240: 380, 360: 630, 480: 1130, 720: 2630, 1080: 4630, 1440: 10130, 2160: 20130}
+
+    @staticmethod
+    def format_bitrate(fmt, duration):
+        """Bytes/s of one yt-dlp format (0 when unknown)"""
+        kbps = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+        if kbps:
+            return kbps * 1000 / 8
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size and duration:
+            return size / duration
+        return 0
+
+    @staticmethod
+    def height_of(quality):
+        match = re.fullmatch(r'(\d+)p', quality or '')
+        return int(match.group(1)) if match else None
+
+    @classmethod
+    def typical_bitrate(cls, height):
+        """Typical bytes/s of the closest known height at or below `height`"""
+        known = [known for known in cls.TYPICAL_KBPS if known <= height]
+        return cls.TYPICAL_KBPS[max(known) if known else min(cls.TYPICAL_KBPS)] * 1000 // 8
+
+    @classmethod
+    def bitrate_table(cls, formats, duration, audio_bitrate=0):
+        """
+        {quality or format_id: bytes/s} for the kept formats of a video.
+
+        `audio_bitrate` is the bytes/s of the audio stream merged into video-only formats.
+        """
+        table = {}
+        rates = []
+        for fmt in formats:
+            rate = cls.format_bitrate(fmt, duration)
+            if rate and not fmt.get('has_audio', True):
+                rate += audio_bitrate
+            table[fmt['format_id']] = int(rate)
+            rates.append((cls.height_of(fmt.get('quality')), rate))
+
+        for fmt in formats:
+            quality = fmt.get('quality')
+            height = cls.height_of(quality)
+            if height is None or quality in table:
+                continue
+            # The downloader takes the best stream at or below the height
+            candidates = [rate for fmt_height, rate in rates if fmt_height and fmt_height <= height and rate]
+            table[quality] = int(max(candidates)) if candidates else 0
+
+        known = [rate for rate in table.values() if rate]
+        table['best'] = max(known) if known else 0
+        return table
+
+    @classmethod
+    def bitrate(cls, video_info, quality):
+        """Bytes/s of `quality` for a VideoInfo, from its precomputed table when it has one"""
+        table = video_info.bitrates
+        if not table:
+            formats = [fmt.to_dict() for fmt in video_info.formats.all()]
+            table = cls.bitrate_table(formats, video_info.duration)
+        rate = table.get(quality)
+        if not rate:
+            height = cls.height_of(quality)
+            if height is None and quality == 'best':
+                height = max((cls.height_of(quality) or 0 for quality in table), default=0)
+            rate = cls.typical_bitrate(height) if height else 0
+        return rate
+
+    @classmethod
+    def estimate_size(cls, video_info, start, end, quality):
+        """Estimated bytes of the start..end segment (0 when the quality is unknown)"""
+        return int(cls.bitrate(video_info, quality) * max(end - start, 0))
+
+
+class ThroughputEstimator:
+    """
+    Predict how long a task takes from the throughput workers actually observed.
+
+    Workers report every download (bytes, seconds) and every cut (clip seconds,
+    seconds) and the estimator keeps an exponentially weighted moving average
+    of each in the shared cache: download speed in bytes/s and cut cost in
+    processing seconds per clip second, per cut mode. Until something was
+    observed the configured SCHEDULER_BANDWIDTH and DEFAULT_CUT_COST are used.
+    Concurrent updates may drop an observation, which is fine for an average.
+    """
+
+    KEY_PREFIX = 'ysd:throughput:'
+
+    # Seconds of processing per second of clip for the cut itself
+    DEFAULT_CUT_COST = {'copy': 0.02, 'smart': 0.5}
+
+    @staticmethod
+    def _smoothing():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('ESTIMATE_SMOOTHING', 0.2)
+
+    @classmethod
+    def _observe(cls, name, value):
+        key = cls.KEY_PREFIX + name
+        previous = cache.get(key)
+        if previous is not None:
+            alpha = cls._smoothing()
+            value = alpha * value + (1 - alpha) * previous
+        cache.set(key, value, timeout=None)
+
+    @classmethod
+    def observe_download(cls, size, seconds):
+        if size > 0 and seconds > 0:
+            cls._observe('download', size / seconds)
+
+    @classmethod
+    def observe_cut(cls, cut_mode, clip_seconds, seconds):
+        if clip_seconds > 0 and seconds >= 0:
+            cls._observe(f'cut:{cut_mode}', seconds / clip_seconds)
+
+    @classmethod
+    def download_rate(cls):
+        """Observed download speed in bytes/s"""
+        rate = cache.get(cls.KEY_PREFIX + 'download')
+        return rate or settings.YOUTUBE_DOWNLOADER_SETTINGS.get('SCHEDULER_BANDWIDTH', 1024 * 1024 * 5)
+
+    @classmethod
+    def cut_cost(cls, cut_mode):
+        """Observed processing seconds per clip second for a cut mode"""
+        cost = cache.get(f'{cls.KEY_PREFIX}cut:{cut_mode}')
+        if cost is None:
+            cost = cls.DEFAULT_CUT_COST.get(cut_mode, cls.DEFAULT_CUT_COST['copy'])
+        return cost
+
+    @classmethod
+    def predict(cls, size, clip_seconds, cut_mode='copy', source_cached=False):
+        """Predicted seconds to download `size` bytes (unless the source is cached) and cut the clip"""
+        seconds = clip_seconds * cls.cut_cost(cut_mode)
+        if not source_cached:
+            seconds += size / cls.download_rate()
+        return seconds
@@ -20,12 +20,23 @@ class FileManager:
         """Generate unique temp file path"""
         cls.ensure_directories()
         return cls.TEMP_DIR / f"{youtube_id}_{quality}.mp4"
-    
+
+    @classmethod
+    def get_range_temp_path(cls, youtube_id, quality, start, end, task_id):
+        """Generate temp file path for a partially downloaded (ranged) source"""
+        # Ranged sources belong to a single task, so the task id keeps concurrent tasks apart
+        cls.ensure_directories()
+        return cls.TEMP_DIR / f"{youtube_id}_{quality}_{start}_{end}_{task_id}.range.mp4"
+
     @classmethod
-    def get_output_filename(cls, youtube_id, start, end, quality):
+    def get_output_filename(cls, youtube_id, start, end, quality, cut_mode='copy'):
         """Generate output filename for segment"""
-        # Format: youtubeID_startTime_endTime.mp4
-        return f"{youtube_id}_{start}_{end}.mp4"
+        # Format: youtubeID_startTime_endTime_quality.mp4 (plus _smart for smart cuts)
+        # Quality is part of the name so identical requests map to the same file and different
+        # qualities of the same segment don't overwrite each other
+        if cut_mode != 'copy':
+            return f"{youtube_id}_{start}_{end}_{quality}_{cut_mode}.mp4"
+        return f"{youtube_id}_{start}_{end}_{quality}.mp4"
         
     @classmethod
     def get_output_path(cls, filename):
@@ -52,13 +63,15 @@ class FileManager:
                 pass
 
     @classmethod
-    def cleanup_old_temp_files(cls, max_age_seconds=86400):
-        """Cleanup files in TEMP_DIR older than max_age_seconds"""
+    def cleanup_old_temp_files(cls, max_age_seconds=86400, exclude=()):
+        """Cleanup files in TEMP_DIR older than max_age_seconds, except the names in exclude"""
         import time
         now = time.time()
         cls.ensure_directories()
         
         for filename in os.listdir(cls.TEMP_DIR):
+            if filename in exclude:
+                continue
             file_path = os.path.join(cls.TEMP_DIR, filename)
             if os.stat(file_path).st_mtime < now - max_age_seconds:
                 cls.delete_file(file_path)
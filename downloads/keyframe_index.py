@@ -0,0 +1,339 @@
+import os
+import sys
+import struct
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from .file_manager import FileManager
+
+logger = logging.getLogger(__name__)
+
+
+class KeyframeIndex:
+    """
+    Keyframe timestamp -> byte offset table of a source video, stored next to it.
+
+    The table is built once per source (from the mp4 sample tables, or by
+    listing packets with ffmpeg for other containers, in which case offsets are
+    unknown and stored as -1) and saved as a compact binary sidecar:
+    a header followed by two parallel arrays of float64 timestamps and int64
+    offsets sorted by timestamp. Lookups by timestamp are binary searches.
+
+    The sidecar records the size and mtime of the source it was built from, so
+    a replaced source never serves a stale index.
+    """
+
+    SUFFIX = '.kfi'
+    MAGIC = b'KFI1'
+    # magic, source size, source mtime (ns), keyframe count, codec name
+    HEADER = struct.Struct('<4sqqI16s')
+
+    def __init__(self, timestamps, offsets, codec=None):
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.codec = codec
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def path_for(cls, source_path):
+        return f"{source_path}{cls.SUFFIX}"
+
+    @staticmethod
+    def _fingerprint(source_path):
+        stat = os.stat(source_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @classmethod
+    def load(cls, source_path):
+        """Return the saved index of source_path, or None when missing or stale"""
+        index_path = cls.path_for(source_path)
+        try:
+            with open(index_path, 'rb') as f:
+                magic, size, mtime_ns, count, codec = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                if magic != cls.MAGIC or (size, mtime_ns) != cls._fingerprint(source_path):
+                    return None
+                timestamps = array('d')
+                offsets = array('q')
+                timestamps.fromfile(f, count)
+                offsets.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        if sys.byteorder == 'big':
+            timestamps.byteswap()
+            offsets.byteswap()
+        return cls(timestamps, offsets, codec.rstrip(b'\0').decode() or None)
+
+    def save(self, source_path):
+        size, mtime_ns = self._fingerprint(source_path)
+        timestamps = array('d', self.timestamps)
+        offsets = array('q', self.offsets)
+        if sys.byteorder == 'big':
+            timestamps.byteswap()
+            offsets.byteswap()
+
+        index_path = self.path_for(source_path)
+        part_path = f"{index_path}.part"
+        with open(part_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, size, mtime_ns, len(timestamps), (self.codec or '').encode()[:16]))
+            timestamps.tofile(f)
+            offsets.tofile(f)
+        os.replace(part_path, index_path)
+
+    @classmethod
+    def build(cls, source_path):
+        """Scan source_path, save its index next to it and return it"""
+        try:
+            codec, keyframes = Mp4SampleTable.keyframes(source_path)
+        except ValueError as e:
+            # Not a (progressive) mp4: list the packets with ffmpeg, byte offsets stay unknown
+            from .services import SegmentDownloader
+            logger.info(f"Indexing {source_path} with ffmpeg ({e})")
+            codec, times = SegmentDownloader.probe_keyframes(source_path, 0, None)
+            keyframes = [(time, -1) for time in times]
+
+        keyframes.sort()
+        index = cls(
+            array('d', (time for time, _ in keyframes)),
+            array('q', (offset for _, offset in keyframes)),
+            codec
+        )
+        index.save(source_path)
+        return index
+
+    @classmethod
+    def get(cls, source_path, build=True):
+        """Saved index of source_path, built on first use; None when it can't be indexed"""
+        index = cls.load(source_path)
+        if index is None and build and os.path.exists(source_path):
+            try:
+                index = cls.build(source_path)
+            except Exception as e:
+                logger.warning(f"Could not index keyframes of {source_path}: {e}")
+        return index
+
+    @classmethod
+    def invalidate(cls, source_path):
+        FileManager.delete_file(cls.path_for(source_path))
+
+    def keyframe_before(self, time):
+        """(timestamp, offset) of the last keyframe at or before time, or None"""
+        position = bisect_right(self.timestamps, time + 1e-6)
+        if position == 0:
+            return None
+        return self.timestamps[position - 1], self.offsets[position - 1]
+
+    def keyframe_after(self, time):
+        """(timestamp, offset) of the first keyframe at or after time, or None"""
+        position = bisect_left(self.timestamps, time - 1e-6)
+        if position == len(self.timestamps):
+            return None
+        return self.timestamps[position], self.offsets[position]
+
+    def between(self, start_time, end_time):
+        """Keyframe timestamps within start_time..end_time"""
+        low = bisect_left(self.timestamps, start_time - 1e-6)
+        high = bisect_right(self.timestamps, end_time + 1e-6)
+        return list(self.timestamps[low:high])
+
+    def byte_range(self, start_time, end_time):
+        """
+        Bytes of the source needed to decode start_time..end_time:
+        (offset of the keyframe at/before start_time, offset of the first keyframe after end_time).
+        Either side is None when it isn't known (before the first / after the last keyframe).
+        """
+        first = self.keyframe_before(start_time)
+        last = self.keyframe_after(end_time)
+        return (
+            first[1] if first and first[1] >= 0 else None,
+            last[1] if last and last[1] >= 0 else None,
+        )
+
+
+class Mp4SampleTable:
+    """Minimal ISO-BMFF reader extracting the keyframes of the first video track"""
+
+    # Sample entry types of the video codecs we know by name
+    CODECS = {
+        b'avc1': 'h264', b'avc3': 'h264',
+        b'hvc1': 'hevc', b'hev1': 'hevc',
+        b'vp09': 'vp9', b'av01': 'av1',
+    }
+
+    @staticmethod
+    def _boxes(data, start=0, end=None):
+        """Yield (type, payload_start, payload_end) of the boxes in data[start:end]"""
+        end = len(data) if end is None else end
+        position = start
+        while position + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', data, position)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', data, position + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - position
+            if size < header:
+                raise ValueError("corrupt box")
+            yield box_type, position + header, min(position + size, end)
+            position += size
+
+    @classmethod
+    def _read_moov(cls, path):
+        """Walk the top-level boxes of the file (without reading mdat) and return the moov payload"""
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError("no moov box")
+                size, box_type = struct.unpack('>I4s', header)
+                header_size = 8
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                    header_size = 16
+                elif size == 0:
+                    if box_type != b'moov':
+                        raise ValueError("no moov box")
+                    return f.read()
+                if box_type == b'moov':
+                    return f.read(size - header_size)
+                if size < header_size:
+                    raise ValueError("corrupt box")
+                f.seek(size - header_size, os.SEEK_CUR)
+
+    @classmethod
+    def _children(cls, data, start, end):
+        return {box_type: (payload_start, payload_end) for box_type, payload_start, payload_end in cls._boxes(data, start, end)}
+
+    @staticmethod
+    def _table(data, start, count, typecode, width=1):
+        """Big-endian table of count*width entries following a full box header"""
+        table = array(typecode)
+        table.frombytes(data[start:start + count * width * table.itemsize])
+        if sys.byteorder == 'little':
+            table.byteswap()
+        return table
+
+    @classmethod
+    def keyframes(cls, path):
+        """Return (codec, [(timestamp, byte_offset), ...]) for the keyframes of the first video track"""
+        moov = cls._read_moov(path)
+        top = cls._children(moov, 0, len(moov))
+        if b'mvex' in top:
+            raise ValueError("fragmented mp4")
+
+        movie_timescale = 1
+        if b'mvhd' in top:
+            start, _ = top[b'mvhd']
+            version = moov[start]
+            movie_timescale = struct.unpack_from('>I', moov, start + (20 if version == 1 else 12))[0] or 1
+
+        for box_type, trak_start, trak_end in cls._boxes(moov):
+            if box_type != b'trak':
+                continue
+            trak = cls._children(moov, trak_start, trak_end)
+            if b'mdia' not in trak:
+                continue
+            mdia = cls._children(moov, *trak[b'mdia'])
+            if b'hdlr' not in mdia or moov[mdia[b'hdlr'][0] + 8:mdia[b'hdlr'][0] + 12] != b'vide':
+                continue
+            return cls._track_keyframes(moov, trak, mdia, movie_timescale)
+        raise ValueError("no video track")
+
+    @classmethod
+    def _track_keyframes(cls, moov, trak, mdia, movie_timescale):
+        start, _ = mdia[b'mdhd']
+        version = moov[start]
+        timescale = struct.unpack_from('>I', moov, start + (20 if version == 1 else 12))[0]
+        if not timescale:
+            raise ValueError("invalid timescale")
+
+        stbl = cls._children(moov, *cls._children(moov, *mdia[b'minf'])[b'stbl'])
+
+        codec = None
+        if b'stsd' in stbl:
+            fourcc = moov[stbl[b'stsd'][0] + 12:stbl[b'stsd'][0] + 16]
+            codec = cls.CODECS.get(fourcc, fourcc.decode('latin-1').strip())
+
+        def entries(box, typecode, width=1):
+            start, _ = stbl[box]
+            count = struct.unpack_from('>I', moov, start + 4)[0]
+            return cls._table(moov, start + 8, count, typecode, width)
+
+        # Sample sizes
+        start, _ = stbl[b'stsz']
+        uniform_size, sample_count = struct.unpack_from('>II', moov, start + 4)
+        if not sample_count:
+            raise ValueError("no samples")
+        sizes = None if uniform_size else cls._table(moov, start + 12, sample_count, 'I')
+
+        # Chunk offsets and the samples in each chunk
+        if b'co64' in stbl:
+            chunk_offsets = entries(b'co64', 'Q')
+        else:
+            chunk_offsets = entries(b'stco', 'I')
+        stsc = entries(b'stsc', 'I', 3)
+
+        # Sync samples (1-based); without stss every sample is a keyframe
+        sync = set(entries(b'stss', 'I')) if b'stss' in stbl else None
+
+        # Decode times (stts) and composition offsets (ctts)
+        stts = entries(b'stts', 'I', 2)
+        ctts = entries(b'ctts', 'i', 2) if b'ctts' in stbl else array('i')
+
+        # Edit list: presentation starts at media_time, possibly after an empty edit
+        shift = 0.0
+        edts = cls._children(moov, *trak[b'edts']) if b'edts' in trak else {}
+        if b'elst' in edts:
+            start, _ = edts[b'elst']
+            version = moov[start]
+            count = struct.unpack_from('>I', moov, start + 4)[0]
+            position = start + 8
+            for _ in range(count):
+                if version == 1:
+                    duration, media_time = struct.unpack_from('>Qq', moov, position)
+                    position += 20
+                else:
+                    duration, media_time = struct.unpack_from('>Ii', moov, position)
+                    position += 12
+                if media_time == -1:
+                    shift += duration / movie_timescale
+                    continue
+                shift -= media_time / timescale
+                break
+
+        keyframes = []
+        sample = 1
+        dts = 0
+        stts_entry, stts_left = 0, stts[0] if stts else 0
+        ctts_entry, ctts_left = 0, ctts[0] if ctts else 0
+        stsc_entry = 0
+        for chunk in range(1, len(chunk_offsets) + 1):
+            # stsc entries are (first_chunk, samples_per_chunk, description_index)
+            while stsc_entry * 3 + 3 < len(stsc) and chunk >= stsc[stsc_entry * 3 + 3]:
+                stsc_entry += 1
+            samples_in_chunk = stsc[stsc_entry * 3 + 1] if stsc else 0
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(samples_in_chunk):
+                if sample > sample_count:
+                    break
+                if sync is None or sample in sync:
+                    composition = ctts[ctts_entry * 2 + 1] if ctts else 0
+                    keyframes.append((round((dts + composition) / timescale + shift, 6), offset))
+
+                offset += uniform_size or sizes[sample - 1]
+                sample += 1
+
+                if stts:
+                    dts += stts[stts_entry * 2 + 1]
+                    stts_left -= 1
+                    if stts_left == 0 and stts_entry * 2 + 2 < len(stts):
+                        stts_entry += 1
+                        stts_left = stts[stts_entry * 2]
+                if ctts:
+                    ctts_left -= 1
+                    if ctts_left == 0 and ctts_entry * 2 + 2 < len(ctts):
+                        ctts_entry += 1
+                        ctts_left = ctts[ctts_entry * 2]
+        return codec, keyframes
@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileLock:
+    """
+    Exclusive lock shared by every process on the host (Celery workers included).
+
+    Uses flock() on POSIX, so the lock is released by the kernel if the holder
+    dies. Elsewhere it falls back to an O_EXCL lock file that is considered stale
+    after `stale_after` seconds.
+    """
+
+    def __init__(self, path, stale_after=3600):
+        self.path = str(path)
+        self.stale_after = stale_after
+        self._fd = None
+
+    def acquire(self, blocking=True, timeout=None, poll_interval=0.5):
+        """Try to take the lock; returns False if it couldn't be taken within timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._try_acquire():
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(poll_interval)
+
+    def _try_acquire(self):
+        if fcntl:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                    logger.warning(f"Removing stale lock {self.path}")
+                    os.remove(self.path)
+            except OSError:
+                pass
+            return False
+
+    @staticmethod
+    def held(path):
+        """Whether a lock file exists and someone holds it; never creates the file"""
+        if not fcntl:
+            return os.path.exists(path)
+        try:
+            fd = os.open(str(path), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        finally:
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        else:
+            os.close(self._fd)
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent fetches of the same file across workers.
+
+    The first caller (the leader) takes a lock next to the target, fetches into a
+    `.part` file and atomically renames it into place. Everyone else (followers)
+    waits for the lock instead of starting their own download, relaying the
+    leader's progress to their own callback while they wait. If the leader fails,
+    the next follower to get the lock takes over.
+    """
+
+    PROGRESS_KEY_PREFIX = 'ysd:singleflight:'
+
+    @staticmethod
+    def get_part_path(target_path):
+        """In-progress path for target_path; keeps the extension so yt-dlp/ffmpeg pick the right muxer"""
+        root, ext = os.path.splitext(str(target_path))
+        return f"{root}.part{ext}"
+
+    @classmethod
+    def fetch(cls, target_path, fetch_func, progress_callback=None, timeout=None, poll_interval=0.5):
+        """
+        Make sure target_path exists, calling fetch_func(part_path, progress_callback) at most once at a time.
+
+        Returns True if this call performed the fetch, False if the file came from another worker.
+        """
+        if timeout is None:
+            timeout = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('SOURCE_LOCK_TIMEOUT', 3600)
+
+        target_path = str(target_path)
+        progress_key = cls.PROGRESS_KEY_PREFIX + os.path.basename(target_path)
+        lock = FileLock(f"{target_path}.lock", stale_after=timeout)
+        deadline = time.monotonic() + timeout
+        waited = False
+
+        while True:
+            if os.path.exists(target_path):
+                return False
+
+            if lock.acquire(blocking=False):
+                try:
+                    # Another leader may have finished right before we got the lock
+                    if os.path.exists(target_path):
+                        return False
+                    if waited:
+                        logger.info(f"Taking over fetch of {target_path}")
+                    cls._lead(target_path, fetch_func, progress_callback, progress_key, timeout)
+                    return True
+                finally:
+                    lock.release()
+
+            # Follower: report the leader's progress and wait for it to finish
+            waited = True
+            if progress_callback:
+                percent = cache.get(progress_key)
+                if percent is not None:
+                    progress_callback(percent)
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for another worker to fetch {os.path.basename(target_path)}")
+            time.sleep(poll_interval)
+
+    @classmethod
+    def _lead(cls, target_path, fetch_func, progress_callback, progress_key, timeout):
+        part_path = cls.get_part_path(target_path)
+
+        def publish_progress(percent):
+            cache.set(progress_key, percent, timeout)
+            if progress_callback:
+                progress_callback(percent)
+
+        try:
+            fetch_func(part_path, publish_progress)
+            # Atomic on the same filesystem: readers see either no file or the complete one
+            os.replace(part_path, target_path)
+        finally:
+            cache.delete(progress_key)
+            if os.path.exists(part_path):
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
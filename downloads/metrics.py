@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from django.core.cache import cache
+
+
+class Counters:
+    """Monotonic counters kept in the Django cache so every process can update and read them"""
+
+    KEY_PREFIX = 'ysd:counter:'
+
+    @classmethod
+    def incr(cls, name, amount=1):
+        key = cls.KEY_PREFIX + name
+        # add() is a no-op when the key exists, so concurrent first increments don't reset each other
+        cache.add(key, 0, timeout=None)
+        try:
+            return cache.incr(key, amount)
+        except ValueError:
+            # Key was evicted between add() and incr()
+            cache.set(key, amount, timeout=None)
+            return amount
+
+    @classmethod
+    def get(cls, name):
+        return cache.get(cls.KEY_PREFIX + name, 0)
+
+    @classmethod
+    def get_many(cls, *names):
+        values = cache.get_many([cls.KEY_PREFIX + name for name in names])
+        return {name: values.get(cls.KEY_PREFIX + name, 0) for name in names}
+
+    @staticmethod
+    def ratio(hits, misses):
+        total = hits + misses
+        return round(hits / total, 4) if total else 0.0
+
+
+class Gauges:
+    """Up/down counts in the Django cache, e.g. processes running right now across all workers"""
+
+    KEY_PREFIX = 'ysd:gauge:'
+
+    @classmethod
+    def add(cls, name, amount):
+        key = cls.KEY_PREFIX + name
+        cache.add(key, 0, timeout=None)
+        try:
+            return cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, max(amount, 0), timeout=None)
+            return max(amount, 0)
+
+    @classmethod
+    def get(cls, name):
+        return max(cache.get(cls.KEY_PREFIX + name, 0), 0)
+
+    @classmethod
+    @contextmanager
+    def track(cls, name):
+        """Count the wrapped block as active while it runs"""
+        cls.add(name, 1)
+        try:
+            yield
+        finally:
+            cls.add(name, -1)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram kept in Counters, with an optional label.
+
+    An observation increments the counter of the first bucket it fits in (so
+    it costs three cache increments whatever the number of buckets), buckets
+    are made cumulative when rendered. Counters are integers, so the sum is
+    kept in `scale`ths of the unit (milliseconds for seconds with scale=1000).
+    """
+
+    def __init__(self, name, description, buckets, label=None, label_values=(), scale=1):
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self.label = label
+        self.label_values = label_values
+        self.scale = scale
+
+    def _key(self, label_value=None):
+        return f"hist:{self.name}:{label_value}" if self.label else f"hist:{self.name}"
+
+    def observe(self, value, label_value=None):
+        key = self._key(label_value)
+        bucket = next((bound for bound in self.buckets if value <= bound), '+Inf')
+        Counters.incr(f"{key}:{bucket}")
+        Counters.incr(f"{key}:count")
+        Counters.incr(f"{key}:sum", int(round(value * self.scale)))
+
+    def render(self):
+        """Prometheus text exposition lines"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_value in (self.label_values if self.label else [None]):
+            key = self._key(label_value)
+            bounds = [*self.buckets, '+Inf']
+            values = Counters.get_many(*(f"{key}:{bound}" for bound in bounds), f"{key}:count", f"{key}:sum")
+            labels = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound in bounds:
+                cumulative += values[f"{key}:{bound}"]
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels.rstrip(',')}}}" if labels else ''
+            lines.append(f"{self.name}_count{suffix} {values[f'{key}:count']}")
+            lines.append(f"{self.name}_sum{suffix} {values[f'{key}:sum'] / self.scale}")
+        return lines
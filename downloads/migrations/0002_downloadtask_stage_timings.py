@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Seconds spent in each processing stage'),
+        ),
+    ]
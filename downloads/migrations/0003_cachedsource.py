@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-17 16:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0002_downloadtask_stage_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(help_text='File name inside the temp directory', max_length=255, unique=True)),
+                ('youtube_id', models.CharField(db_index=True, max_length=20)),
+                ('quality', models.CharField(max_length=50)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('last_accessed', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0003_cachedsource'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='batch_id',
+            field=models.UUIDField(blank=True, db_index=True, help_text='Shared by the tasks created by one batch request', null=True),
+        ),
+    ]
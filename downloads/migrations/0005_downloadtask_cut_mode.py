@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0004_downloadtask_batch_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='cut_mode',
+            field=models.CharField(choices=[('copy', 'Stream copy (cuts snap to keyframes)'), ('smart', 'Smart cut (frame accurate, re-encodes the edges)')], default='copy', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0005_downloadtask_cut_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('fetch', 'Fetching source'), ('cut', 'Cutting'), ('finalize', 'Finalizing'), ('done', 'Done')], default='', help_text='Pipeline stage the task is in or queued for', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='stage_changed_at',
+            field=models.DateTimeField(blank=True, help_text='When the task was handed off to its current stage', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-17 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0006_downloadtask_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='client_id',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Who requested the task (user id or IP address)', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='estimated_size',
+            field=models.BigIntegerField(default=0, help_text='Estimated output size in bytes when the task was queued'),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='priority',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Scheduling level, 0 runs first', null=True),
+        ),
+    ]
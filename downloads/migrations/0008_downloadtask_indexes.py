@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-17 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0007_downloadtask_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['status', 'created_at'], name='downloads_d_status_3de342_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='downloadtask',
+            index=models.Index(fields=['video', 'start_time', 'end_time', 'quality'], name='downloads_d_video_i_99acf3_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-17 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0008_downloadtask_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadtask',
+            name='downloaded_bytes',
+            field=models.BigIntegerField(default=0, help_text='Bytes of source fetched for the task'),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='output_size',
+            field=models.BigIntegerField(default=0, help_text='Size of the produced segment in bytes'),
+        ),
+        migrations.AddField(
+            model_name='downloadtask',
+            name='started_at',
+            field=models.DateTimeField(blank=True, help_text='When a worker picked the task up', null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0009_downloadtask_instrumentation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='What was profiled, e.g. process_download_segment', max_length=100)),
+                ('task_id', models.UUIDField(blank=True, db_index=True, help_text='DownloadTask the run belongs to', null=True)),
+                ('path', models.CharField(blank=True, default='', help_text='Request path of profiled views', max_length=255)),
+                ('duration', models.FloatField(help_text='Wall-clock seconds of the profiled run')),
+                ('summary', models.TextField(blank=True, default='', help_text='Top functions by cumulative time')),
+                ('stats', models.BinaryField(help_text='pstats dump (marshal) of the run')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
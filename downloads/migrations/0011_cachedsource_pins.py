@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-17 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloads', '0010_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedsource',
+            name='pinned_at',
+            field=models.DateTimeField(blank=True, help_text='Last time a task pinned the source', null=True),
+        ),
+        migrations.AddField(
+            model_name='cachedsource',
+            name='pins',
+            field=models.PositiveIntegerField(default=0, help_text='Tasks waiting to cut from this source'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from videos.models import VideoInfo
 
 class DownloadTask(models.Model):
@@ -9,18 +10,78 @@ class DownloadTask(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+    STAGE_CHOICES = [
+        ('fetch', 'Fetching source'),
+        ('cut', 'Cutting'),
+        ('finalize', 'Finalizing'),
+        ('done', 'Done'),
+    ]
+    CUT_MODE_CHOICES = [
+        ('copy', 'Stream copy (cuts snap to keyframes)'),
+        ('smart', 'Smart cut (frame accurate, re-encodes the edges)'),
+    ]
 
     task_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     video = models.ForeignKey(VideoInfo, on_delete=models.CASCADE, related_name='download_tasks')
     start_time = models.IntegerField(help_text="Start time in seconds")
     end_time = models.IntegerField(help_text="End time in seconds")
     quality = models.CharField(max_length=50)
+    cut_mode = models.CharField(max_length=10, choices=CUT_MODE_CHOICES, default='copy')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     progress = models.IntegerField(default=0)
+    stage = models.CharField(max_length=10, choices=STAGE_CHOICES, blank=True, default='', help_text="Pipeline stage the task is in or queued for")
+    stage_changed_at = models.DateTimeField(blank=True, null=True, help_text="When the task was handed off to its current stage")
     output_file = models.FileField(upload_to='downloads/', blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True, help_text="When a worker picked the task up")
+    stage_timings = models.JSONField(default=dict, blank=True, help_text="Seconds spent in each processing stage")
+    downloaded_bytes = models.BigIntegerField(default=0, help_text="Bytes of source fetched for the task")
+    output_size = models.BigIntegerField(default=0, help_text="Size of the produced segment in bytes")
+    client_id = models.CharField(max_length=64, blank=True, default='', db_index=True, help_text="Who requested the task (user id or IP address)")
+    estimated_size = models.BigIntegerField(default=0, help_text="Estimated output size in bytes when the task was queued")
+    priority = models.PositiveSmallIntegerField(blank=True, null=True, help_text="Scheduling level, 0 runs first")
+    batch_id = models.UUIDField(blank=True, null=True, db_index=True, help_text="Shared by the tasks created by one batch request")
+
+    class Meta:
+        indexes = [
+            # Status filters ordered by age: admission control, scheduling, admin list_filter, cleanup scans
+            models.Index(fields=['status', 'created_at']),
+            # Identical segment lookups of the result cache
+            models.Index(fields=['video', 'start_time', 'end_time', 'quality']),
+        ]
 
     def __str__(self):
         return f"{self.video.title} ({self.start_time}-{self.end_time})"
+
+class CachedSource(models.Model):
+    """Index of the full source videos kept in media/temp, used for LRU/LFU eviction"""
+    filename = models.CharField(max_length=255, unique=True, help_text="File name inside the temp directory")
+    youtube_id = models.CharField(max_length=20, db_index=True)
+    quality = models.CharField(max_length=50)
+    size_bytes = models.BigIntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
+    pins = models.PositiveIntegerField(default=0, help_text="Tasks waiting to cut from this source")
+    pinned_at = models.DateTimeField(blank=True, null=True, help_text="Last time a task pinned the source")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.filename
+
+class Profile(models.Model):
+    """A cProfile run of a task, an extraction or an API view, see Profiler"""
+    name = models.CharField(max_length=100, help_text="What was profiled, e.g. process_download_segment")
+    task_id = models.UUIDField(blank=True, null=True, db_index=True, help_text="DownloadTask the run belongs to")
+    path = models.CharField(max_length=255, blank=True, default='', help_text="Request path of profiled views")
+    duration = models.FloatField(help_text="Wall-clock seconds of the profiled run")
+    summary = models.TextField(blank=True, default='', help_text="Top functions by cumulative time")
+    stats = models.BinaryField(help_text="pstats dump (marshal) of the run")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.duration:.2f}s)"
@@ -0,0 +1,116 @@
+from django.db.models import Count
+from .models import DownloadTask
+from .metrics import Counters, Gauges, Histogram
+from .cache import ResultCache
+from .source_cache import SourceCache
+from .estimation import ThroughputEstimator
+from videos.cache import MetadataCache
+
+
+class TaskMetrics:
+    """
+    Aggregate finished tasks into histograms and counters for the /metrics endpoint.
+
+    Every task keeps its own breakdown (stage_timings, downloaded_bytes,
+    output_size); record() adds it to cluster-wide histograms kept in the
+    cache, so capacity planning doesn't need to scan the tasks table.
+    Downloaded bytes are counted once per fetch, when the source lands on disk
+    (a batch shares one fetch), not here.
+    """
+
+    # Every stage a StageTimer may report, see the tasks and SegmentDownloader
+    STAGES = (
+        'queue_wait', 'metadata', 'download', 'resolve', 'stream_cut', 'cut', 'probe', 'smart_cut', 'concat',
+        'finalize', 'fetch_wait', 'cut_wait', 'finalize_wait',
+    )
+    SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+    BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 50, 100, 250, 500, 1024, 2048))
+
+    STAGE_SECONDS = Histogram(
+        'ysd_stage_seconds', "Seconds tasks spent in each processing stage",
+        SECONDS_BUCKETS, label='stage', label_values=STAGES, scale=1000
+    )
+    TASK_SECONDS = Histogram(
+        'ysd_task_seconds', "Seconds from queueing to completion of completed tasks",
+        SECONDS_BUCKETS, scale=1000
+    )
+    OUTPUT_BYTES = Histogram('ysd_output_bytes', "Size of completed segments in bytes", BYTES_BUCKETS)
+
+    @classmethod
+    def record(cls, task):
+        """Add a completed or failed task to the aggregates"""
+        Counters.incr(f'tasks_{task.status}')
+        for stage, seconds in (task.stage_timings or {}).items():
+            if stage in cls.STAGES:
+                cls.STAGE_SECONDS.observe(seconds, stage)
+        if task.status == 'completed':
+            if task.completed_at and task.created_at:
+                cls.TASK_SECONDS.observe((task.completed_at - task.created_at).total_seconds())
+            cls.OUTPUT_BYTES.observe(task.output_size)
+            Counters.incr('output_bytes', task.output_size)
+
+
+class PrometheusExporter:
+    """Render queue, cache, process and throughput metrics in the Prometheus text format"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    @staticmethod
+    def _metric(name, kind, description, samples):
+        """Lines of one metric; samples are (labels dict, value)"""
+        lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return lines
+
+    @classmethod
+    def render(cls):
+        in_flight = dict(
+            DownloadTask.objects.filter(status__in=('pending', 'processing'))
+            .values_list('status').annotate(count=Count('id'))
+        )
+        caches = {'result': ResultCache.stats(), 'source': SourceCache.stats(), 'metadata': MetadataCache.stats()}
+        counters = Counters.get_many(
+            'tasks_completed', 'tasks_failed', 'downloaded_bytes', 'output_bytes',
+            'admission_rejected_queue', 'admission_rejected_client', 'admission_rejected_disk',
+        )
+
+        lines = []
+        lines += cls._metric('ysd_tasks_in_flight', 'gauge', "Tasks queued (pending) or running (processing)", [
+            ({'status': status}, in_flight.get(status, 0)) for status in ('pending', 'processing')
+        ])
+        lines += cls._metric('ysd_tasks_finished_total', 'counter', "Tasks finished, by outcome", [
+            ({'status': status}, counters[f'tasks_{status}']) for status in ('completed', 'failed')
+        ])
+        lines += cls._metric('ysd_admission_rejected_total', 'counter', "Requests refused by admission control", [
+            ({'reason': reason}, counters[f'admission_rejected_{reason}']) for reason in ('queue', 'client', 'disk')
+        ])
+        lines += cls._metric('ysd_ffmpeg_processes', 'gauge', "ffmpeg processes running on all workers", [
+            ({}, Gauges.get('ffmpeg_processes'))
+        ])
+        lines += cls._metric('ysd_downloaded_bytes_total', 'counter', "Bytes of sources downloaded", [
+            ({}, counters['downloaded_bytes'])
+        ])
+        lines += cls._metric('ysd_output_bytes_total', 'counter', "Bytes of segments produced", [
+            ({}, counters['output_bytes'])
+        ])
+        lines += cls._metric(
+            'ysd_download_throughput_bytes_per_second', 'gauge', "Moving average of observed download speed",
+            [({}, round(ThroughputEstimator.download_rate(), 1))]
+        )
+        lines += cls._metric('ysd_cache_hits_total', 'counter', "Cache hits", [
+            ({'cache': name}, stats['hits']) for name, stats in caches.items()
+        ])
+        lines += cls._metric('ysd_cache_misses_total', 'counter', "Cache misses", [
+            ({'cache': name}, stats['misses']) for name, stats in caches.items()
+        ])
+        lines += cls._metric('ysd_cache_hit_ratio', 'gauge', "Cache hits over lookups", [
+            ({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()
+        ])
+        lines += cls._metric('ysd_source_cache_bytes', 'gauge', "Bytes of full sources kept in the source cache", [
+            ({}, caches['source']['total_bytes'])
+        ])
+        for histogram in (TaskMetrics.STAGE_SECONDS, TaskMetrics.TASK_SECONDS, TaskMetrics.OUTPUT_BYTES):
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
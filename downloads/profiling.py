@@ -0,0 +1,125 @@
+import cProfile
+import functools
+import io
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_active = threading.local()
+
+
+class Profiler:
+    """
+    Opt-in cProfile runs of worker tasks, extraction and API views, stored as Profile rows.
+
+    A run is profiled when it's asked for (the X-Profile request header from a
+    staff user or with PROFILE_TOKEN as value, or the `profile` kwarg of
+    process_download_segment and the split stage tasks) or picked by PROFILE_SAMPLE_RATE. When nothing
+    asks for it the cost is a settings lookup and a random draw. Runs nested in
+    a profiled run (extraction inside a profiled view) are part of the outer profile.
+    """
+
+    HEADER = 'X-Profile'
+    SUMMARY_LINES = 40
+
+    @staticmethod
+    def _settings():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS
+
+    @classmethod
+    def sampled(cls):
+        rate = cls._settings().get('PROFILE_SAMPLE_RATE', 0)
+        return rate > 0 and random.random() < rate
+
+    @classmethod
+    def enabled(cls, requested=False):
+        return bool(requested) or cls.sampled()
+
+    @classmethod
+    def requested_by(cls, request):
+        """Whether an HTTP request asks to be profiled"""
+        value = request.headers.get(cls.HEADER)
+        if not value:
+            return False
+        token = cls._settings().get('PROFILE_TOKEN')
+        if token and value == token:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
+
+    @classmethod
+    @contextmanager
+    def profile(cls, name, enabled, task_id=None, path=''):
+        """
+        Profile the wrapped block when `enabled`. Yields a dict whose 'task_id' can be
+        set while the block runs (e.g. by a view that creates a task), or None when not profiling.
+        """
+        if not enabled or getattr(_active, 'running', False):
+            yield None
+            return
+
+        run = {'task_id': task_id}
+        profiler = cProfile.Profile()
+        _active.running = True
+        started = time.monotonic()
+        profiler.enable()
+        try:
+            yield run
+        finally:
+            profiler.disable()
+            _active.running = False
+            cls._save(name, run['task_id'], path, time.monotonic() - started, profiler)
+
+    @classmethod
+    def _save(cls, name, task_id, path, duration, profiler):
+        from .models import Profile
+
+        try:
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(cls.SUMMARY_LINES)
+            profiler.create_stats()
+            Profile.objects.create(
+                name=name,
+                task_id=task_id,
+                path=path[:255],
+                duration=round(duration, 3),
+                summary=summary.getvalue(),
+                # The format of pstats dump files, loadable with pstats/snakeviz
+                stats=marshal.dumps(profiler.stats),
+            )
+        except Exception as e:
+            logger.warning(f"Could not store the profile of {name}: {e}")
+
+    @classmethod
+    def sampling(cls, name):
+        """Decorator profiling the sampled calls of a function"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with cls.profile(name, cls.sampled()):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class ProfiledViewMixin:
+    """
+    Profile API view handlers on request (see Profiler.requested_by) or by sampling.
+
+    The handler sees the run as `request.profile` (None when not profiled), to
+    link the profile to the task it creates.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        name = f"{type(self).__name__}.{request.method.lower()}"
+        enabled = Profiler.enabled(Profiler.requested_by(request))
+        with Profiler.profile(name, enabled, path=request.get_full_path()) as run:
+            request.profile = run
+            return super().dispatch(request, *args, **kwargs)
@@ -1,51 +1,107 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
 from downloads.models import DownloadTask
+from downloads.estimation import SizeEstimator
 
 class ProgressTracker:
     """Track and update download progress"""
-    
+
+    KEY_PREFIX = 'ysd:progress:'
+    STATUS_KEY_PREFIX = 'ysd:status:'
+
+    @classmethod
+    def _key(cls, task_id):
+        return f"{cls.KEY_PREFIX}{task_id}"
+
+    @classmethod
+    def _status_key(cls, task_id):
+        return f"{cls.STATUS_KEY_PREFIX}{task_id}"
+
     @staticmethod
-    def update_progress(task_id, percent):
+    def _timeout():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('PROGRESS_CACHE_TTL', 3600)
+
+    @classmethod
+    def publish(cls, task_ids, percent, status=None):
+        """Store hot progress (and the status when it changed) in the shared cache only (no database write)"""
+        percent = min(max(int(percent), 0), 100)
+        values = {cls._key(task_id): percent for task_id in task_ids}
+        if status:
+            values.update({cls._status_key(task_id): status for task_id in task_ids})
+        cache.set_many(values, cls._timeout())
+
+    @classmethod
+    def get_cached_states(cls, task_ids):
+        """{task_id: (status, progress)} published by workers; either value is None when unknown"""
+        keys = [cls._key(task_id) for task_id in task_ids] + [cls._status_key(task_id) for task_id in task_ids]
+        values = cache.get_many(keys)
+        return {
+            task_id: (values.get(cls._status_key(task_id)), values.get(cls._key(task_id)))
+            for task_id in task_ids
+        }
+
+    @classmethod
+    def update_progress(cls, task_id, percent):
         """Update DownloadTask progress field"""
-        try:
-            task = DownloadTask.objects.get(task_id=task_id)
-            task.progress = min(max(percent, 0), 100)
-            task.save()
-        except DownloadTask.DoesNotExist:
-            pass
+        percent = min(max(int(percent), 0), 100)
+        cls.publish([task_id], percent)
+        DownloadTask.objects.filter(task_id=task_id).update(progress=percent)
+
+    @classmethod
+    def get_progress(cls, task_id):
+        """Return current progress, from the cache when a worker is publishing it"""
+        percent = cache.get(cls._key(task_id))
+        if percent is not None:
+            return percent
+        return DownloadTask.objects.filter(task_id=task_id).values_list('progress', flat=True).first() or 0
+
+    @classmethod
+    def get_cached_progress(cls, task_id):
+        """Progress published by a worker, or None if there is none"""
+        return cache.get(cls._key(task_id))
 
-    @staticmethod
-    def get_progress(task_id):
-        """Return current progress"""
-        try:
-            task = DownloadTask.objects.get(task_id=task_id)
-            return task.progress
-        except DownloadTask.DoesNotExist:
-            return 0
-    
     @staticmethod
     def estimate_size(video_info, start, end, quality):
         """Calculate estimated file size based on format bitrate/duration"""
-        # video_info is VideoInfo object or dict
-        # Available from model: available_qualities is JSON
-        
-        qualities = video_info.available_qualities
-        target_format = None
-        
-        # Try to find format by quality label
-        for fmt in qualities:
-            if fmt.get('quality') == quality or fmt.get('format_id') == quality:
-                target_format = fmt
-                break
-        
-        if not target_format:
-            return 0
-            
-        full_size = target_format.get('filesize')
-        full_duration = video_info.duration
-        
-        if not full_size or not full_duration:
-            return 0
-            
-        duration = end - start
-        estimated_size = (full_size / full_duration) * duration
-        return int(estimated_size)
+        return SizeEstimator.estimate_size(video_info, start, end, quality)
+
+
+class ProgressReporter:
+    """
+    Rate-limited progress reporting for one or more tasks processed together.
+
+    Calling the reporter (e.g. from a yt-dlp progress hook) only updates the
+    shared cache, and only when the value moved by at least PROGRESS_MIN_DELTA
+    percent or PROGRESS_MIN_INTERVAL seconds passed since the last publish.
+    milestone() publishes and also writes DownloadTask.progress, so the
+    database sees a handful of writes per task instead of one per hook call.
+    """
+
+    def __init__(self, task_ids, min_interval=None, min_delta=None):
+        downloader_settings = settings.YOUTUBE_DOWNLOADER_SETTINGS
+        self.task_ids = [str(task_id) for task_id in task_ids]
+        self.min_interval = downloader_settings.get('PROGRESS_MIN_INTERVAL', 1.0) if min_interval is None else min_interval
+        self.min_delta = downloader_settings.get('PROGRESS_MIN_DELTA', 5) if min_delta is None else min_delta
+        self.percent = None
+        self._published_at = 0.0
+
+    def __call__(self, percent):
+        percent = int(percent)
+        if percent == self.percent:
+            return
+        now = time.monotonic()
+        jump = abs(percent - self.percent) if self.percent is not None else percent
+        if jump < self.min_delta and now - self._published_at < self.min_interval:
+            return
+        self._publish(percent, now)
+
+    def _publish(self, percent, now=None, status=None):
+        ProgressTracker.publish(self.task_ids, percent, status=status)
+        self.percent = percent
+        self._published_at = time.monotonic() if now is None else now
+
+    def milestone(self, percent, **fields):
+        """Publish and persist progress (plus any other DownloadTask fields) in one query"""
+        self._publish(percent, status=fields.get('status'))
+        DownloadTask.objects.filter(task_id__in=self.task_ids).update(progress=percent, **fields)
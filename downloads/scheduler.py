@@ -0,0 +1,120 @@
+import math
+import logging
+from django.conf import settings
+from .models import DownloadTask, CachedSource
+from .file_manager import FileManager
+from .estimation import ThroughputEstimator
+
+logger = logging.getLogger(__name__)
+
+
+class TaskScheduler:
+    """
+    Decide in which order queued segment tasks run, and hand them to Celery.
+
+    Every task gets an urgency level from 0 (run first) to 9:
+    - shortest job first: the estimated cost in seconds (download of the
+      estimated bytes plus the cut, see ThroughputEstimator) on a log scale, so short clips overtake long ones;
+    - fair share: clients with many tasks in flight are pushed back, so one
+      client queueing fifty long clips doesn't hold up everyone else;
+    - tasks whose full source is already cached skip the download cost.
+
+    The level becomes the Celery message priority on brokers that support
+    priorities (Redis, RabbitMQ). Other brokers (the default SQLAlchemy one)
+    ignore it and keep running tasks in FIFO order.
+    """
+
+    ACTIVE_STATUSES = ('pending', 'processing')
+    MAX_LEVEL = 9
+
+    @staticmethod
+    def _settings():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS
+
+    @classmethod
+    def priorities_supported(cls):
+        """Whether the broker orders messages by priority (SCHEDULER_PRIORITIES overrides the detection)"""
+        supported = cls._settings().get('SCHEDULER_PRIORITIES')
+        if supported is not None:
+            return supported
+        broker_url = getattr(settings, 'CELERY_BROKER_URL', '') or ''
+        return broker_url.split('://', 1)[0] in ('redis', 'rediss', 'sentinel', 'amqp', 'amqps', 'pyamqp')
+
+    @staticmethod
+    def source_cached(youtube_id, quality):
+        """Whether the full source is in the source cache (without counting it as a cache access)"""
+        path = FileManager.get_temp_path(youtube_id, quality)
+        return CachedSource.objects.filter(filename=path.name).exists()
+
+    @classmethod
+    def estimate_cost(cls, task, source_cached=False):
+        """Estimated seconds of work for a task, at the throughput workers observed lately"""
+        clip_seconds = task.end_time - task.start_time
+        size = task.estimated_size or clip_seconds * cls._settings().get('SCHEDULER_BYTES_PER_SECOND', 250000)
+        return ThroughputEstimator.predict(size, clip_seconds, task.cut_mode, source_cached)
+
+    @classmethod
+    def level(cls, cost, client_in_flight):
+        """Urgency level: 0 for jobs under ~15s from clients with nothing else in flight"""
+        job = int(math.log2(1 + cost / 15))
+        fair_share = int(math.log2(1 + client_in_flight))
+        return min(cls.MAX_LEVEL, job + fair_share)
+
+    @classmethod
+    def client_in_flight(cls, client_id, exclude=()):
+        if not client_id:
+            return 0
+        return DownloadTask.objects.filter(
+            client_id=client_id, status__in=cls.ACTIVE_STATUSES
+        ).exclude(pk__in=exclude).count()
+
+    @classmethod
+    def broker_priority(cls, level):
+        """Celery priority for a level: Redis runs 0 first, RabbitMQ runs the highest number first"""
+        broker_url = getattr(settings, 'CELERY_BROKER_URL', '') or ''
+        if broker_url.startswith(('amqp', 'pyamqp')):
+            return cls.MAX_LEVEL - level
+        return level
+
+    @classmethod
+    def prioritize(cls, tasks):
+        """Compute and store the level of new tasks (all of one video and quality); returns it"""
+        first = tasks[0]
+        pks = [task.pk for task in tasks]
+        cached = cls.source_cached(first.video.youtube_id, first.quality)
+        cost = sum(cls.estimate_cost(task, cached) for task in tasks)
+        level = cls.level(cost, cls.client_in_flight(first.client_id, exclude=pks))
+        DownloadTask.objects.filter(pk__in=pks).update(priority=level)
+        for task in tasks:
+            task.priority = level
+        return level
+
+    @classmethod
+    def _options(cls, level):
+        if not cls.priorities_supported():
+            return {}
+        return {'priority': cls.broker_priority(level)}
+
+    @classmethod
+    def submit(cls, task, profile=False):
+        """Queue a new segment task with its priority (`profile` asks the worker to profile it)"""
+        from .tasks import process_download_segment, queue_segment_stages
+
+        level = cls.prioritize([task])
+        options = cls._options(level)
+        logger.debug(f"Queueing task {task.task_id} at level {level}")
+        if cls._settings().get('SPLIT_STAGES', False):
+            if profile:
+                options['profile'] = True
+            return queue_segment_stages(task.task_id, **options)
+        if profile:
+            options['kwargs'] = {'profile': True}
+        return process_download_segment.apply_async(args=[task.task_id], **options)
+
+    @classmethod
+    def submit_batch(cls, tasks):
+        """Queue a batch job, prioritized by the total work of its segments"""
+        from .tasks import process_download_batch
+
+        level = cls.prioritize(tasks)
+        return process_download_batch.apply_async(args=[[str(task.task_id) for task in tasks]], **cls._options(level))
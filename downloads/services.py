@@ -4,17 +4,27 @@ import logging
 from django.conf import settings
 from .models import DownloadTask
 from .file_manager import FileManager
+from .keyframe_index import KeyframeIndex
+from .budget import DownloadBudget
+from .utils import StageTimer
+from .metrics import Gauges
 from videos.models import VideoInfo
+from videos.services import YouTubeExtractor
 import yt_dlp
+from yt_dlp.utils import DownloadError, download_range_func
 import imageio_ffmpeg
 
 logger = logging.getLogger(__name__)
 
+class DownloadCancelled(Exception):
+    """A pipelined download was stopped on purpose once the segment it was needed for was cut"""
+
 class SegmentDownloader:
     """Handle segment extraction and downloading"""
     
     @staticmethod
-    def create_download_task(youtube_id, start_time, end_time, quality):
+    def create_download_task(youtube_id, start_time, end_time, quality, batch_id=None, cut_mode='copy',
+                             client_id='', estimated_size=0, stage_timings=None):
         """
         - Validate timestamps (0 <= start < end <= duration)
         - Create DownloadTask record
@@ -35,7 +45,12 @@ class SegmentDownloader:
             start_time=start_time,
             end_time=end_time,
             quality=quality,
-            status='pending'
+            status='pending',
+            batch_id=batch_id,
+            cut_mode=cut_mode,
+            client_id=client_id,
+            estimated_size=estimated_size,
+            stage_timings=stage_timings or {}
         )
         
         # We will return the task object, the caller (View) will handle queuing the Celery task
@@ -49,51 +64,106 @@ class SegmentDownloader:
         return task
     
     @staticmethod
-    def download_full_video(youtube_id, quality, temp_path, progress_callback=None):
-        """Download complete video file to temp storage"""
-        # We need to construct the URL or use yt-dlp to download to temp_path
-        # format_id is passed as 'quality' usually in this context based on previous files
-        
-        url = f"https://www.youtube.com/watch?v={youtube_id}"
-        
-        # Construct proper format selector from quality string (e.g., '720p')
+    def build_format_selector(quality):
+        """Translate a quality string (e.g. '720p', 'best' or a format_id) into a yt-dlp format selector"""
         if quality == 'best':
-            format_selector = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+            return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
         elif quality.endswith('p') and quality[:-1].isdigit():
             height = quality[:-1]
             # Select best video with height <= requested height (ensures we get the closest match)
-            format_selector = f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}][ext=mp4]/best[height<={height}]'
-        else:
-            # Fallback or if it's a specific format_id
-            format_selector = quality
+            return f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}][ext=mp4]/best[height<={height}]'
+        # Fallback or if it's a specific format_id
+        return quality
 
-        # Progress hook to update progress
+    @staticmethod
+    def _build_progress_hook(progress_callback):
+        """yt-dlp progress hook mapping download progress onto the 0-65% range of the task"""
         def progress_hook(d):
+            if not progress_callback:
+                return
             if d['status'] == 'downloading':
-                if progress_callback:
-                    # Calculate percentage based on downloaded bytes
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                    downloaded = d.get('downloaded_bytes', 0)
-                    if total > 0:
-                        percent = int((downloaded / total) * 60)  # Max 60% for download phase
-                        progress_callback(percent)
+                # Calculate percentage based on downloaded bytes
+                total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                downloaded = d.get('downloaded_bytes', 0)
+                if total > 0:
+                    percent = int((downloaded / total) * 60)  # Max 60% for download phase
+                    progress_callback(percent)
             elif d['status'] == 'finished':
-                if progress_callback:
-                    progress_callback(65)  # Download complete
+                progress_callback(65)  # Download complete
+        return progress_hook
+
+    @staticmethod
+    def download_full_video(youtube_id, quality, temp_path, progress_callback=None):
+        """Download complete video file to temp storage"""
+        # We need to construct the URL or use yt-dlp to download to temp_path
+        # format_id is passed as 'quality' usually in this context based on previous files
+        
+        url = f"https://www.youtube.com/watch?v={youtube_id}"
 
         ydl_opts = {
-            'format': format_selector,
+            'format': SegmentDownloader.build_format_selector(quality),
             'outtmpl': str(temp_path),
             'quiet': True,
             'overwrites': True,
             'ffmpeg_location': imageio_ffmpeg.get_ffmpeg_exe(),
-            'progress_hooks': [progress_hook],
+            'progress_hooks': [SegmentDownloader._build_progress_hook(progress_callback)],
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+        # Parallel fragments and bandwidth come out of the budget shared by this worker's downloads
+        with DownloadBudget() as budget:
+            ydl_opts.update(budget.ydl_options())
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.add_progress_hook(budget.rebalance_hook(ydl.params))
+                ydl.download([url])
             
         return temp_path
+
+    @staticmethod
+    def download_segment_range(youtube_id, quality, start_time, end_time, range_path,
+                               progress_callback=None, padding=None):
+        """
+        Download only the part of the video covering start_time..end_time.
+
+        The requested window is widened by `padding` seconds on each side so the
+        keyframe preceding the cut start is included. yt-dlp fetches the section
+        through ffmpeg with input-side seeking, so only the fragments/byte ranges
+        overlapping the window are transferred.
+
+        Returns the offset (in seconds) of the fetched range within the source,
+        i.e. the cut has to be made at start_time - offset in the range file.
+        Raises yt_dlp.utils.DownloadError when the format cannot be partially
+        downloaded; callers should fall back to download_full_video.
+        """
+        if padding is None:
+            padding = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('RANGE_FETCH_PADDING', 5)
+
+        url = f"https://www.youtube.com/watch?v={youtube_id}"
+        range_start = max(0, start_time - padding)
+        range_end = end_time + padding
+
+        ydl_opts = {
+            'format': SegmentDownloader.build_format_selector(quality),
+            'outtmpl': str(range_path),
+            'quiet': True,
+            'overwrites': True,
+            'ffmpeg_location': imageio_ffmpeg.get_ffmpeg_exe(),
+            'progress_hooks': [SegmentDownloader._build_progress_hook(progress_callback)],
+            'download_ranges': download_range_func(None, [(range_start, range_end)]),
+            # Cutting happens later in extract_segment, don't re-encode here
+            'force_keyframes_at_cuts': False,
+        }
+
+        # yt-dlp runs ffmpeg to fetch the range
+        with DownloadBudget() as budget, Gauges.track('ffmpeg_processes'):
+            ydl_opts.update(budget.ydl_options())
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.add_progress_hook(budget.rebalance_hook(ydl.params))
+                ydl.download([url])
+
+        if not os.path.exists(range_path) or os.path.getsize(range_path) == 0:
+            raise DownloadError("Partial download produced no output")
+
+        return range_start
     
     @staticmethod
     def extract_segment(input_path, start_time, end_time, output_path):
@@ -117,12 +187,13 @@ class SegmentDownloader:
                 str(output_path)
             ]
             
-            result = subprocess.run(
-                ffmpeg_cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            with Gauges.track('ffmpeg_processes'):
+                subprocess.run(
+                    ffmpeg_cmd,
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
             return True
         except subprocess.CalledProcessError as e:
             logger.error(f"Error extracting segment: {e.stderr}")
@@ -130,6 +201,322 @@ class SegmentDownloader:
         except FileNotFoundError:
             logger.error("FFmpeg not found. Please install ffmpeg.")
             raise Exception("FFmpeg not found. Please install ffmpeg.")
+
+    @staticmethod
+    def extract_segments(input_path, segments):
+        """
+        Cut several segments from one source in a single ffmpeg pass.
+
+        `segments` is a list of (start_time, end_time, output_path). Every output
+        gets its own -ss/-to, so the input is read and demuxed once no matter
+        how many clips are produced.
+        """
+        import subprocess
+
+        ffmpeg_cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-i', str(input_path)]
+        for start_time, end_time, output_path in segments:
+            ffmpeg_cmd += [
+                '-ss', str(start_time),
+                '-to', str(end_time),
+                '-c', 'copy',
+                '-avoid_negative_ts', 'make_zero',
+                str(output_path)
+            ]
+
+        try:
+            with Gauges.track('ffmpeg_processes'):
+                subprocess.run(ffmpeg_cmd, capture_output=True, text=True, check=True)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error extracting segments: {e.stderr}")
+            for _, _, output_path in segments:
+                FileManager.delete_file(output_path)
+            raise Exception(f"FFmpeg error: {e.stderr}")
+        except FileNotFoundError:
+            logger.error("FFmpeg not found. Please install ffmpeg.")
+            raise Exception("FFmpeg not found. Please install ffmpeg.")
+
+    @staticmethod
+    def probe_keyframes(input_path, start_time, end_time):
+        """
+        List the keyframe positions (seconds) of the first video stream between start_time and end_time
+        (to the end of the file when end_time is None).
+
+        Packets are read with stream copy (no decoding) and listed with ffmpeg's
+        framecrc muxer, where non-keyframes carry a flags column.
+        Returns (codec_name, keyframe_times).
+        """
+        import subprocess
+
+        ffmpeg_cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-nostdin',
+            '-ss', str(start_time),
+            '-i', str(input_path),
+            *(['-t', str(end_time - start_time)] if end_time is not None else []),
+            '-map', '0:v:0',
+            '-c', 'copy',
+            '-f', 'framecrc', '-'
+        ]
+        try:
+            with Gauges.track('ffmpeg_processes'):
+                result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error probing keyframes: {e.stderr}")
+            raise Exception(f"FFmpeg error: {e.stderr}")
+
+        codec = None
+        time_base = None
+        keyframes = []
+        for line in result.stdout.splitlines():
+            if line.startswith('#tb 0:'):
+                num, den = line.split(':', 1)[1].strip().split('/')
+                time_base = int(num) / int(den)
+            elif line.startswith('#codec_id 0:'):
+                codec = line.split(':', 1)[1].strip()
+            elif line and not line.startswith('#'):
+                fields = [field.strip() for field in line.split(',')]
+                # stream, dts, pts, duration, size, checksum[, F=flags] - keyframes have no flags column
+                if len(fields) == 6 and time_base:
+                    # Timestamps are relative to the seek position
+                    position = round(start_time + int(fields[2]) * time_base, 6)
+                    if start_time <= position and (end_time is None or position <= end_time):
+                        keyframes.append(position)
+        return codec, sorted(keyframes)
+
+    @staticmethod
+    def smart_cut(input_path, start_time, end_time, output_path, timer=None):
+        """
+        Frame-accurate cut that re-encodes only the partial GOPs at both edges.
+
+        The video between the first keyframe after start_time and the last one
+        before end_time is stream-copied; the head (start_time..first keyframe)
+        and tail (last keyframe..end_time) are re-encoded with libx264, and the
+        pieces are concatenated with the audio of the whole range. Only H.264
+        sources are supported, anything else raises ValueError so callers can
+        fall back to extract_segment.
+        """
+        import subprocess
+        import tempfile
+
+        timer = timer or StageTimer()
+        downloader_settings = settings.YOUTUBE_DOWNLOADER_SETTINGS
+        ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+
+        with timer.stage('probe'):
+            # Cached sources have a keyframe index, other inputs (ranged fetches) are probed
+            index = KeyframeIndex.get(input_path, build=False)
+            if index is not None:
+                codec, keyframes = index.codec, index.between(start_time, end_time)
+            else:
+                codec, keyframes = SegmentDownloader.probe_keyframes(input_path, start_time, end_time)
+        if codec != 'h264':
+            raise ValueError(f"Smart cut is not supported for {codec or 'unknown'} video")
+
+        encode_opts = [
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', downloader_settings.get('SMART_CUT_PRESET', 'veryfast'),
+            '-crf', str(downloader_settings.get('SMART_CUT_CRF', 18)),
+            '-pix_fmt', 'yuv420p',
+            # Parameter sets in-band so the pieces decode after concatenation
+            '-x264-params', 'repeat-headers=1',
+            '-f', 'mp4',
+        ]
+
+        work_dir = tempfile.mkdtemp(prefix='smartcut_', dir=FileManager.TEMP_DIR)
+        try:
+            pieces = []
+            middle = [k for k in keyframes if k >= start_time]
+            copy_start = middle[0] if middle else None
+            copy_end = keyframes[-1] if keyframes else None
+
+            with timer.stage('smart_cut'):
+                if copy_start is None or copy_end is None or copy_end <= copy_start:
+                    # No complete GOP inside the range: re-encode all of it
+                    pieces.append(('encode', start_time, end_time))
+                else:
+                    if copy_start > start_time:
+                        pieces.append(('encode', start_time, copy_start))
+                    pieces.append(('copy', copy_start, copy_end))
+                    if end_time > copy_end:
+                        pieces.append(('encode', copy_end, end_time))
+
+                piece_paths = []
+                for index, (kind, piece_start, piece_end) in enumerate(pieces):
+                    piece_path = os.path.join(work_dir, f"piece{index}.mp4")
+                    if kind == 'encode':
+                        cmd = [
+                            ffmpeg_path, '-y', '-nostdin',
+                            '-ss', str(piece_start), '-i', str(input_path),
+                            '-t', str(piece_end - piece_start),
+                            *encode_opts, piece_path
+                        ]
+                    else:
+                        # Seek just past the keyframe so rounding can't land on the previous GOP;
+                        # the segment muxer then splits exactly at the keyframe at piece_end
+                        cmd = [
+                            ffmpeg_path, '-y', '-nostdin',
+                            '-ss', str(piece_start + 0.001), '-i', str(input_path),
+                            '-t', str(piece_end - piece_start + 1),
+                            '-an', '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb',
+                            '-f', 'segment',
+                            '-segment_times', str(piece_end - piece_start),
+                            '-segment_format', 'mp4',
+                            '-reset_timestamps', '1',
+                            os.path.join(work_dir, f"piece{index}_%d.mp4")
+                        ]
+                        piece_path = os.path.join(work_dir, f"piece{index}_0.mp4")
+                    with Gauges.track('ffmpeg_processes'):
+                        subprocess.run(cmd, capture_output=True, text=True, check=True)
+                    piece_paths.append(piece_path)
+
+            with timer.stage('concat'), Gauges.track('ffmpeg_processes'):
+                list_path = os.path.join(work_dir, 'pieces.txt')
+                with open(list_path, 'w') as f:
+                    f.writelines(f"file '{path}'\n" for path in piece_paths)
+                subprocess.run([
+                    ffmpeg_path, '-y', '-nostdin',
+                    '-f', 'concat', '-safe', '0', '-i', list_path,
+                    '-ss', str(start_time), '-t', str(end_time - start_time), '-i', str(input_path),
+                    '-map', '0:v', '-map', '1:a?',
+                    '-c', 'copy',
+                    '-movflags', '+faststart',
+                    str(output_path)
+                ], capture_output=True, text=True, check=True)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error smart-cutting segment: {e.stderr}")
+            FileManager.delete_file(output_path)
+            raise Exception(f"FFmpeg error: {e.stderr}")
+        finally:
+            FileManager.delete_file(work_dir)
+
+    @staticmethod
+    def download_pipelined(youtube_id, quality, part_path, ready_at, on_ready, duration=None,
+                           continue_download=True, progress_callback=None):
+        """
+        Download the full source while letting a cut start as soon as the part it needs is on disk.
+
+        ffmpeg copies the resolved media URL(s) into a fragmented MP4, which stays
+        readable while it grows, and reports its position on a progress pipe.
+        Once everything up to `ready_at` seconds (plus PIPELINE_READY_MARGIN) has
+        been written, on_ready(part_path) is called from this thread. Afterwards
+        the download either runs to completion (continue_download) or is stopped
+        and DownloadCancelled is raised, so the partial file is never kept as a source.
+        """
+        import subprocess
+
+        margin = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('PIPELINE_READY_MARGIN', 2)
+        format_selector = SegmentDownloader.build_format_selector(quality)
+        urls, http_headers = YouTubeExtractor.get_stream_urls(youtube_id, format_selector)
+        if not urls:
+            raise Exception("Could not resolve media URL")
+
+        headers = ''.join(f"{key}: {value}\r\n" for key, value in http_headers.items())
+
+        ffmpeg_cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y', '-nostdin', '-v', 'error']
+        for url in urls:
+            if headers:
+                ffmpeg_cmd += ['-headers', headers]
+            ffmpeg_cmd += ['-i', url]
+        for index in range(len(urls)):
+            ffmpeg_cmd += ['-map', str(index)]
+        ffmpeg_cmd += [
+            '-c', 'copy',
+            '-f', 'mp4',
+            # Self-contained fragments of at most a second, flushed as soon as they are complete
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-frag_duration', '1000000',
+            '-flush_packets', '1',
+            '-progress', 'pipe:1',
+            str(part_path)
+        ]
+
+        # The lease counts this transfer in the shares of the yt-dlp downloads on the host; ffmpeg's
+        # HTTP input has no bytes/s limit (-readrate is relative to playback speed), so it isn't throttled
+        with DownloadBudget():
+            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            Gauges.add('ffmpeg_processes', 1)
+            ready = False
+            try:
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key != 'out_time_us' or not value.isdigit():
+                        continue
+                    position = int(value) / 1000000
+                    if progress_callback and duration:
+                        progress_callback(int(min(position / duration, 1) * 60))  # Max 60% for download phase
+                    if not ready and position >= ready_at + margin:
+                        ready = True
+                        on_ready(part_path)
+                        if not continue_download:
+                            raise DownloadCancelled(f"Stopped downloading {youtube_id} after {position:.0f}s")
+
+                stderr = process.stderr.read()
+                if process.wait() != 0:
+                    logger.error(f"Error downloading source: {stderr}")
+                    raise Exception(f"FFmpeg error: {stderr}")
+                if progress_callback:
+                    progress_callback(65)  # Download complete
+                if not ready:
+                    # The segment ends within the margin of the end of the video
+                    on_ready(part_path)
+                return part_path
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+                process.stderr.close()
+                Gauges.add('ffmpeg_processes', -1)
+
+    @staticmethod
+    def stream_segment(youtube_id, quality, start_time, end_time, output_path, timer=None):
+        """
+        Cut a segment straight from the remote media without writing a temp file.
+
+        The media URL(s) are resolved through yt-dlp and handed to ffmpeg with
+        input-side seeking (-ss/-t before -i), so ffmpeg only requests the data
+        around the segment. Separate video and audio streams are muxed in the
+        same pass. Stage durations are recorded on `timer` (a StageTimer) if given.
+        """
+        import subprocess
+
+        timer = timer or StageTimer()
+        duration = end_time - start_time
+
+        with timer.stage('resolve'):
+            format_selector = SegmentDownloader.build_format_selector(quality)
+            urls, http_headers = YouTubeExtractor.get_stream_urls(youtube_id, format_selector)
+        if not urls:
+            raise Exception("Could not resolve media URL")
+
+        headers = ''.join(f"{key}: {value}\r\n" for key, value in http_headers.items())
+
+        ffmpeg_cmd = [imageio_ffmpeg.get_ffmpeg_exe(), '-y']
+        for url in urls:
+            if headers:
+                ffmpeg_cmd += ['-headers', headers]
+            # Input-side seeking: only fetch/demux from the keyframe before start_time
+            ffmpeg_cmd += ['-ss', str(start_time), '-t', str(duration), '-i', url]
+        for index in range(len(urls)):
+            ffmpeg_cmd += ['-map', str(index)]
+        ffmpeg_cmd += [
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',
+            '-movflags', '+faststart',
+            str(output_path)
+        ]
+
+        try:
+            # Holds a download lease like download_pipelined, without a bandwidth limit of its own
+            with timer.stage('stream_cut'), DownloadBudget(), Gauges.track('ffmpeg_processes'):
+                subprocess.run(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error stream-extracting segment: {e.stderr}")
+            FileManager.delete_file(output_path)
+            raise Exception(f"FFmpeg error: {e.stderr}")
+        return True
     
     @staticmethod
     def cleanup_temp_files(file_path):
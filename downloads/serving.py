@@ -0,0 +1,177 @@
+import asyncio
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file"""
+
+
+class RangeFile:
+    """
+    A file limited to `length` bytes from its current position.
+
+    fileno() is the real file's, so WSGI servers whose wsgi.file_wrapper uses
+    sendfile (gunicorn) send the range from the page cache, starting at the
+    file position and stopping at Content-Length. Other servers read() it.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class FileServer:
+    """
+    Serve completed segments with validators and byte ranges, doing as little work in Python as possible.
+
+    DOWNLOAD_SERVE_MODE picks who moves the bytes:
+    - 'sendfile' (default): Django answers Range/If-Range/If-None-Match itself. Under WSGI the body is a
+      file handed to the server's wsgi.file_wrapper (sendfile with gunicorn); under ASGI it is read in
+      DOWNLOAD_BLOCK_SIZE chunks off the event loop, never loading the whole file like FileResponse does there;
+    - 'x-accel': nginx serves the file from an internal location at DOWNLOAD_ACCEL_PREFIX (X-Accel-Redirect);
+    - 'x-sendfile': Apache/lighttpd serve it by absolute path (X-Sendfile).
+    Front proxies handle ranges and validators themselves.
+    """
+
+    RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+    @staticmethod
+    def _settings():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS
+
+    @staticmethod
+    def etag(stat):
+        """Strong validator from size and modification time, no need to hash the file"""
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    @classmethod
+    def parse_range(cls, header, size):
+        """
+        (start, end) of a single `bytes=` range (end included), or None to serve the whole file
+        (no, malformed or multi-range header). Raises RangeNotSatisfiable.
+        """
+        match = cls.RANGE_RE.fullmatch((header or '').strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start >= size:
+            raise RangeNotSatisfiable()
+        return start, min(end, size - 1)
+
+    @classmethod
+    def requested_range(cls, request, etag, last_modified, size):
+        header = request.headers.get('Range')
+        if not header:
+            return None
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range not in (etag, last_modified):
+            # The client's partial copy is outdated, send the whole new file
+            return None
+        return cls.parse_range(header, size)
+
+    @staticmethod
+    def not_modified(request, etag):
+        if_none_match = request.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f"W/{etag}" in tags
+
+    @staticmethod
+    async def _read_chunks(path, start, length, block_size):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while length > 0:
+                chunk = await asyncio.to_thread(f.read, min(block_size, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+    @classmethod
+    def serve(cls, request, path, media_name):
+        """
+        Response for GET/HEAD of the file at `path` (`media_name` relative to MEDIA_ROOT).
+        Raises FileNotFoundError when it's gone.
+        """
+        stat = os.stat(path)
+        filename = os.path.basename(media_name)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        etag = cls.etag(stat)
+        last_modified = http_date(stat.st_mtime)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': last_modified,
+            'Accept-Ranges': 'bytes',
+            'Content-Disposition': content_disposition_header(True, filename),
+        }
+
+        if cls.not_modified(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        mode = cls._settings().get('DOWNLOAD_SERVE_MODE', 'sendfile')
+        if mode == 'x-accel':
+            prefix = cls._settings().get('DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+            headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(media_name)
+            return HttpResponse(content_type=content_type, headers=headers)
+        if mode == 'x-sendfile':
+            headers['X-Sendfile'] = str(path)
+            return HttpResponse(content_type=content_type, headers=headers)
+
+        size = stat.st_size
+        try:
+            byte_range = cls.requested_range(request, etag, last_modified, size)
+        except RangeNotSatisfiable:
+            return HttpResponse(status=416, headers={'Content-Range': f"bytes */{size}", 'Accept-Ranges': 'bytes'})
+
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1 if size else 0
+        status = 206 if byte_range else 200
+        if byte_range:
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+        if request.method == 'HEAD':
+            response = HttpResponse(status=status, content_type=content_type, headers=headers)
+        elif isinstance(request, ASGIRequest):
+            block_size = cls._settings().get('DOWNLOAD_BLOCK_SIZE', 1024 * 1024)
+            response = StreamingHttpResponse(
+                cls._read_chunks(path, start, length, block_size),
+                status=status, content_type=content_type, headers=headers
+            )
+        else:
+            f = open(path, 'rb')
+            f.seek(start)
+            response = FileResponse(RangeFile(f, length), status=status, content_type=content_type, headers=headers)
+            response.block_size = cls._settings().get('DOWNLOAD_BLOCK_SIZE', 1024 * 1024)
+        response['Content-Length'] = length
+        return response
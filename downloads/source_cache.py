@@ -0,0 +1,167 @@
+import os
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import CachedSource
+from .file_manager import FileManager
+from .keyframe_index import KeyframeIndex
+from .metrics import Counters
+
+logger = logging.getLogger(__name__)
+
+
+class SourceCache:
+    """
+    Size-bounded cache of full source videos in media/temp.
+
+    Every cached source has a CachedSource row, so lookups, accounting and
+    eviction work from the index instead of listing and stat-ing the directory.
+    Sources also get a KeyframeIndex sidecar, built when they are registered
+    and removed with them.
+    When the total size exceeds SOURCE_CACHE_MAX_BYTES the least recently used
+    (or, with the 'lfu' policy, least frequently used) sources are removed.
+    Sources a task is about to cut are pinned (see pin) and never evicted
+    until unpinned or SOURCE_PIN_TIMEOUT has passed.
+    """
+
+    @staticmethod
+    def max_bytes():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('SOURCE_CACHE_MAX_BYTES', 1024 * 1024 * 1024 * 20)
+
+    @staticmethod
+    def policy():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('SOURCE_CACHE_POLICY', 'lru')
+
+    @classmethod
+    def lookup(cls, path, youtube_id=None, quality=None):
+        """Return True if the source at path is cached, recording the access"""
+        filename = os.path.basename(str(path))
+        entry = CachedSource.objects.filter(filename=filename).first()
+
+        if entry and not os.path.exists(path):
+            # File disappeared behind our back, drop the stale index entry
+            entry.delete()
+            KeyframeIndex.invalidate(path)
+            entry = None
+
+        if entry is None:
+            if not os.path.exists(path):
+                Counters.incr('source_cache_misses')
+                return False
+            # Source written before the index existed (or by hand), start tracking it
+            entry = cls.register(path, youtube_id or '', quality or '')
+
+        CachedSource.objects.filter(pk=entry.pk).update(
+            last_accessed=timezone.now(),
+            hit_count=F('hit_count') + 1
+        )
+        Counters.incr('source_cache_hits')
+        Counters.incr('source_cache_bytes_saved', entry.size_bytes)
+        return True
+
+    @classmethod
+    def register(cls, path, youtube_id, quality):
+        """Add (or refresh) the index entry for a freshly fetched source and enforce the size budget"""
+        filename = os.path.basename(str(path))
+        entry, _ = CachedSource.objects.update_or_create(
+            filename=filename,
+            defaults={
+                'youtube_id': youtube_id,
+                'quality': quality,
+                'size_bytes': FileManager.get_file_size(path),
+                'last_accessed': timezone.now(),
+            }
+        )
+        cls.enforce_budget(keep=filename)
+        # Built once per source; a refreshed source gets a new one (the old sidecar no longer matches it)
+        KeyframeIndex.get(path)
+        return entry
+
+    @classmethod
+    def pin(cls, path):
+        """Protect the source at path from eviction until unpin() (one pin per task)"""
+        CachedSource.objects.filter(filename=os.path.basename(str(path))).update(
+            pins=F('pins') + 1,
+            pinned_at=timezone.now()
+        )
+
+    @classmethod
+    def unpin(cls, path):
+        CachedSource.objects.filter(filename=os.path.basename(str(path)), pins__gt=0).update(pins=F('pins') - 1)
+
+    @staticmethod
+    def _evictable():
+        """Entries that aren't pinned; pins older than SOURCE_PIN_TIMEOUT belong to lost tasks"""
+        timeout = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('SOURCE_PIN_TIMEOUT', 6 * 3600)
+        return CachedSource.objects.exclude(pins__gt=0, pinned_at__gte=timezone.now() - timedelta(seconds=timeout))
+
+    @classmethod
+    def _eviction_order(cls):
+        if cls.policy() == 'lfu':
+            return ['hit_count', 'last_accessed']
+        return ['last_accessed']
+
+    @classmethod
+    def _evict(cls, entry):
+        FileManager.delete_file(FileManager.TEMP_DIR / entry.filename)
+        KeyframeIndex.invalidate(FileManager.TEMP_DIR / entry.filename)
+        entry.delete()
+        Counters.incr('source_cache_evictions')
+        logger.info(f"Evicted cached source {entry.filename} ({entry.size_bytes} bytes)")
+
+    @classmethod
+    def enforce_budget(cls, keep=None):
+        """Evict sources until the cache fits in max_bytes; `keep` and pinned sources are never evicted"""
+        limit = cls.max_bytes()
+        total = CachedSource.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+        if total <= limit:
+            return 0
+
+        evicted = 0
+        candidates = cls._evictable().exclude(filename=keep).order_by(*cls._eviction_order())
+        for entry in candidates.iterator():
+            if total <= limit:
+                break
+            cls._evict(entry)
+            total -= entry.size_bytes
+            evicted += 1
+        return evicted
+
+    @classmethod
+    def evict_expired(cls, max_age_seconds):
+        """Evict sources that haven't been used for max_age_seconds (unless pinned)"""
+        cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+        evicted = 0
+        for entry in cls._evictable().filter(last_accessed__lt=cutoff).iterator():
+            cls._evict(entry)
+            evicted += 1
+        return evicted
+
+    @staticmethod
+    def indexed_filenames():
+        """Cached sources and their keyframe index sidecars"""
+        filenames = set(CachedSource.objects.values_list('filename', flat=True))
+        return filenames | {filename + KeyframeIndex.SUFFIX for filename in filenames}
+
+    @classmethod
+    def stats(cls):
+        counters = Counters.get_many(
+            'source_cache_hits',
+            'source_cache_misses',
+            'source_cache_evictions',
+            'source_cache_bytes_saved',
+        )
+        usage = CachedSource.objects.aggregate(total=Sum('size_bytes'))
+        return {
+            'hits': counters['source_cache_hits'],
+            'misses': counters['source_cache_misses'],
+            'hit_ratio': Counters.ratio(counters['source_cache_hits'], counters['source_cache_misses']),
+            'evictions': counters['source_cache_evictions'],
+            'bytes_saved': counters['source_cache_bytes_saved'],
+            'entries': CachedSource.objects.count(),
+            'total_bytes': usage['total'] or 0,
+            'max_bytes': cls.max_bytes(),
+            'policy': cls.policy(),
+        }
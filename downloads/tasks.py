@@ -1,129 +1,613 @@
-from celery import shared_task
+from celery import shared_task, chain
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from .models import DownloadTask
-from .services import SegmentDownloader
+from .models import DownloadTask, Profile
+from .services import SegmentDownloader, DownloadCancelled
 from .file_manager import FileManager
+from .cache import ResultCache
+from .locks import SingleFlight
+from .source_cache import SourceCache
+from .utils import StageTimer
+from .estimation import ThroughputEstimator
+from .progress import ProgressTracker, ProgressReporter
+from .metrics import Counters
+from .monitoring import TaskMetrics
+from .profiling import Profiler
 from videos.models import VideoInfo
 import logging
 import os
+import time
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
 @shared_task(bind=True)
-def process_download_segment(self, task_id):
+def process_download_segment(self, task_id, profile=False):
     """
     Background task to:
     1. Get DownloadTask instance
     2. Update status to 'processing'
-    3. Download full video to temp location
-    4. Extract specified segment using ffmpeg
+    3. Download the source (only the needed range when possible) to temp location
+    4. Extract specified segment using ffmpeg, by stream copy or frame-accurate smart cut
+       (or stream-cut it straight from the media URLs when EXTRACTION_MODE is 'stream',
+       or cut it from the growing source as soon as it is on disk when it's 'pipeline')
     5. Save segment to media/downloads/
     6. Update task status to 'completed'
     
     Handle failures with proper error messages
     Update progress periodically (0-100%)
+
+    All stages run in one worker slot. With SPLIT_STAGES the same stages run
+    as separate tasks on the download and cut queues, see queue_segment_stages.
+
+    With `profile` (or when sampled by PROFILE_SAMPLE_RATE) the run is profiled, see Profiler.
     """
-    from django.db import transaction
-    
+    with Profiler.profile('process_download_segment', Profiler.enabled(profile), task_id=task_id):
+        return _process_segment(task_id)
+
+def _process_segment(task_id):
     try:
         task = DownloadTask.objects.get(task_id=task_id)
     except DownloadTask.DoesNotExist:
         logger.error(f"Task {task_id} not found")
         return "Task not found"
 
-    # Progress callback for yt-dlp
-    def update_progress(percent):
+    # Progress callback for yt-dlp: hot progress goes to the cache (throttled),
+    # only stage transitions are written to the task row
+    update_progress = ProgressReporter([task.task_id])
+
+    # Wall-clock time spent in each stage, stored on the task for comparing extraction modes
+    # (starting from what the API recorded before queueing, e.g. the metadata lookup)
+    timer = StageTimer(task.stage_timings)
+
+    try:
+        fetched = _fetch_stage(task, timer, update_progress)
+        _cut_stage(task, fetched, timer, update_progress)
+        _finalize_stage(task, fetched, timer, update_progress)
+        return "Completed"
+    except Exception as e:
+        _fail_task(task, e, timer, update_progress)
+        return f"Failed: {e}"
+
+def queue_segment_stages(task_id, priority=None, profile=False):
+    """
+    Queue a DownloadTask as chained fetch -> cut -> finalize tasks.
+
+    core/celery.py routes fetch and finalize to the 'download' queue (a
+    high-concurrency pool waiting on the network) and cut to the 'cut' queue
+    (a CPU-count-sized pool running ffmpeg), so both pools can be sized on their own.
+    The priority (see TaskScheduler) and `profile` apply to every stage.
+    """
+    options = {} if priority is None else {'priority': priority}
+    stage_kwargs = {'profile': True} if profile else {}
+    return chain(
+        fetch_segment_stage.s(str(task_id), **stage_kwargs).set(**options),
+        cut_segment_stage.s(**stage_kwargs).set(**options),
+        finalize_segment_stage.s(**stage_kwargs).set(**options)
+    ).apply_async()
+
+@shared_task(bind=True)
+def fetch_segment_stage(self, task_id, profile=False):
+    """Network-bound stage: get the source (or stream-cut the segment), hand off to the cut queue"""
+    return _run_stage(task_id, 'fetch', _fetch_stage, profile)
+
+@shared_task(bind=True)
+def cut_segment_stage(self, fetched, profile=False):
+    """CPU-bound stage: cut the segment out of the fetched source"""
+    if not fetched:
+        # An earlier stage failed, the task is already marked
+        return None
+    return _run_stage(fetched['task_id'], 'cut', lambda task, timer, update_progress: _cut_stage(task, fetched, timer, update_progress), profile)
+
+@shared_task(bind=True)
+def finalize_segment_stage(self, fetched, profile=False):
+    """Link the output to the task and mark it completed"""
+    if not fetched:
+        return None
+    return _run_stage(fetched['task_id'], 'finalize', lambda task, timer, update_progress: _finalize_stage(task, fetched, timer, update_progress), profile)
+
+def _run_stage(task_id, stage, func, profile=False):
+    """
+    Run one stage of a split pipeline for a task, recording how long it waited in its queue.
+
+    Returns the stage's result for the next stage, or None when the task is gone or the stage failed.
+    With `profile` (or when sampled) the stage is profiled as '<stage>_segment_stage', see Profiler.
+    """
+    with Profiler.profile(f'{stage}_segment_stage', Profiler.enabled(profile), task_id=task_id):
+        try:
+            task = DownloadTask.objects.select_related('video').get(task_id=task_id)
+        except DownloadTask.DoesNotExist:
+            logger.error(f"Task {task_id} not found")
+            return None
+
+        update_progress = ProgressReporter([task.task_id])
+        # Timings accumulate across the stage tasks
+        timer = StageTimer(task.stage_timings)
+        if task.stage == stage and task.stage_changed_at:
+            timer.timings[f"{stage}_wait"] = round((timezone.now() - task.stage_changed_at).total_seconds(), 3)
+
         try:
-            with transaction.atomic():
-                task.progress = percent
-                task.save(update_fields=['progress'])
+            return func(task, timer, update_progress)
         except Exception as e:
-            logger.error(f"Progress update error: {e}")
+            _fail_task(task, e, timer, update_progress)
+            return None
 
-    try:
-        # 2. Update status to 'processing'
-        with transaction.atomic():
-            task.status = 'processing'
-            task.progress = 5
-            task.save(update_fields=['status', 'progress'])
-        
-        # Validate Video Info exists
-        if not task.video:
-             raise ValueError("Associated video info missing")
+def _handoff(task, stage, percent, timer, update_progress, **fields):
+    """Record that the task moved on to (or is queued for) `stage`, with the timings so far"""
+    task.stage = stage
+    task.stage_changed_at = timezone.now()
+    update_progress.milestone(
+        percent, stage=stage, stage_changed_at=task.stage_changed_at, stage_timings=timer.timings, **fields
+    )
+
+def _output_for(task):
+    output_filename = FileManager.get_output_filename(
+        task.video.youtube_id, 
+        task.start_time, 
+        task.end_time, 
+        task.quality,
+        task.cut_mode
+    )
+    return output_filename, FileManager.get_output_path(output_filename)
 
-        # 3. Download full video to temp location
-        # Generate temp path
-        temp_path = FileManager.get_temp_path(task.video.youtube_id, task.quality)
+def _fetch_stage(task, timer, update_progress):
+    """
+    Get what the cut needs. Returns a JSON-serializable dict handed to the next stages:
+    source_path / offset / range_path of the fetched source, `cut` when the segment
+    was already written (streaming) and `completed` when the task is already done (pipelined).
+    """
+    # 2. Update status to 'processing'
+    task.status = 'processing'
+    task.started_at = timezone.now()
+    timer.timings['queue_wait'] = round((task.started_at - task.created_at).total_seconds(), 3)
+    _handoff(task, 'fetch', 5, timer, update_progress, status='processing', started_at=task.started_at)
+    
+    # Validate Video Info exists
+    if not task.video:
+         raise ValueError("Associated video info missing")
+
+    fetched = {
+        'task_id': str(task.task_id),
+        'source_path': None,
+        'offset': 0,
+        'range_path': None,
+        'cut': False,
+        'completed': False,
+    }
+
+    # 3. Get the source video into a temp location
+    # Generate temp path
+    temp_path = FileManager.get_temp_path(task.video.youtube_id, task.quality)
+    # Check if we already have the full video in temp (caching optimization)
+    source_cached = SourceCache.lookup(temp_path, task.video.youtube_id, task.quality)
+    
+    output_filename, output_path = _output_for(task)
+
+    # Streaming mode lets ffmpeg cut straight from the remote media, without any temp file.
+    # A cached full source is still cheaper, so only stream when we don't have one.
+    # Smart cuts need to probe keyframes in a local file, so they always download.
+    mode = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('EXTRACTION_MODE', 'download')
+    if mode == 'stream' and not source_cached and task.cut_mode == 'copy':
+        update_progress(10)
+        try:
+            SegmentDownloader.stream_segment(
+                task.video.youtube_id,
+                task.quality,
+                task.start_time,
+                task.end_time,
+                output_path,
+                timer=timer
+            )
+            fetched['cut'] = True
+            _handoff(task, 'finalize', 90, timer, update_progress)
+            return fetched
+        except Exception as e:
+            logger.warning(f"Streaming extraction failed for task {task.task_id} ({e}), falling back to download")
+
+    # Pipelined mode downloads the full source but cuts (and completes the task) as soon as
+    # the segment is on disk, instead of waiting for the end of the download
+    if mode == 'pipeline' and not source_cached:
+        update_progress(10)
+        fetched['completed'] = _pipelined_fetch(task, temp_path, output_path, output_filename, timer, update_progress)
+        if fetched['completed']:
+            return fetched
+        # Otherwise another worker was already downloading this source, it's cached now
+        source_cached = True
+
+    if not source_cached:
+        # Update progress - starting download
+        update_progress(10)
         
-        # Check if we already have the full video in temp (caching optimization)
-        if not os.path.exists(temp_path):
-            # Update progress - starting download
-            with transaction.atomic():
-                task.progress = 10
-                task.save(update_fields=['progress'])
-            
-            # Download with progress callback
-            SegmentDownloader.download_full_video(
-                task.video.youtube_id, 
-                task.quality, 
+        # Download with progress callback
+        with timer.stage('download'):
+            source_path, offset = _fetch_source(
+                task.video.youtube_id,
+                task.quality,
+                task.start_time,
+                task.end_time,
                 temp_path,
-                progress_callback=update_progress
+                task.task_id,
+                update_progress
             )
-        else:
-            # Use cached file
-            update_progress(65)
-        
-        # Update progress - download complete, starting extraction
-        with transaction.atomic():
-            task.progress = 70
-            task.save(update_fields=['progress'])
-        
-        # 4. Extract specified segment
-        output_filename = FileManager.get_output_filename(
-            task.video.youtube_id, 
-            task.start_time, 
-            task.end_time, 
-            task.quality
+        task.downloaded_bytes = _observe_download(source_path, timer)
+        fetched['source_path'] = str(source_path)
+        fetched['offset'] = offset
+        if source_path != temp_path:
+            fetched['range_path'] = str(source_path)
+    else:
+        # Use cached file
+        fetched['source_path'] = str(temp_path)
+        update_progress(65)
+
+    if not fetched['range_path']:
+        # The cut may wait in its queue for a while, keep the cached source from being evicted meanwhile
+        SourceCache.pin(temp_path)
+
+    # Download complete, queued for extraction
+    _handoff(task, 'cut', 65, timer, update_progress, downloaded_bytes=task.downloaded_bytes)
+    return fetched
+
+def _cut_stage(task, fetched, timer, update_progress):
+    if fetched['cut'] or fetched['completed']:
+        return fetched
+
+    # Update progress - download complete, starting extraction
+    update_progress(70)
+    
+    # 4. Extract specified segment
+    # Timestamps are relative to the fetched range when only part of the source was downloaded
+    _, output_path = _output_for(task)
+    try:
+        _cut_segment(
+            task.cut_mode,
+            fetched['source_path'],
+            task.start_time - fetched['offset'],
+            task.end_time - fetched['offset'],
+            output_path,
+            timer,
+            task.end_time - task.start_time
         )
-        output_path = FileManager.get_output_path(output_filename)
-        
-        SegmentDownloader.extract_segment(
-            temp_path, 
-            task.start_time, 
-            task.end_time, 
-            output_path
+    finally:
+        if not fetched['range_path']:
+            SourceCache.unpin(fetched['source_path'])
+
+    # Ranged sources only cover this segment, they are not worth keeping around
+    if fetched['range_path']:
+        SegmentDownloader.cleanup_temp_files(fetched['range_path'])
+
+    # Update progress - extraction complete, saving file
+    _handoff(task, 'finalize', 90, timer, update_progress)
+    return fetched
+
+def _finalize_stage(task, fetched, timer, update_progress):
+    if not fetched['completed']:
+        output_filename, _ = _output_for(task)
+        _complete_task(task, output_filename, timer)
+    
+    logger.info(f"Download task {task.task_id} completed, stage timings: {timer.timings}")
+    return "Completed"
+
+def _fail_task(task, error, timer, update_progress):
+    with transaction.atomic():
+        task.status = 'failed'
+        task.error_message = str(error)
+        task.stage_timings = timer.timings
+        # Progress is only persisted at milestones, keep the last reported value
+        task.progress = update_progress.percent or task.progress
+        task.save()
+    ProgressTracker.publish([task.task_id], task.progress, status='failed')
+    TaskMetrics.record(task)
+    logger.error(f"Download task {task.task_id} failed: {error}")
+
+def _complete_task(task, output_filename, timer):
+    """Link the cut output to the task and mark it completed"""
+    # 5. Save segment to media/downloads/ (Update database record)
+    # The file is already at output_path, we just need to link it
+    # Relative path for FileField
+    relative_path = f"downloads/{output_filename}"
+    with timer.stage('finalize'):
+        task.output_size = _file_size(FileManager.get_output_path(output_filename))
+
+    # 6. Update task status to 'completed'
+    with transaction.atomic():
+        task.status = 'completed'
+        task.progress = 100
+        task.completed_at = timezone.now()
+        task.output_file = relative_path
+        task.stage = 'done'
+        task.stage_timings = timer.timings
+        task.save()
+    ProgressTracker.publish([task.task_id], 100, status='completed')
+
+    # Identical requests can reuse this output from now on
+    ResultCache.store(task)
+    TaskMetrics.record(task)
+
+def _pipelined_fetch(task, temp_path, output_path, output_filename, timer, update_progress):
+    """
+    Download the full source of a task and cut its segment from the growing file.
+
+    The task is completed from inside the download, as soon as the segment is
+    on disk. The rest of the source is then either downloaded into the source
+    cache or dropped, depending on PIPELINE_CONTINUE_DOWNLOAD.
+    Returns True when the task was completed, False when the source was
+    fetched by another worker (the caller then cuts the cached file as usual).
+    """
+    video = task.video
+    done = []
+
+    def on_ready(part_path):
+        update_progress.milestone(70)
+        _cut_segment(
+            task.cut_mode, part_path, task.start_time, task.end_time, output_path, timer,
+            task.end_time - task.start_time
         )
-        
-        # Update progress - extraction complete, saving file
-        with transaction.atomic():
-            task.progress = 90
-            task.save(update_fields=['progress'])
-        
-        # 5. Save segment to media/downloads/ (Update database record)
-        # The file is already at output_path, we just need to link it
-        # Relative path for FileField
-        relative_path = f"downloads/{output_filename}"
-        
-        # 6. Update task status to 'completed'
-        with transaction.atomic():
+        update_progress(90)
+        _complete_task(task, output_filename, timer)
+        done.append(True)
+
+    def report(percent):
+        # The rest of the download must not move a completed task's progress back
+        if not done:
+            update_progress(percent)
+
+    continue_download = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('PIPELINE_CONTINUE_DOWNLOAD', True)
+    try:
+        with timer.stage('download'):
+            fetched = SingleFlight.fetch(
+                temp_path,
+                lambda part_path, callback: SegmentDownloader.download_pipelined(
+                    video.youtube_id,
+                    task.quality,
+                    part_path,
+                    task.end_time,
+                    on_ready,
+                    duration=video.duration,
+                    continue_download=continue_download,
+                    progress_callback=callback
+                ),
+                progress_callback=report
+            )
+    except DownloadCancelled as e:
+        logger.info(f"{e}, task {task.task_id} is done")
+        fetched = False
+    except Exception as e:
+        if not done:
+            raise
+        logger.warning(f"Download of {video.youtube_id} failed after task {task.task_id} completed: {e}")
+        fetched = False
+
+    if fetched:
+        SourceCache.register(temp_path, video.youtube_id, task.quality)
+        task.downloaded_bytes = _observe_download(temp_path, timer)
+    if done:
+        # Timings saved at completion didn't include the end of the download
+        DownloadTask.objects.filter(pk=task.pk).update(
+            stage_timings=timer.timings, downloaded_bytes=task.downloaded_bytes
+        )
+    return bool(done)
+
+def _cut_segment(cut_mode, source_path, start_time, end_time, output_path, timer, clip_seconds):
+    """
+    Cut one segment with the requested mode; smart cuts fall back to stream copy for unsupported codecs.
+    `clip_seconds` is the length of the segment, reported with the time the cut took.
+    """
+    if cut_mode == 'smart':
+        started = time.monotonic()
+        try:
+            SegmentDownloader.smart_cut(source_path, start_time, end_time, output_path, timer=timer)
+            ThroughputEstimator.observe_cut(cut_mode, clip_seconds, time.monotonic() - started)
+            return
+        except ValueError as e:
+            logger.warning(f"{e}, falling back to stream copy")
+
+    with timer.stage('cut'):
+        SegmentDownloader.extract_segment(source_path, start_time, end_time, output_path)
+    ThroughputEstimator.observe_cut('copy', clip_seconds, timer.last['cut'])
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _observe_download(source_path, timer):
+    """Report the size and speed of the download that just fetched source_path; returns the size"""
+    size = _file_size(source_path)
+    if not size:
+        return 0
+    ThroughputEstimator.observe_download(size, timer.last['download'])
+    Counters.incr('downloaded_bytes', size)
+    return size
+
+def _fetch_source(youtube_id, quality, start_time, end_time, temp_path, range_key, progress_callback):
+    """
+    Fetch the source needed for the start_time..end_time window of a video.
+
+    Tries a ranged fetch of just that window first (when enabled) and falls
+    back to downloading the full video for formats that can't be partially fetched.
+    Full downloads are coalesced across workers, see SingleFlight.
+    `range_key` (a task id) keeps the ranged temp files of concurrent tasks apart.
+    Returns (source_path, offset) where offset is the position of the fetched file
+    within the original video in seconds.
+    """
+    if settings.YOUTUBE_DOWNLOADER_SETTINGS.get('RANGE_FETCH', True):
+        range_path = FileManager.get_range_temp_path(
+            youtube_id, quality, start_time, end_time, range_key
+        )
+        try:
+            offset = SegmentDownloader.download_segment_range(
+                youtube_id,
+                quality,
+                start_time,
+                end_time,
+                range_path,
+                progress_callback=progress_callback
+            )
+            return range_path, offset
+        except Exception as e:
+            logger.warning(f"Ranged fetch failed for {youtube_id} ({e}), falling back to full download")
+            SegmentDownloader.cleanup_temp_files(range_path)
+
+    # Only one worker downloads a given source at a time, the others wait for its result
+    fetched = SingleFlight.fetch(
+        temp_path,
+        lambda part_path, callback: SegmentDownloader.download_full_video(
+            youtube_id,
+            quality,
+            part_path,
+            progress_callback=callback
+        ),
+        progress_callback=progress_callback
+    )
+    if fetched:
+        # Track the new source in the cache index (may evict older sources to stay in budget)
+        SourceCache.register(temp_path, youtube_id, quality)
+    return temp_path, 0
+
+@shared_task(bind=True)
+def process_download_batch(self, task_ids):
+    """
+    Process several segments of the same video, quality and cut mode as one job:
+    the source is fetched once (only the span covering all segments when
+    range fetching works) and every clip is cut in a single ffmpeg pass.
+
+    Each segment keeps its own DownloadTask, so clients follow progress and
+    results per clip exactly like for process_download_segment.
+    """
+    tasks = list(DownloadTask.objects.filter(task_id__in=task_ids).select_related('video').order_by('start_time'))
+    if not tasks:
+        logger.error(f"Batch tasks {task_ids} not found")
+        return "Tasks not found"
+
+    batch = DownloadTask.objects.filter(pk__in=[task.pk for task in tasks])
+
+    # Progress callback for yt-dlp, applied to every clip of the batch at once
+    update_progress = ProgressReporter([task.task_id for task in tasks])
+
+    timer = StageTimer(tasks[0].stage_timings)
+    video = tasks[0].video
+    quality = tasks[0].quality
+    cut_mode = tasks[0].cut_mode
+
+    try:
+        started_at = timezone.now()
+        timer.timings['queue_wait'] = round((started_at - tasks[0].created_at).total_seconds(), 3)
+        update_progress.milestone(5, status='processing', started_at=started_at)
+
+        temp_path = FileManager.get_temp_path(video.youtube_id, quality)
+        source_cached = SourceCache.lookup(temp_path, video.youtube_id, quality)
+
+        range_path = None
+        offset = 0
+        downloaded_bytes = 0
+        if not source_cached:
+            update_progress(10)
+            with timer.stage('download'):
+                source_path, offset = _fetch_source(
+                    video.youtube_id,
+                    quality,
+                    min(task.start_time for task in tasks),
+                    max(task.end_time for task in tasks),
+                    temp_path,
+                    tasks[0].task_id,
+                    update_progress
+                )
+            downloaded_bytes = _observe_download(source_path, timer)
+            if source_path != temp_path:
+                range_path = source_path
+        else:
+            source_path = temp_path
+            update_progress(65)
+
+        update_progress.milestone(70)
+
+        outputs = {}
+        for task in tasks:
+            outputs[task.pk] = FileManager.get_output_filename(
+                video.youtube_id, task.start_time, task.end_time, quality, cut_mode
+            )
+        if not range_path:
+            # Like the split cut stage, keep the cached source from being evicted while cutting
+            SourceCache.pin(source_path)
+        try:
+            if cut_mode == 'smart':
+                # Every clip has its own edges to re-encode, cut them one by one
+                for task in tasks:
+                    _cut_segment(
+                        cut_mode,
+                        source_path,
+                        task.start_time - offset,
+                        task.end_time - offset,
+                        FileManager.get_output_path(outputs[task.pk]),
+                        timer,
+                        task.end_time - task.start_time
+                    )
+            else:
+                with timer.stage('cut'):
+                    SegmentDownloader.extract_segments(source_path, [
+                        (task.start_time - offset, task.end_time - offset, FileManager.get_output_path(outputs[task.pk]))
+                        for task in tasks
+                    ])
+                ThroughputEstimator.observe_cut(
+                    cut_mode, sum(task.end_time - task.start_time for task in tasks), timer.last['cut']
+                )
+        finally:
+            if not range_path:
+                SourceCache.unpin(source_path)
+
+        if range_path:
+            SegmentDownloader.cleanup_temp_files(range_path)
+
+        update_progress(90)
+
+        with timer.stage('finalize'):
+            for task in tasks:
+                task.output_size = _file_size(FileManager.get_output_path(outputs[task.pk]))
+        completed_at = timezone.now()
+        for task in tasks:
             task.status = 'completed'
             task.progress = 100
-            task.completed_at = timezone.now()
-            task.output_file = relative_path
-            task.save()
-        
+            task.started_at = started_at
+            task.completed_at = completed_at
+            task.output_file = f"downloads/{outputs[task.pk]}"
+            task.stage = 'done'
+            task.stage_changed_at = completed_at
+            task.stage_timings = timer.timings
+            # The source was fetched once for the whole batch
+            task.downloaded_bytes = downloaded_bytes
+        DownloadTask.objects.bulk_update(tasks, [
+            'status', 'progress', 'completed_at', 'output_file', 'stage', 'stage_changed_at', 'stage_timings',
+            'output_size', 'downloaded_bytes',
+        ])
+
+        ProgressTracker.publish(update_progress.task_ids, 100, status='completed')
+        for task in tasks:
+            ResultCache.store(task)
+            TaskMetrics.record(task)
+
+        logger.info(f"Batch of {len(tasks)} segments of {video.youtube_id} completed, stage timings: {timer.timings}")
         return "Completed"
 
     except Exception as e:
-        with transaction.atomic():
+        batch.update(status='failed', error_message=str(e), stage_timings=timer.timings)
+        ProgressTracker.publish(update_progress.task_ids, update_progress.percent or 0, status='failed')
+        for task in tasks:
             task.status = 'failed'
-            task.error_message = str(e)
-            task.save()
-        logger.error(f"Download task {task_id} failed: {e}")
+            task.stage_timings = timer.timings
+            TaskMetrics.record(task)
+        logger.error(f"Batch of {len(tasks)} segments of {video.youtube_id} failed: {e}")
         return f"Failed: {e}"
 
 @shared_task
 def cleanup_old_files():
-    """Daily task to remove files older than 24 hours"""
-    FileManager.cleanup_old_temp_files(max_age_seconds=86400)
+    """Daily task to remove sources unused for 24 hours and stray temp files older than that"""
+    # Cached sources expire by last access (from the index), not by creation time
+    SourceCache.evict_expired(max_age_seconds=86400)
+    SourceCache.enforce_budget()
+    # Leftovers that aren't in the index (ranged sources, partial downloads, lock files)
+    FileManager.cleanup_old_temp_files(max_age_seconds=86400, exclude=SourceCache.indexed_filenames())
+    retention = settings.YOUTUBE_DOWNLOADER_SETTINGS.get('PROFILE_RETENTION', 7 * 86400)
+    Profile.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=retention)).delete()
     return "Cleanup completed"
@@ -1,10 +1,39 @@
+import io
+import marshal
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 from unittest.mock import patch, MagicMock
-from .models import DownloadTask
+from .models import DownloadTask, CachedSource, Profile
 from videos.models import VideoInfo
-from .services import SegmentDownloader
+from .services import SegmentDownloader, DownloadCancelled
+from .cache import ResultCache
+from .locks import SingleFlight
+from .source_cache import SourceCache
+from .keyframe_index import KeyframeIndex
+from .budget import DownloadBudget
+from .scheduler import TaskScheduler
+from .estimation import SizeEstimator, ThroughputEstimator
+from .metrics import Counters, Gauges, Histogram
+from .monitoring import TaskMetrics
+from .profiling import Profiler
+from .file_manager import FileManager
 from .validators import DownloadValidator
-from .tasks import process_download_segment
+from .tasks import (
+    process_download_segment, process_download_batch,
+    fetch_segment_stage, cut_segment_stage, finalize_segment_stage, queue_segment_stages
+)
+from .utils import StageTimer
+from .progress import ProgressTracker, ProgressReporter
 
 class DownloadValidatorTests(TestCase):
     def test_validate_youtube_url(self):
@@ -14,6 +43,19 @@ class DownloadValidatorTests(TestCase):
         self.assertTrue(DownloadValidator.validate_youtube_url(valid_url))
         self.assertFalse(DownloadValidator.validate_youtube_url(invalid_url))
 
+    def test_extract_video_id(self):
+        self.assertEqual(DownloadValidator.extract_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10"), "dQw4w9WgXcQ")
+        self.assertEqual(DownloadValidator.extract_video_id("https://youtu.be/dQw4w9WgXcQ"), "dQw4w9WgXcQ")
+        self.assertIsNone(DownloadValidator.extract_video_id("https://example.com/video"))
+
+    def test_validate_quality(self):
+        video = VideoInfo.objects.create(youtube_id="test_id", title="Test", duration=600)
+        video.formats.create(format_id='22', quality='720p', ext='mp4')
+
+        self.assertTrue(DownloadValidator.validate_quality('720p', video))
+        self.assertTrue(DownloadValidator.validate_quality('22', video))
+        self.assertFalse(DownloadValidator.validate_quality('1080p', video))
+
     def test_validate_timestamps(self):
         duration = 1000
         # Valid
@@ -70,6 +112,139 @@ class SegmentDownloaderTests(TestCase):
         path = SegmentDownloader.download_full_video("test_id", "720p", "temp/path.mp4")
         self.assertEqual(path, "temp/path.mp4")
         mock_instance.download.assert_called_once()
+        ydl_opts = mock_ydl.call_args[0][0]
+        self.assertGreaterEqual(ydl_opts['concurrent_fragment_downloads'], 1)
+
+    @patch('downloads.services.yt_dlp.YoutubeDL')
+    def test_download_segment_range(self, mock_ydl):
+        mock_instance = MagicMock()
+        mock_ydl.return_value.__enter__.return_value = mock_instance
+
+        with tempfile.TemporaryDirectory() as tmp:
+            range_path = os.path.join(tmp, "range.mp4")
+            # Simulate yt-dlp writing the section
+            mock_instance.download.side_effect = lambda urls: open(range_path, 'wb').write(b'data')
+
+            offset = SegmentDownloader.download_segment_range("test_id", "720p", 100, 120, range_path, padding=5)
+
+        self.assertEqual(offset, 95)
+        ydl_opts = mock_ydl.call_args[0][0]
+        self.assertIn('download_ranges', ydl_opts)
+
+    @patch('subprocess.run')
+    @patch('downloads.services.YouTubeExtractor.get_stream_urls')
+    def test_stream_segment_seeks_on_input(self, mock_urls, mock_run):
+        mock_urls.return_value = (["http://video", "http://audio"], {'User-Agent': 'test'})
+        timer = StageTimer()
+
+        SegmentDownloader.stream_segment("test_id", "720p", 100, 120, "output.mp4", timer=timer)
+
+        cmd = mock_run.call_args[0][0]
+        # -ss must come before each -i for input-side seeking
+        self.assertEqual(cmd.count('-i'), 2)
+        self.assertLess(cmd.index('-ss'), cmd.index('-i'))
+        self.assertEqual(cmd[cmd.index('-t') + 1], '20')
+        self.assertIn('resolve', timer.timings)
+        self.assertIn('stream_cut', timer.timings)
+
+    @patch('subprocess.run')
+    def test_extract_segments_single_pass(self, mock_run):
+        SegmentDownloader.extract_segments("input.mp4", [(10, 20, "a.mp4"), (30, 45, "b.mp4")])
+
+        mock_run.assert_called_once()
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertEqual(cmd.count('-ss'), 2)
+        self.assertEqual(cmd[-1], "b.mp4")
+
+    @patch('subprocess.Popen')
+    @patch('downloads.services.YouTubeExtractor.get_stream_urls')
+    def test_download_pipelined_cuts_once_range_is_on_disk(self, mock_urls, mock_popen):
+        mock_urls.return_value = (["http://video", "http://audio"], {})
+        process = mock_popen.return_value
+        process.stdout = io.StringIO(
+            "out_time_us=5000000\nprogress=continue\n"
+            "out_time_us=12500000\nout_time_us=13000000\n"
+            "out_time_us=30000000\nprogress=end\n"
+        )
+        process.wait.return_value = 0
+        process.poll.return_value = 0
+        on_ready = MagicMock()
+        progress = MagicMock()
+
+        SegmentDownloader.download_pipelined(
+            "test_id", "720p", "temp.part.mp4", 10, on_ready, duration=30, progress_callback=progress
+        )
+
+        cmd = mock_popen.call_args[0][0]
+        self.assertIn('frag_keyframe+empty_moov+default_base_moof', cmd)
+        self.assertEqual(cmd.count('-i'), 2)
+        # Ready once 10s + the 2s margin are written, and only once
+        on_ready.assert_called_once_with("temp.part.mp4")
+        progress.assert_any_call(25)
+        progress.assert_called_with(65)
+
+    @patch('subprocess.Popen')
+    @patch('downloads.services.YouTubeExtractor.get_stream_urls')
+    def test_download_pipelined_can_stop_after_cut(self, mock_urls, mock_popen):
+        mock_urls.return_value = (["http://video"], {})
+        process = mock_popen.return_value
+        process.stdout = io.StringIO("out_time_us=15000000\nout_time_us=30000000\n")
+        process.poll.return_value = None
+        on_ready = MagicMock()
+
+        with self.assertRaises(DownloadCancelled):
+            SegmentDownloader.download_pipelined(
+                "test_id", "720p", "temp.part.mp4", 10, on_ready, continue_download=False
+            )
+
+        on_ready.assert_called_once()
+        process.kill.assert_called_once()
+
+    @patch('subprocess.run')
+    def test_probe_keyframes(self, mock_run):
+        mock_run.return_value = MagicMock(stdout=(
+            "#tb 0: 1/12800\n"
+            "#codec_id 0: h264\n"
+            "0,      -1280,          0,      512,     3607, 0x23540cdf\n"
+            "0,       -768,       2048,      512,      488, 0xed4deeb5, F=0x0\n"
+            "0,      24320,      25600,      512,     3785, 0xbde29cdf\n"
+            "0,      24832,      27648,      512,      542, 0x14b90f23, F=0x0\n"
+        ))
+
+        codec, keyframes = SegmentDownloader.probe_keyframes("input.mp4", 8, 14)
+
+        self.assertEqual(codec, 'h264')
+        self.assertEqual(keyframes, [8.0, 10.0])
+
+    @patch('subprocess.run')
+    @patch('downloads.services.SegmentDownloader.probe_keyframes')
+    def test_smart_cut_copies_between_keyframes(self, mock_probe, mock_run):
+        mock_probe.return_value = ('h264', [8.0, 10.0, 12.0])
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+
+        with patch.object(FileManager, 'TEMP_DIR', Path(tmp)):
+            SegmentDownloader.smart_cut("input.mp4", 7.5, 13, "output.mp4")
+
+        commands = [call[0][0] for call in mock_run.call_args_list]
+        head, middle, tail, concat = commands
+        self.assertIn('libx264', head)
+        self.assertEqual(head[head.index('-ss') + 1], '7.5')
+        self.assertEqual(middle[middle.index('-c:v') + 1], 'copy')
+        self.assertEqual(middle[middle.index('-segment_times') + 1], '4.0')
+        self.assertIn('libx264', tail)
+        self.assertEqual(tail[tail.index('-t') + 1], '1.0')
+        self.assertIn('concat', concat)
+        # The pieces' work directory is removed
+        self.assertEqual(os.listdir(tmp), [])
+
+    @patch('downloads.services.SegmentDownloader.probe_keyframes')
+    def test_smart_cut_rejects_other_codecs(self, mock_probe):
+        mock_probe.return_value = ('vp9', [8.0])
+
+        with self.assertRaises(ValueError):
+            SegmentDownloader.smart_cut("input.webm", 7.5, 13, "output.mp4")
 
     @patch('downloads.services.ffmpeg_extract_subclip')
     def test_extract_segment(self, mock_ffmpeg):
@@ -108,3 +283,943 @@ class CeleryTaskTests(TestCase):
         self.task.refresh_from_db()
         self.assertEqual(self.task.status, 'completed')
         self.assertEqual(self.task.progress, 100)
+        self.assertIsNotNone(self.task.started_at)
+        for stage in ('queue_wait', 'download', 'cut', 'finalize'):
+            self.assertIn(stage, self.task.stage_timings)
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_process_download_segment_uses_range_offset(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+
+        result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        MockDownloader.download_full_video.assert_not_called()
+        MockDownloader.extract_segment.assert_called_with("temp.range.mp4", 5, 15, "media/downloads/out.mp4")
+
+    @patch('downloads.tasks.SingleFlight')
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_process_download_segment_range_fallback(self, MockFileManager, MockDownloader, MockSingleFlight):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        MockDownloader.download_segment_range.side_effect = Exception("This format cannot be partially downloaded")
+
+        result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        # Full download goes through the single-flight guard
+        MockSingleFlight.fetch.assert_called_once()
+        fetch_func = MockSingleFlight.fetch.call_args[0][1]
+        fetch_func("temp.part.mp4", None)
+        MockDownloader.download_full_video.assert_called_once_with("test_id", "720p", "temp.part.mp4", progress_callback=None)
+        MockDownloader.extract_segment.assert_called_with("temp.mp4", 10, 20, "media/downloads/out.mp4")
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_process_download_segment_stream_mode(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, EXTRACTION_MODE='stream')
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        MockDownloader.stream_segment.assert_called_once()
+        MockDownloader.download_full_video.assert_not_called()
+        MockDownloader.extract_segment.assert_not_called()
+        self.task.refresh_from_db()
+        self.assertIsInstance(self.task.stage_timings, dict)
+
+    def _run_pipelined(self, MockFileManager, MockDownloader, MockSingleFlight, MockSourceCache, continue_download):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        MockSourceCache.lookup.return_value = False
+        MockSingleFlight.fetch.side_effect = lambda target, fetch_func, progress_callback: fetch_func("temp.part.mp4", progress_callback) or True
+
+        def download_pipelined(youtube_id, quality, part_path, ready_at, on_ready, **kwargs):
+            self.assertEqual(ready_at, 20)
+            on_ready(part_path)
+            # Task is already completed while the rest of the source downloads
+            self.assertEqual(DownloadTask.objects.get(pk=self.task.pk).status, 'completed')
+            kwargs['progress_callback'](30)
+            if not kwargs['continue_download']:
+                raise DownloadCancelled("Stopped")
+        MockDownloader.download_pipelined.side_effect = download_pipelined
+
+        downloader_settings = dict(
+            settings.YOUTUBE_DOWNLOADER_SETTINGS,
+            EXTRACTION_MODE='pipeline',
+            PIPELINE_CONTINUE_DOWNLOAD=continue_download
+        )
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        MockDownloader.extract_segment.assert_called_once_with("temp.part.mp4", 10, 20, "media/downloads/out.mp4")
+        MockDownloader.download_segment_range.assert_not_called()
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'completed')
+        self.assertIn('download', self.task.stage_timings)
+        # Download progress after completion doesn't move the task back
+        self.assertEqual(ProgressTracker.get_progress(self.task.task_id), 100)
+
+    @patch('downloads.tasks.SourceCache')
+    @patch('downloads.tasks.SingleFlight')
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_pipeline_mode_completes_before_download_ends(self, MockFileManager, MockDownloader, MockSingleFlight, MockSourceCache):
+        self._run_pipelined(MockFileManager, MockDownloader, MockSingleFlight, MockSourceCache, continue_download=True)
+
+        # The rest of the source went into the cache
+        MockSourceCache.register.assert_called_once_with("temp.mp4", "test_id", "720p")
+
+    @patch('downloads.tasks.SourceCache')
+    @patch('downloads.tasks.SingleFlight')
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_pipeline_mode_can_stop_the_download(self, MockFileManager, MockDownloader, MockSingleFlight, MockSourceCache):
+        self._run_pipelined(MockFileManager, MockDownloader, MockSingleFlight, MockSourceCache, continue_download=False)
+
+        MockSourceCache.register.assert_not_called()
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_process_download_segment_smart_cut(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.return_value = "out_smart.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out_smart.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+        self.task.cut_mode = 'smart'
+        self.task.save()
+
+        result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        MockFileManager.get_output_filename.assert_called_with("test_id", 10, 20, "720p", "smart")
+        MockDownloader.smart_cut.assert_called_once()
+        self.assertEqual(MockDownloader.smart_cut.call_args[0][:4], ("temp.range.mp4", 5, 15, "media/downloads/out_smart.mp4"))
+        MockDownloader.extract_segment.assert_not_called()
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_smart_cut_falls_back_to_copy(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.return_value = "out_smart.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out_smart.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+        MockDownloader.smart_cut.side_effect = ValueError("Smart cut is not supported for vp9 video")
+        self.task.cut_mode = 'smart'
+        self.task.save()
+
+        result = process_download_segment(self.task.task_id)
+
+        self.assertEqual(result, "Completed")
+        MockDownloader.extract_segment.assert_called_with("temp.range.mp4", 5, 15, "media/downloads/out_smart.mp4")
+
+class SplitStageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.video = VideoInfo.objects.create(youtube_id="test_id", title="Test Video", duration=300)
+        self.task = DownloadTask.objects.create(video=self.video, start_time=10, end_time=20, quality="720p")
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_stages_hand_off_through_the_task(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+
+        fetched = fetch_segment_stage(str(self.task.task_id))
+
+        self.assertEqual(fetched['source_path'], "temp.range.mp4")
+        self.assertEqual(fetched['offset'], 5)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.stage, 'cut')
+        self.assertIsNotNone(self.task.stage_changed_at)
+        MockDownloader.extract_segment.assert_not_called()
+
+        fetched = cut_segment_stage(fetched)
+
+        MockDownloader.extract_segment.assert_called_once_with("temp.range.mp4", 5, 15, "media/downloads/out.mp4")
+        MockDownloader.cleanup_temp_files.assert_called_once_with("temp.range.mp4")
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.stage, 'finalize')
+
+        self.assertEqual(finalize_segment_stage(fetched), "Completed")
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'completed')
+        self.assertEqual(self.task.stage, 'done')
+        # Timings of every stage task, including time spent waiting in the queues
+        for stage in ('download', 'cut', 'cut_wait', 'finalize_wait'):
+            self.assertIn(stage, self.task.stage_timings)
+
+    @patch('downloads.tasks.SourceCache')
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_cached_source_is_pinned_until_cut(self, MockFileManager, MockDownloader, MockSourceCache):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        MockSourceCache.lookup.return_value = True
+        MockDownloader.extract_segment.side_effect = Exception("FFmpeg error")
+
+        fetched = fetch_segment_stage(str(self.task.task_id))
+
+        MockSourceCache.pin.assert_called_once_with("temp.mp4")
+        MockSourceCache.unpin.assert_not_called()
+
+        # Released even when the cut fails
+        self.assertIsNone(cut_segment_stage(fetched))
+        MockSourceCache.unpin.assert_called_once_with("temp.mp4")
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_failed_stage_stops_the_chain(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_output_filename.return_value = "out.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+        MockDownloader.extract_segment.side_effect = Exception("FFmpeg error")
+
+        fetched = fetch_segment_stage(str(self.task.task_id))
+        self.assertIsNone(cut_segment_stage(fetched))
+        self.assertIsNone(finalize_segment_stage(None))
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'failed')
+        self.assertEqual(self.task.stage, 'cut')
+
+    @patch('downloads.tasks.chain')
+    def test_profile_flag_reaches_every_stage(self, mock_chain):
+        queue_segment_stages(self.task.task_id, profile=True)
+
+        for signature in mock_chain.call_args[0]:
+            self.assertEqual(signature.kwargs, {'profile': True})
+
+        queue_segment_stages(self.task.task_id)
+
+        for signature in mock_chain.call_args[0]:
+            self.assertEqual(signature.kwargs, {})
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_profiled_stage_is_stored(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockDownloader.download_segment_range.return_value = 5
+
+        fetch_segment_stage(str(self.task.task_id), profile=True)
+
+        profile = Profile.objects.get()
+        self.assertEqual(profile.name, 'fetch_segment_stage')
+        self.assertEqual(profile.task_id, self.task.task_id)
+
+    def test_stages_are_routed_to_their_queues(self):
+        from core.celery import app
+        router = app.amqp.router
+        self.assertEqual(router.route({}, 'downloads.tasks.fetch_segment_stage')['queue'].name, 'download')
+        self.assertEqual(router.route({}, 'downloads.tasks.cut_segment_stage')['queue'].name, 'cut')
+        self.assertEqual(router.route({}, 'downloads.tasks.finalize_segment_stage')['queue'].name, 'download')
+
+class TaskSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.video = VideoInfo.objects.create(youtube_id="test_id", title="Test Video", duration=7200)
+
+    def _task(self, start, end, client_id="ip:1.2.3.4", **fields):
+        return DownloadTask.objects.create(
+            video=self.video, start_time=start, end_time=end, quality="720p", client_id=client_id, **fields
+        )
+
+    def test_short_jobs_first(self):
+        short = self._task(0, 10)
+        self.assertEqual(TaskScheduler.prioritize([short]), 0)
+        short.status = 'completed'
+        short.save()
+
+        long = self._task(0, 3600)
+        self.assertGreater(TaskScheduler.prioritize([long]), 0)
+        self.assertEqual(DownloadTask.objects.get(pk=long.pk).priority, long.priority)
+
+    def test_clients_with_many_tasks_in_flight_are_pushed_back(self):
+        for _ in range(7):
+            self._task(0, 10, client_id="ip:busy")
+
+        self.assertEqual(TaskScheduler.prioritize([self._task(0, 10, client_id="ip:busy")]), 3)
+        self.assertEqual(TaskScheduler.prioritize([self._task(0, 10, client_id="ip:other")]), 0)
+
+    def test_cached_source_skips_download_cost(self):
+        task = self._task(0, 1800, estimated_size=1024 * 1024 * 500)
+        uncached = TaskScheduler.prioritize([task])
+
+        CachedSource.objects.create(filename="test_id_720p.mp4", youtube_id="test_id", quality="720p")
+        self.assertLess(TaskScheduler.prioritize([task]), uncached)
+
+    @patch('downloads.tasks.process_download_segment')
+    def test_priority_only_sent_to_capable_brokers(self, mock_process):
+        task = self._task(0, 3600)
+
+        with self.settings(CELERY_BROKER_URL='sqla+sqlite:///celerydb.sqlite'):
+            TaskScheduler.submit(task)
+        self.assertNotIn('priority', mock_process.apply_async.call_args[1])
+
+        with self.settings(CELERY_BROKER_URL='redis://localhost:6379/0'):
+            TaskScheduler.submit(task)
+        self.assertEqual(mock_process.apply_async.call_args[1]['priority'], task.priority)
+
+        with self.settings(CELERY_BROKER_URL='amqp://localhost'):
+            TaskScheduler.submit(task)
+        self.assertEqual(mock_process.apply_async.call_args[1]['priority'], 9 - task.priority)
+
+    @patch('downloads.tasks.queue_segment_stages')
+    def test_split_stages_get_the_priority(self, mock_queue_stages):
+        task = self._task(0, 10)
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SPLIT_STAGES=True, SCHEDULER_PRIORITIES=True)
+
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings, CELERY_BROKER_URL='redis://localhost'):
+            TaskScheduler.submit(task)
+
+        mock_queue_stages.assert_called_once_with(task.task_id, priority=0)
+
+class SizeEstimatorTests(TestCase):
+    def setUp(self):
+        self.formats = [
+            # Video-only DASH formats, merged with the audio
+            {'format_id': '137', 'quality': '1080p', 'has_video': True, 'has_audio': False, 'tbr': 4000},
+            {'format_id': '136', 'quality': '720p', 'has_video': True, 'has_audio': False, 'vbr': 2000},
+            {'format_id': '135', 'quality': '480p', 'has_video': True, 'has_audio': False,
+             'filesize_approx': 60_000_000},
+            # Muxed format
+            {'format_id': '18', 'quality': '360p', 'has_video': True, 'has_audio': True, 'tbr': 600},
+        ]
+
+    def test_bitrate_table_adds_audio_to_video_only_formats(self):
+        table = SizeEstimator.bitrate_table(self.formats, 600, audio_bitrate=16_000)
+
+        self.assertEqual(table['1080p'], 500_000 + 16_000)
+        self.assertEqual(table['720p'], 250_000 + 16_000)
+        self.assertEqual(table['480p'], 100_000 + 16_000)
+        self.assertEqual(table['360p'], 75_000)
+        self.assertEqual(table['136'], 266_000)
+        self.assertEqual(table['best'], 516_000)
+
+    def test_estimate_uses_precomputed_table(self):
+        video = VideoInfo.objects.create(youtube_id="test_id", title="Test", duration=600, bitrates={'720p': 300_000})
+
+        self.assertEqual(SizeEstimator.estimate_size(video, 10, 20, '720p'), 3_000_000)
+
+    def test_estimate_without_table_or_bitrates(self):
+        video = VideoInfo.objects.create(youtube_id="test_id", title="Test", duration=600)
+        video.formats.create(format_id='22', quality='720p', ext='mp4')
+
+        # Rows extracted before the bitrate table fall back to typical bitrates for the height
+        self.assertEqual(SizeEstimator.estimate_size(video, 0, 10, '720p'), SizeEstimator.typical_bitrate(720) * 10)
+        self.assertEqual(SizeEstimator.estimate_size(video, 0, 10, 'best'), SizeEstimator.typical_bitrate(720) * 10)
+        self.assertEqual(SizeEstimator.estimate_size(video, 0, 10, 'unknown'), 0)
+
+
+class ThroughputEstimatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_defaults_until_observed(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SCHEDULER_BANDWIDTH=1_000_000)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            self.assertAlmostEqual(ThroughputEstimator.predict(10_000_000, 100, 'copy'), 10 + 2)
+            self.assertAlmostEqual(ThroughputEstimator.predict(10_000_000, 100, 'smart', source_cached=True), 50)
+
+    def test_moving_average_of_observations(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, ESTIMATE_SMOOTHING=0.5)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            ThroughputEstimator.observe_download(4_000_000, 2)
+            self.assertEqual(ThroughputEstimator.download_rate(), 2_000_000)
+            ThroughputEstimator.observe_download(1_000_000, 1)
+            self.assertEqual(ThroughputEstimator.download_rate(), 1_500_000)
+
+            ThroughputEstimator.observe_cut('copy', 60, 3)
+            self.assertAlmostEqual(ThroughputEstimator.cut_cost('copy'), 0.05)
+            self.assertAlmostEqual(ThroughputEstimator.predict(3_000_000, 60, 'copy'), 2 + 3)
+
+
+class TaskMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        video = VideoInfo.objects.create(youtube_id="test_id", title="Test Video", duration=300)
+        self.task = DownloadTask.objects.create(
+            video=video, start_time=10, end_time=20, quality='720p', status='completed',
+            completed_at=timezone.now(), stage_timings={'queue_wait': 0.2, 'download': 3.0, 'cut': 0.4},
+            output_size=2 * 1024 * 1024, downloaded_bytes=5 * 1024 * 1024
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('ysd_test_seconds', "Test", (1, 5), scale=1000)
+        for value in (0.5, 2, 2, 10):
+            histogram.observe(value)
+
+        lines = histogram.render()
+        self.assertIn('ysd_test_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('ysd_test_seconds_bucket{le="5"} 3', lines)
+        self.assertIn('ysd_test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('ysd_test_seconds_count 4', lines)
+        self.assertIn('ysd_test_seconds_sum 14.5', lines)
+
+    def test_record_adds_stages_and_bytes(self):
+        TaskMetrics.record(self.task)
+
+        lines = TaskMetrics.STAGE_SECONDS.render()
+        self.assertIn('ysd_stage_seconds_count{stage="download"} 1', lines)
+        self.assertIn('ysd_stage_seconds_bucket{stage="download",le="5"} 1', lines)
+        self.assertIn('ysd_stage_seconds_count{stage="smart_cut"} 0', lines)
+        self.assertEqual(Counters.get('tasks_completed'), 1)
+        self.assertEqual(Counters.get('output_bytes'), 2 * 1024 * 1024)
+        # Counted when the source was fetched
+        self.assertEqual(Counters.get('downloaded_bytes'), 0)
+
+    def test_gauge_tracks_running_blocks(self):
+        with Gauges.track('ffmpeg_processes'):
+            with Gauges.track('ffmpeg_processes'):
+                self.assertEqual(Gauges.get('ffmpeg_processes'), 2)
+        self.assertEqual(Gauges.get('ffmpeg_processes'), 0)
+
+
+class ProfilerTests(TestCase):
+    def test_disabled_runs_store_nothing(self):
+        with Profiler.profile('test', False) as run:
+            sum(range(1000))
+
+        self.assertIsNone(run)
+        self.assertFalse(Profile.objects.exists())
+
+    def test_nested_runs_are_part_of_the_outer_profile(self):
+        with Profiler.profile('outer', True) as run:
+            run['task_id'] = '7d3c1b4e-0f4a-4a3e-9f5e-2b1f0c9d8e7a'
+            with Profiler.profile('inner', True) as inner:
+                sum(range(1000))
+
+        self.assertIsNone(inner)
+        profile = Profile.objects.get()
+        self.assertEqual(profile.name, 'outer')
+        self.assertEqual(str(profile.task_id), '7d3c1b4e-0f4a-4a3e-9f5e-2b1f0c9d8e7a')
+        self.assertIn('function calls', profile.summary)
+        self.assertTrue(marshal.loads(bytes(profile.stats)))
+
+    def test_sample_rate(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, PROFILE_SAMPLE_RATE=1.0)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            self.assertTrue(Profiler.enabled())
+        self.assertFalse(Profiler.enabled())
+        self.assertTrue(Profiler.enabled(requested=True))
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_task_kwarg_profiles_the_task(self, MockFileManager, MockDownloader):
+        MockFileManager.get_output_path.return_value = "media/downloads/out.mp4"
+        video = VideoInfo.objects.create(youtube_id="test_id", title="Test Video", duration=300)
+        task = DownloadTask.objects.create(video=video, start_time=10, end_time=20, quality="720p")
+
+        process_download_segment(task.task_id, profile=True)
+
+        profile = Profile.objects.get()
+        self.assertEqual(profile.name, 'process_download_segment')
+        self.assertEqual(profile.task_id, task.task_id)
+
+    def test_admin_download(self):
+        from django.contrib.auth.models import User
+
+        with Profiler.profile('test', True):
+            sum(range(1000))
+        profile = Profile.objects.get()
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+        response = self.client.get(f'/admin/downloads/profile/{profile.pk}/download/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(marshal.loads(response.content), marshal.loads(bytes(profile.stats)))
+
+
+class BatchTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.video = VideoInfo.objects.create(
+            youtube_id="test_id",
+            title="Test Video",
+            duration=300
+        )
+        self.tasks = [
+            DownloadTask.objects.create(video=self.video, start_time=start, end_time=end, quality="720p")
+            for start, end in [(100, 110), (10, 20), (50, 60)]
+        ]
+
+    @patch('downloads.tasks._file_size', return_value=1000)
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_one_fetch_and_one_cut_for_all_segments(self, MockFileManager, MockDownloader, mock_size):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockFileManager.get_range_temp_path.return_value = "temp.range.mp4"
+        MockFileManager.get_output_filename.side_effect = lambda vid, start, end, quality, cut_mode: f"{start}_{end}.mp4"
+        MockFileManager.get_output_path.side_effect = lambda name: f"out/{name}"
+        MockDownloader.download_segment_range.return_value = 5
+
+        result = process_download_batch([str(task.task_id) for task in self.tasks])
+
+        self.assertEqual(result, "Completed")
+        MockDownloader.download_segment_range.assert_called_once()
+        # The fetched span covers every segment
+        self.assertEqual(MockDownloader.download_segment_range.call_args[0][2:4], (10, 110))
+        MockDownloader.extract_segments.assert_called_once_with("temp.range.mp4", [
+            (5, 15, "out/10_20.mp4"),
+            (45, 55, "out/50_60.mp4"),
+            (95, 105, "out/100_110.mp4"),
+        ])
+        for task in self.tasks:
+            task.refresh_from_db()
+            self.assertEqual(task.status, 'completed')
+            self.assertEqual(task.output_file.name, f"downloads/{task.start_time}_{task.end_time}.mp4")
+            self.assertEqual(task.downloaded_bytes, 1000)
+            self.assertEqual(task.stage, 'done')
+            self.assertEqual(task.stage_changed_at, task.completed_at)
+        # The shared fetch counts once, not once per segment
+        self.assertEqual(Counters.get('downloaded_bytes'), 1000)
+
+    @patch('downloads.tasks.SegmentDownloader')
+    @patch('downloads.tasks.FileManager')
+    def test_failure_marks_every_segment_failed(self, MockFileManager, MockDownloader):
+        MockFileManager.get_temp_path.return_value = "temp.mp4"
+        MockDownloader.extract_segments.side_effect = Exception("FFmpeg error")
+
+        result = process_download_batch([str(task.task_id) for task in self.tasks])
+
+        self.assertTrue(result.startswith("Failed"))
+        self.assertEqual(DownloadTask.objects.filter(status='failed').count(), 3)
+
+class ProgressReporterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.video = VideoInfo.objects.create(
+            youtube_id="test_id",
+            title="Test Video",
+            duration=300
+        )
+        self.task = DownloadTask.objects.create(
+            video=self.video,
+            start_time=10,
+            end_time=20,
+            quality="720p"
+        )
+
+    def test_hook_updates_are_throttled_and_stay_in_cache(self):
+        reporter = ProgressReporter([self.task.task_id], min_interval=60, min_delta=5)
+
+        for percent in range(0, 13):
+            reporter(percent)
+
+        # 0 is published first, then only jumps of at least 5 percent
+        self.assertEqual(ProgressTracker.get_cached_progress(self.task.task_id), 10)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.progress, 0)
+
+    def test_milestone_is_persisted(self):
+        reporter = ProgressReporter([self.task.task_id])
+
+        reporter.milestone(70, status='processing')
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.progress, 70)
+        self.assertEqual(self.task.status, 'processing')
+        self.assertEqual(ProgressTracker.get_progress(self.task.task_id), 70)
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.target = os.path.join(self.tmp, "source.mp4")
+
+    def test_concurrent_fetches_download_once(self):
+        calls = []
+
+        def fetch(part_path, progress_callback):
+            calls.append(part_path)
+            time.sleep(0.2)
+            with open(part_path, 'wb') as f:
+                f.write(b'video')
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(SingleFlight.fetch(self.target, fetch, poll_interval=0.05)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertTrue(calls[0].endswith('.part.mp4'))
+        self.assertFalse(os.path.exists(calls[0]))
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), b'video')
+
+    def test_failed_leader_leaves_no_partial_file(self):
+        def fetch(part_path, progress_callback):
+            with open(part_path, 'wb') as f:
+                f.write(b'partial')
+            raise IOError("connection reset")
+
+        with self.assertRaises(IOError):
+            SingleFlight.fetch(self.target, fetch)
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(SingleFlight.get_part_path(self.target)))
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.video = VideoInfo.objects.create(
+            youtube_id="test_id",
+            title="Test Video",
+            duration=300
+        )
+        self.task = DownloadTask.objects.create(
+            video=self.video,
+            start_time=10,
+            end_time=20,
+            quality="720p",
+            status='completed',
+            output_file="downloads/test_id_10_20_720p.mp4"
+        )
+
+    def test_lookup_hit_when_output_exists(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            os.makedirs(os.path.join(self.media_root, 'downloads'))
+            open(os.path.join(self.media_root, 'downloads', 'test_id_10_20_720p.mp4'), 'wb').close()
+
+            cached = ResultCache.lookup("test_id", 10, 20, "720p")
+            miss = ResultCache.lookup("test_id", 10, 20, "360p")
+
+        self.assertEqual(cached.task_id, self.task.task_id)
+        self.assertIsNone(miss)
+        stats = ResultCache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_cut_modes_are_cached_separately(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            os.makedirs(os.path.join(self.media_root, 'downloads'))
+            open(os.path.join(self.media_root, 'downloads', 'test_id_10_20_720p.mp4'), 'wb').close()
+
+            self.assertIsNotNone(ResultCache.lookup("test_id", 10, 20, "720p"))
+            self.assertIsNone(ResultCache.lookup("test_id", 10, 20, "720p", "smart"))
+
+        self.assertNotEqual(
+            ResultCache.make_key("test_id", 10, 20, "720p"),
+            ResultCache.make_key("test_id", 10, 20, "720p", "smart")
+        )
+
+    def test_lookup_evicts_missing_output(self):
+        with self.settings(MEDIA_ROOT=self.media_root):
+            cached = ResultCache.lookup("test_id", 10, 20, "720p")
+
+        self.assertIsNone(cached)
+        self.task.refresh_from_db()
+        self.assertFalse(self.task.output_file)
+        self.assertEqual(ResultCache.stats()['evictions'], 1)
+
+class SourceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        patcher = patch.object(FileManager, 'TEMP_DIR', Path(self.tmp))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(KeyframeIndex, 'get')
+        self.build_index = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write_source(self, name, size):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_lookup_tracks_hits_and_misses(self):
+        path = self._write_source("vid_720p.mp4", 100)
+        self.assertFalse(SourceCache.lookup(os.path.join(self.tmp, "other_720p.mp4")))
+
+        SourceCache.register(path, "vid", "720p")
+        self.assertTrue(SourceCache.lookup(path))
+
+        stats = SourceCache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['bytes_saved'], 100)
+        self.assertEqual(CachedSource.objects.get(filename="vid_720p.mp4").hit_count, 1)
+
+    def test_evicts_least_recently_used_over_budget(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SOURCE_CACHE_MAX_BYTES=250)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            old = self._write_source("old_720p.mp4", 100)
+            SourceCache.register(old, "old", "720p")
+            recent = self._write_source("recent_720p.mp4", 100)
+            SourceCache.register(recent, "recent", "720p")
+            CachedSource.objects.filter(filename="recent_720p.mp4").update(last_accessed=timezone.now())
+            CachedSource.objects.filter(filename="old_720p.mp4").update(
+                last_accessed=timezone.now() - timedelta(hours=1)
+            )
+
+            new = self._write_source("new_720p.mp4", 100)
+            SourceCache.register(new, "new", "720p")
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(SourceCache.indexed_filenames(), {
+            "recent_720p.mp4", "recent_720p.mp4.kfi", "new_720p.mp4", "new_720p.mp4.kfi"
+        })
+        self.assertEqual(SourceCache.stats()['evictions'], 1)
+
+    def test_pinned_sources_are_not_evicted(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SOURCE_CACHE_MAX_BYTES=150)
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            waiting = self._write_source("waiting_720p.mp4", 100)
+            SourceCache.register(waiting, "waiting", "720p")
+            # Fetched by a task whose cut is still queued
+            SourceCache.pin(waiting)
+            CachedSource.objects.filter(filename="waiting_720p.mp4").update(
+                last_accessed=timezone.now() - timedelta(days=2)
+            )
+
+            new = self._write_source("new_720p.mp4", 100)
+            SourceCache.register(new, "new", "720p")
+            self.assertEqual(SourceCache.evict_expired(max_age_seconds=86400), 0)
+            self.assertTrue(os.path.exists(waiting))
+
+            SourceCache.unpin(waiting)
+            self.assertEqual(SourceCache.enforce_budget(keep="new_720p.mp4"), 1)
+
+        self.assertFalse(os.path.exists(waiting))
+        self.assertTrue(os.path.exists(new))
+
+    def test_pins_of_lost_tasks_expire(self):
+        downloader_settings = dict(settings.YOUTUBE_DOWNLOADER_SETTINGS, SOURCE_PIN_TIMEOUT=60)
+        path = self._write_source("vid_720p.mp4", 100)
+        SourceCache.register(path, "vid", "720p")
+        SourceCache.pin(path)
+        CachedSource.objects.update(
+            last_accessed=timezone.now() - timedelta(days=2),
+            pinned_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=downloader_settings):
+            self.assertEqual(SourceCache.evict_expired(max_age_seconds=86400), 1)
+
+    def test_keyframe_index_follows_the_source(self):
+        path = self._write_source("vid_720p.mp4", 100)
+        SourceCache.register(path, "vid", "720p")
+        self.build_index.assert_called_once_with(path)
+
+        # The sidecar goes away with its source
+        open(KeyframeIndex.path_for(path), 'wb').close()
+        SourceCache._evict(CachedSource.objects.get(filename="vid_720p.mp4"))
+        self.assertFalse(os.path.exists(KeyframeIndex.path_for(path)))
+
+
+class DownloadBudgetTests(TestCase):
+    def setUp(self):
+        self.lease_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lease_dir, ignore_errors=True)
+        self.downloader_settings = dict(
+            settings.YOUTUBE_DOWNLOADER_SETTINGS,
+            CONCURRENT_FRAGMENTS=4,
+            WORKER_MAX_FRAGMENTS=6,
+            WORKER_MAX_BANDWIDTH=1000
+        )
+
+    def test_downloads_share_the_worker_budget(self):
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=self.downloader_settings):
+            with DownloadBudget(self.lease_dir) as first:
+                self.assertEqual(first.shares(), (4, 1000))
+                with DownloadBudget(self.lease_dir) as second:
+                    self.assertEqual(second.shares(), (3, 500))
+                    self.assertEqual(first.shares(), (3, 500))
+                    # Rate limits apply per connection
+                    self.assertEqual(second.ydl_options()['ratelimit'], 166)
+                self.assertEqual(first.shares(), (4, 1000))
+        self.assertEqual(os.listdir(self.lease_dir), [])
+
+    @patch('subprocess.run')
+    @patch('downloads.services.YouTubeExtractor.get_stream_urls')
+    def test_stream_cut_holds_a_lease(self, mock_urls, mock_run):
+        mock_urls.return_value = (["http://video"], {})
+        mock_run.side_effect = lambda *args, **kwargs: self.assertEqual(len(os.listdir(self.lease_dir)), 1)
+
+        with patch.object(DownloadBudget, 'LEASE_DIR', Path(self.lease_dir)):
+            SegmentDownloader.stream_segment("test_id", "720p", 100, 120, "output.mp4")
+
+        mock_run.assert_called_once()
+        self.assertEqual(os.listdir(self.lease_dir), [])
+
+    def test_stale_leases_are_ignored(self):
+        # Left behind by a process that died: the file exists but nobody holds its lock
+        dead = os.path.join(self.lease_dir, "dead.lease")
+        open(dead, 'w').close()
+        os.utime(dead, (time.time() - 3600, time.time() - 3600))
+
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=self.downloader_settings):
+            with DownloadBudget(self.lease_dir) as budget:
+                self.assertEqual(budget.active_downloads(), 1)
+        self.assertEqual(os.listdir(self.lease_dir), [])
+
+    def test_leases_not_locked_yet_are_counted_and_kept(self):
+        # Created by another process that hasn't flocked it yet
+        starting = os.path.join(self.lease_dir, "starting.lease")
+        open(starting, 'w').close()
+
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=self.downloader_settings):
+            with DownloadBudget(self.lease_dir) as budget:
+                self.assertEqual(budget.active_downloads(), 2)
+        self.assertEqual(os.listdir(self.lease_dir), ["starting.lease"])
+
+    def test_rebalance_hook_updates_running_http_download(self):
+        params = {'ratelimit': 1000}
+        with self.settings(YOUTUBE_DOWNLOADER_SETTINGS=self.downloader_settings):
+            with DownloadBudget(self.lease_dir) as budget:
+                hook = budget.rebalance_hook(params, interval=0)
+                with DownloadBudget(self.lease_dir):
+                    # Fragmented downloads can't be changed once started
+                    hook({'status': 'downloading', 'fragment_index': 3})
+                    self.assertEqual(params['ratelimit'], 1000)
+                    hook({'status': 'downloading'})
+                    self.assertEqual(params['ratelimit'], 500)
+
+
+def _box(box_type, *payload):
+    data = b''.join(payload)
+    return struct.pack('>I4s', len(data) + 8, box_type) + data
+
+
+def _full_box(box_type, fmt, *values):
+    return _box(box_type, struct.pack('>I' + fmt, 0, *values))
+
+
+class KeyframeIndexTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def _write_mp4(self, stts=((10, 100),)):
+        """10 samples of 100 bytes at 1/10s (timescale 1000), keyframes 1 and 6, 5 samples per chunk"""
+        mdat_offset = 12
+        stts_values = [value for entry in stts for value in entry]
+        stbl = _box(b'stbl',
+            _box(b'stsd', struct.pack('>II', 0, 1), _box(b'avc1', b'\0' * 78)),
+            _full_box(b'stts', 'I' * (len(stts_values) + 1), len(stts), *stts_values),
+            _full_box(b'stss', 'III', 2, 1, 6),
+            _full_box(b'stsc', 'IIII', 1, 1, 5, 1),
+            _full_box(b'stsz', 'II', 100, 10),
+            _full_box(b'stco', 'III', 2, mdat_offset + 8, mdat_offset + 8 + 500),
+        )
+        trak = _box(b'trak', _box(b'mdia',
+            _full_box(b'mdhd', 'IIII', 0, 0, 1000, 1000),
+            _full_box(b'hdlr', 'I4s', 0, b'vide'),
+            _box(b'minf', stbl),
+        ))
+        moov = _box(b'moov', _full_box(b'mvhd', 'IIII', 0, 0, 1000, 1000), trak)
+        path = os.path.join(self.tmp, "vid_720p.mp4")
+        with open(path, 'wb') as f:
+            # mdat before moov, like files written without +faststart
+            f.write(_box(b'ftyp', b'isom'))
+            f.write(_box(b'mdat', b'\0' * 1000))
+            f.write(moov)
+        return path
+
+    def test_build_reads_mp4_sample_tables(self):
+        path = self._write_mp4()
+
+        index = KeyframeIndex.build(path)
+
+        self.assertEqual(index.codec, 'h264')
+        self.assertEqual(list(index.timestamps), [0.0, 0.5])
+        # ftyp (12 bytes) + mdat header (8 bytes), second keyframe opens the second chunk
+        self.assertEqual(list(index.offsets), [20, 520])
+
+    def test_build_follows_multi_entry_stts(self):
+        # 3 samples of 100ms, then 7 of 200ms: the second keyframe (sample 6) decodes at 0.3 + 2 * 0.2
+        path = self._write_mp4(stts=((3, 100), (7, 200)))
+
+        index = KeyframeIndex.build(path)
+
+        self.assertEqual(list(index.timestamps), [0.0, 0.7])
+
+    def test_build_matches_probed_keyframes_of_variable_frame_rate_video(self):
+        import subprocess
+        import imageio_ffmpeg
+
+        # Dropping frames 7-12 of a 10fps clip leaves a 0.7s gap, so stts has several entries
+        path = os.path.join(self.tmp, "vfr_720p.mp4")
+        subprocess.run([
+            imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-f', 'lavfi', '-i', 'testsrc=size=64x64:rate=10:duration=3',
+            '-vf', "select='not(between(n,7,12))'", '-fps_mode', 'vfr',
+            '-c:v', 'mpeg4', '-g', '6', path
+        ], check=True)
+
+        index = KeyframeIndex.build(path)
+
+        _, probed = SegmentDownloader.probe_keyframes(path, 0, None)
+        self.assertEqual(list(index.timestamps), probed)
+
+    def test_lookups(self):
+        path = self._write_mp4()
+        index = KeyframeIndex.build(path)
+
+        self.assertEqual(index.keyframe_before(0.7), (0.5, 520))
+        self.assertEqual(index.keyframe_before(0.5), (0.5, 520))
+        self.assertEqual(index.keyframe_after(0.2), (0.5, 520))
+        self.assertIsNone(index.keyframe_after(0.7))
+        self.assertEqual(index.between(0.2, 1.0), [0.5])
+        self.assertEqual(index.byte_range(0.2, 0.3), (20, 520))
+
+    def test_saved_index_is_reused_until_the_source_changes(self):
+        path = self._write_mp4()
+        KeyframeIndex.build(path)
+
+        with patch.object(KeyframeIndex, 'build') as mock_build:
+            index = KeyframeIndex.get(path)
+            mock_build.assert_not_called()
+        self.assertEqual(list(index.timestamps), [0.0, 0.5])
+
+        with open(path, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(KeyframeIndex.load(path))
+
+    @patch('downloads.services.SegmentDownloader.probe_keyframes')
+    def test_other_containers_are_probed(self, mock_probe):
+        path = os.path.join(self.tmp, "vid_720p.webm")
+        with open(path, 'wb') as f:
+            f.write(b'\x1a\x45\xdf\xa3' + b'\0' * 100)
+        mock_probe.return_value = ('vp9', [0.0, 2.0])
+
+        index = KeyframeIndex.build(path)
+
+        self.assertEqual(index.codec, 'vp9')
+        self.assertEqual(list(index.timestamps), [0.0, 2.0])
+        self.assertEqual(index.byte_range(1, 1.5), (None, None))
@@ -1 +1,24 @@
 # Utility functions for downloads app
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """Collect wall-clock durations (in seconds) of named processing stages"""
+
+    def __init__(self, timings=None):
+        # Start from earlier timings (e.g. of previous stage tasks) to keep accumulating them
+        self.timings = dict(timings or {})
+        # Duration of the latest run of each stage (timings accumulate repeated runs)
+        self.last = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the wrapped block; repeated stages accumulate"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.last[name] = elapsed
+            self.timings[name] = round(self.timings.get(name, 0) + elapsed, 3)
@@ -11,7 +11,15 @@ class DownloadValidator:
         if not re.match(cls.YOUTUBE_REGEX, url):
             return False
         return True
-    
+
+    @classmethod
+    def extract_video_id(cls, url):
+        """Return the 11-character video ID from a YouTube URL, or None if it can't be parsed"""
+        match = re.match(cls.YOUTUBE_REGEX, url)
+        if not match:
+            return None
+        return match.group(6)
+
     @staticmethod
     def validate_timestamps(start, end, duration):
         """
@@ -39,18 +47,10 @@ class DownloadValidator:
             return False, str(e), None
 
     @staticmethod
-    def validate_quality(quality, available_formats):
-        """Check if requested quality is available"""
-        # available_formats is likely a list of dicts [{'format_id': '...', 'quality': '720p', ...}]
-        # This checks if the requested quality exists in available formats
-        valid_qualities = [fmt.get('quality') for fmt in available_formats]
-        if quality not in valid_qualities:
-             # Also allow passing format_id directly
-             valid_ids = [fmt.get('format_id') for fmt in available_formats]
-             if quality in valid_ids:
-                 return True
-             return False
-        return True
+    def validate_quality(quality, video):
+        """Check if requested quality (a quality label or a format_id) is available for a VideoInfo"""
+        # Indexed lookups on the video's formats, by quality then by format_id
+        return video.find_format(quality) is not None
     
     @staticmethod
     def validate_file_size(estimated_size):
@@ -11,6 +11,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const videoDuration = document.getElementById('videoDuration');
     const videoUploader = document.getElementById('videoUploader');
     const qualitySelect = document.getElementById('qualitySelect');
+    const cutModeSelect = document.getElementById('cutModeSelect');
     
     // Time Inputs (HH:MM:SS format - now dropdowns)
     const startHourInput = document.getElementById('startHour');
@@ -36,6 +37,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     let currentVideoDuration = 0;
     let pollInterval = null;
+    let eventSource = null;
     let currentTaskId = null;
     let isDownloading = false;
 
@@ -166,12 +168,9 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 5000);
     }
 
-    // Stop polling and cleanup
+    // Stop tracking and cleanup
     function stopPolling() {
-        if (pollInterval) {
-            clearInterval(pollInterval);
-            pollInterval = null;
-        }
+        stopTracking();
         setDownloadWarning(false);
         currentTaskId = null;
     }
@@ -310,7 +309,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     youtube_url: url,
                     start_time: start,
                     end_time: end,
-                    quality: quality
+                    quality: quality,
+                    cut_mode: cutModeSelect.value
                 })
             });
 
@@ -320,7 +320,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 const taskId = data.task_id;
                 currentTaskId = taskId;
                 setDownloadWarning(true); // Show warning not to close page
-                startPolling(taskId);
+                trackTask(taskId);
+            } else if (response.status === 200 && data.status === 'completed') {
+                // Same clip was already processed, the server returned the finished file
+                showCompleted(data);
             } else {
                 showError(data.error || 'Download failed to start');
                 downloadBtn.disabled = false;
@@ -331,7 +334,58 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    // 3. Poll Status
+    // 3. Track Status: push updates over Server-Sent Events, polling as a fallback
+    function trackTask(taskId) {
+        stopTracking();
+        if (!window.EventSource) {
+            startPolling(taskId);
+            return;
+        }
+
+        eventSource = new EventSource(`/api/task-events/${taskId}/`);
+        eventSource.addEventListener('status', (event) => {
+            handleStatus(JSON.parse(event.data));
+        });
+        eventSource.onerror = () => {
+            // A closed stream was refused (e.g. no ASGI server); transient drops reconnect by themselves
+            if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+                eventSource = null;
+                startPolling(taskId);
+            }
+        };
+    }
+
+    function stopTracking() {
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+        if (pollInterval) {
+            clearInterval(pollInterval);
+            pollInterval = null;
+        }
+    }
+
+    function handleStatus(data) {
+        const status = data.status;
+        const percent = data.progress || 0;
+
+        progressBar.style.width = `${percent}%`;
+        progressBar.textContent = `${percent}%`;
+
+        if (status === 'processing') {
+             progressStatus.textContent = 'Processing... Downloading video and extracting clip...';
+        } else if (status === 'completed') {
+            stopTracking();
+            showCompleted(data);
+        } else if (status === 'failed') {
+            stopTracking();
+            showError(data.error_message || 'Download failed during processing');
+            downloadBtn.disabled = false;
+            setDownloadWarning(false);
+        }
+    }
+
     function startPolling(taskId) {
         if (pollInterval) clearInterval(pollInterval);
         
@@ -341,38 +395,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 const data = await response.json();
 
                 if (response.ok) {
-                    const status = data.status;
-                    const percent = data.progress || 0;
-                    
-                    progressBar.style.width = `${percent}%`;
-                    progressBar.textContent = `${percent}%`;
-
-                    if (status === 'processing') {
-                         progressStatus.textContent = 'Processing... Downloading video and extracting clip...';
-                    } else if (status === 'completed') {
-                        clearInterval(pollInterval);
-                        progressBar.style.width = '100%';
-                        progressBar.textContent = '100%';
-                        progressStatus.textContent = 'Processing Complete! Your video is ready for download.';
-                        progressStatus.className = 'text-center text-success mt-2 fw-bold';
-                        progressBar.classList.remove('progress-bar-animated');
-                        
-                        // Show Download Link
-                        finalDownloadLink.href = data.download_url;
-                        downloadLinkContainer.style.display = 'block';
-                        downloadBtn.disabled = false;
-                        
-                        // Stop warning
-                        setDownloadWarning(false);
-                        
-                        // Show success alert
-                        alert('Download complete! Click "Save File" to download your video.');
-                    } else if (status === 'failed') {
-                        clearInterval(pollInterval);
-                        showError(data.error_message || 'Download failed during processing');
-                        downloadBtn.disabled = false;
-                        setDownloadWarning(false);
-                    }
+                    handleStatus(data);
                 }
             } catch (error) {
                 console.error('Polling error', error);
@@ -380,6 +403,25 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 2000); // Check every 2 seconds
     }
 
+    function showCompleted(data) {
+        progressBar.style.width = '100%';
+        progressBar.textContent = '100%';
+        progressStatus.textContent = 'Processing Complete! Your video is ready for download.';
+        progressStatus.className = 'text-center text-success mt-2 fw-bold';
+        progressBar.classList.remove('progress-bar-animated');
+        
+        // Show Download Link
+        finalDownloadLink.href = data.download_url;
+        downloadLinkContainer.style.display = 'block';
+        downloadBtn.disabled = false;
+        
+        // Stop warning
+        setDownloadWarning(false);
+        
+        // Show success alert
+        alert('Download complete! Click "Save File" to download your video.');
+    }
+
     function showError(msg) {
         errorContainer.textContent = msg;
         errorContainer.style.display = 'block';
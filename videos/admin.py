@@ -1,8 +1,13 @@
 from django.contrib import admin
-from .models import VideoInfo
+from .models import VideoInfo, VideoFormat
+
+class VideoFormatInline(admin.TabularInline):
+    model = VideoFormat
+    extra = 0
 
 @admin.register(VideoInfo)
 class VideoInfoAdmin(admin.ModelAdmin):
+    inlines = [VideoFormatInline]
     list_display = ('youtube_id', 'title', 'duration', 'uploader')
     search_fields = ('title', 'youtube_id', 'uploader')
     list_filter = ('duration',)
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from downloads.metrics import Counters
+from .models import VideoInfo
+from .services import YouTubeExtractor
+
+
+class MetadataCache:
+    """
+    Serve video metadata without re-running yt-dlp extraction on every request.
+
+    Entries are keyed by youtube_id and considered fresh for METADATA_CACHE_TTL
+    seconds after VideoInfo.updated_at. Fresh entries are kept in the Django
+    cache so repeated requests don't hit the database either; stale or unknown
+    videos are extracted again, which refreshes the row.
+    """
+
+    KEY_PREFIX = 'ysd:video:'
+
+    @staticmethod
+    def ttl():
+        return settings.YOUTUBE_DOWNLOADER_SETTINGS.get('METADATA_CACHE_TTL', 3600)
+
+    @staticmethod
+    def to_video_data(video):
+        """Same shape as YouTubeExtractor.get_video_info's result"""
+        return {
+            'youtube_id': video.youtube_id,
+            'title': video.title,
+            'duration': video.duration,
+            'thumbnail': video.thumbnail_url,
+            'uploader': video.uploader,
+            'formats': [fmt.to_dict() for fmt in video.formats.all()],
+        }
+
+    @classmethod
+    def _remaining(cls, updated_at):
+        """Seconds until a row updated at updated_at goes stale (<= 0 when it already is)"""
+        expires_at = updated_at + timedelta(seconds=cls.ttl())
+        return int((expires_at - timezone.now()).total_seconds())
+
+    @classmethod
+    def get(cls, youtube_url, youtube_id=None):
+        """
+        Return video data for the URL, extracting it only when there is no fresh entry.
+
+        youtube_id should be parsed from the URL by the caller; without it the
+        cache can't be consulted and the video is always extracted.
+        """
+        if youtube_id:
+            video_data = cache.get(cls.KEY_PREFIX + youtube_id)
+            if video_data:
+                Counters.incr('metadata_cache_hits')
+                return video_data
+
+            video = VideoInfo.objects.filter(youtube_id=youtube_id).first()
+            if video:
+                remaining = cls._remaining(video.updated_at)
+                if remaining > 0:
+                    video_data = cls.to_video_data(video)
+                    cache.set(cls.KEY_PREFIX + youtube_id, video_data, remaining)
+                    Counters.incr('metadata_cache_hits')
+                    return video_data
+
+        Counters.incr('metadata_cache_misses')
+        video_data = YouTubeExtractor.get_video_info(youtube_url)
+        cls.store(video_data)
+        return video_data
+
+    @classmethod
+    def store(cls, video_data):
+        """Cache freshly extracted video data (the extractor has just updated the row)"""
+        cache.set(cls.KEY_PREFIX + video_data['youtube_id'], video_data, cls.ttl())
+
+    @classmethod
+    def invalidate(cls, youtube_id):
+        cache.delete(cls.KEY_PREFIX + youtube_id)
+
+    @staticmethod
+    def stats():
+        counters = Counters.get_many('metadata_cache_hits', 'metadata_cache_misses')
+        return {
+            'hits': counters['metadata_cache_hits'],
+            'misses': counters['metadata_cache_misses'],
+            'hit_ratio': Counters.ratio(counters['metadata_cache_hits'], counters['metadata_cache_misses']),
+        }
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoinfo',
+            name='bitrates',
+            field=models.JSONField(blank=True, default=dict, help_text='Bytes per second by quality'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2 on 2026-10-17 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FIELDS = ('format_id', 'quality', 'ext', 'filesize', 'filesize_approx', 'tbr', 'vbr', 'abr', 'has_video', 'has_audio')
+
+
+def copy_formats_to_table(apps, schema_editor):
+    """Backfill VideoFormat rows from the available_qualities JSON of existing videos"""
+    VideoInfo = apps.get_model('videos', 'VideoInfo')
+    VideoFormat = apps.get_model('videos', 'VideoFormat')
+    formats = []
+    for video in VideoInfo.objects.only('pk', 'available_qualities').iterator():
+        # The field defaulted to {} although the extractor always stored a list
+        for fmt in video.available_qualities or []:
+            if isinstance(fmt, dict) and fmt.get('format_id'):
+                formats.append(VideoFormat(
+                    video_id=video.pk,
+                    format_id=fmt['format_id'],
+                    quality=fmt.get('quality') or '',
+                    ext=fmt.get('ext') or '',
+                    filesize=fmt.get('filesize'),
+                    filesize_approx=fmt.get('filesize_approx'),
+                    tbr=fmt.get('tbr'),
+                    vbr=fmt.get('vbr'),
+                    abr=fmt.get('abr'),
+                    has_video=fmt.get('has_video', True),
+                    has_audio=fmt.get('has_audio', True),
+                ))
+    VideoFormat.objects.bulk_create(formats, batch_size=500)
+
+
+def copy_formats_to_json(apps, schema_editor):
+    VideoInfo = apps.get_model('videos', 'VideoInfo')
+    for video in VideoInfo.objects.prefetch_related('formats').iterator(chunk_size=500):
+        video.available_qualities = [
+            {field: getattr(fmt, field) for field in FIELDS} for fmt in video.formats.all()
+        ]
+        video.save(update_fields=['available_qualities'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0002_videoinfo_bitrates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoFormat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format_id', models.CharField(max_length=50)),
+                ('quality', models.CharField(max_length=20)),
+                ('ext', models.CharField(max_length=10)),
+                ('filesize', models.BigIntegerField(blank=True, null=True)),
+                ('filesize_approx', models.BigIntegerField(blank=True, null=True)),
+                ('tbr', models.FloatField(blank=True, help_text='Total bitrate in kbit/s', null=True)),
+                ('vbr', models.FloatField(blank=True, help_text='Video bitrate in kbit/s', null=True)),
+                ('abr', models.FloatField(blank=True, help_text='Audio bitrate in kbit/s', null=True)),
+                ('has_video', models.BooleanField(default=True)),
+                ('has_audio', models.BooleanField(default=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='formats', to='videos.videoinfo')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='videoformat',
+            index=models.Index(fields=['video', 'quality'], name='videos_vide_video_i_f87178_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videoformat',
+            index=models.Index(fields=['video', 'format_id'], name='videos_vide_video_i_ca76a6_idx'),
+        ),
+        migrations.RunPython(copy_formats_to_table, copy_formats_to_json),
+        migrations.RemoveField(
+            model_name='videoinfo',
+            name='available_qualities',
+        ),
+    ]
@@ -6,9 +6,46 @@ class VideoInfo(models.Model):
     duration = models.IntegerField(help_text="Duration in seconds")
     thumbnail_url = models.URLField(max_length=500, blank=True, null=True)
     uploader = models.CharField(max_length=255, blank=True, null=True)
-    available_qualities = models.JSONField(default=dict)
+    bitrates = models.JSONField(default=dict, blank=True, help_text="Bytes per second by quality")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
+
+    def find_format(self, quality):
+        """Format matching a quality label (e.g. '720p') or a format_id, or None"""
+        return (
+            self.formats.filter(quality=quality).first()
+            or self.formats.filter(format_id=quality).first()
+        )
+
+class VideoFormat(models.Model):
+    """A downloadable format of a video, as reported by yt-dlp at extraction"""
+    # Keys of the format dicts returned by YouTubeExtractor.get_video_info
+    FIELDS = ('format_id', 'quality', 'ext', 'filesize', 'filesize_approx', 'tbr', 'vbr', 'abr', 'has_video', 'has_audio')
+
+    video = models.ForeignKey(VideoInfo, on_delete=models.CASCADE, related_name='formats')
+    format_id = models.CharField(max_length=50)
+    quality = models.CharField(max_length=20)
+    ext = models.CharField(max_length=10)
+    filesize = models.BigIntegerField(blank=True, null=True)
+    filesize_approx = models.BigIntegerField(blank=True, null=True)
+    tbr = models.FloatField(blank=True, null=True, help_text="Total bitrate in kbit/s")
+    vbr = models.FloatField(blank=True, null=True, help_text="Video bitrate in kbit/s")
+    abr = models.FloatField(blank=True, null=True, help_text="Audio bitrate in kbit/s")
+    has_video = models.BooleanField(default=True)
+    has_audio = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['video', 'quality']),
+            models.Index(fields=['video', 'format_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.video.youtube_id} {self.format_id} ({self.quality})"
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
@@ -1,4 +1,7 @@
-from .models import VideoInfo
+from django.db import transaction
+from .models import VideoInfo, VideoFormat
+from downloads.estimation import SizeEstimator
+from downloads.profiling import Profiler
 import yt_dlp
 import datetime
 
@@ -15,6 +18,7 @@ class YouTubeExtractor:
     }
 
     @staticmethod
+    @Profiler.sampling('get_video_info')
     def get_video_info(youtube_url):
         """
         Input: YouTube URL
@@ -29,6 +33,8 @@ class YouTubeExtractor:
                 'quality': str,
                 'ext': str,
                 'filesize': int,
+                'filesize_approx': int,
+                'tbr': float, 'vbr': float, 'abr': float,  # kbit/s, None when unknown
                 'has_video': bool,
                 'has_audio': bool
             }]
@@ -46,6 +52,12 @@ class YouTubeExtractor:
                 
                 formats_data = info.get('formats', [])
                 filtered_formats = []
+
+                # Video-only formats are merged with the best m4a audio, whose bitrate adds to theirs
+                audio_bitrate = max((
+                    SizeEstimator.format_bitrate(fmt, duration) for fmt in formats_data
+                    if fmt.get('vcodec') == 'none' and fmt.get('ext') == 'm4a'
+                ), default=0)
                 
                 for fmt in formats_data:
                     # Filter for MP4 and standard resolutions
@@ -67,6 +79,10 @@ class YouTubeExtractor:
                         'quality': quality,
                         'ext': fmt.get('ext'),
                         'filesize': filesize,
+                        'filesize_approx': fmt.get('filesize_approx'),
+                        'tbr': fmt.get('tbr'),
+                        'vbr': fmt.get('vbr'),
+                        'abr': fmt.get('abr'),
                         'has_video': fmt.get('vcodec') != 'none',
                         'has_audio': fmt.get('acodec') != 'none'
                     })
@@ -80,17 +96,21 @@ class YouTubeExtractor:
                     'formats': filtered_formats
                 }
                 
-                # Save or update VideoInfo
-                VideoInfo.objects.update_or_create(
-                    youtube_id=youtube_id,
-                    defaults={
-                        'title': title,
-                        'duration': duration,
-                        'thumbnail_url': thumbnail,
-                        'uploader': uploader,
-                        'available_qualities': filtered_formats
-                    }
-                )
+                # Save or update VideoInfo and replace its formats
+                with transaction.atomic():
+                    video, _ = VideoInfo.objects.update_or_create(
+                        youtube_id=youtube_id,
+                        defaults={
+                            'title': title,
+                            'duration': duration,
+                            'thumbnail_url': thumbnail,
+                            'uploader': uploader,
+                            # Precomputed quality -> bytes/s table for size estimates
+                            'bitrates': SizeEstimator.bitrate_table(filtered_formats, duration, audio_bitrate)
+                        }
+                    )
+                    video.formats.all().delete()
+                    VideoFormat.objects.bulk_create([VideoFormat(video=video, **fmt) for fmt in filtered_formats])
                 
                 return video_data
                 
@@ -104,7 +124,23 @@ class YouTubeExtractor:
         # Typically yt-dlp doesn't give a direct persistent download URL unless we extract it again.
         # But for this task, the goal is likely to get the URL to stream/download *during* processing.
         # This method might be used by the downloader service.
+        urls, _ = YouTubeExtractor.get_stream_urls(youtube_id, format_id)
+        return urls[0] if urls else None
+
+    @staticmethod
+    def get_stream_urls(youtube_id, format_selector):
+        """
+        Resolve the direct media URL(s) for a format selector.
+
+        Merged selections (e.g. 'bestvideo+bestaudio') resolve to one URL per
+        stream, video first. Returns (urls, http_headers); the headers have to be
+        sent along with every request to the media URLs.
+        """
         url = f"https://www.youtube.com/watch?v={youtube_id}"
-        with yt_dlp.YoutubeDL({'format': format_id}) as ydl:
+        with yt_dlp.YoutubeDL({'format': format_selector, 'quiet': True, 'noplaylist': True}) as ydl:
             info = ydl.extract_info(url, download=False)
-            return info.get('url')
+
+        requested = info.get('requested_formats') or [info]
+        urls = [fmt.get('url') for fmt in requested if fmt.get('url')]
+        http_headers = requested[0].get('http_headers') or info.get('http_headers') or {}
+        return urls, http_headers
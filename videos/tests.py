@@ -1,3 +1,40 @@
 from django.test import TestCase
+from unittest.mock import patch
+from .models import VideoInfo, VideoFormat
+from .services import YouTubeExtractor
 
-# Create your tests here.
+
+class YouTubeExtractorTests(TestCase):
+    def _info(self, formats):
+        return {
+            'id': 'test_id', 'title': 'Test Video', 'duration': 100,
+            'thumbnail': None, 'uploader': 'Uploader', 'formats': formats,
+        }
+
+    @patch('videos.services.yt_dlp.YoutubeDL')
+    def test_formats_are_stored_in_their_table(self, MockYDL):
+        ydl = MockYDL.return_value.__enter__.return_value
+        ydl.extract_info.return_value = self._info([
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a', 'abr': 128},
+            {'format_id': '136', 'ext': 'mp4', 'height': 720, 'vcodec': 'avc1', 'acodec': 'none', 'tbr': 2000},
+            {'format_id': '18', 'ext': 'mp4', 'height': 360, 'vcodec': 'avc1', 'acodec': 'mp4a', 'filesize': 5_000_000},
+            {'format_id': '243', 'ext': 'webm', 'height': 360, 'vcodec': 'vp9', 'acodec': 'none'},
+        ])
+
+        video_data = YouTubeExtractor.get_video_info("https://www.youtube.com/watch?v=test_id")
+
+        video = VideoInfo.objects.get(youtube_id='test_id')
+        self.assertEqual([fmt.format_id for fmt in video.formats.all()], ['136', '18'])
+        self.assertEqual(video_data['formats'], [fmt.to_dict() for fmt in video.formats.all()])
+        self.assertEqual(video.find_format('720p').format_id, '136')
+        self.assertEqual(video.find_format('18').quality, '360p')
+        # Video-only 720p gets the m4a audio added, the muxed 360p is filesize over duration
+        self.assertEqual(video.bitrates['720p'], 250_000 + 16_000)
+        self.assertEqual(video.bitrates['360p'], 50_000)
+
+        # Extracting again replaces the formats
+        ydl.extract_info.return_value = self._info([
+            {'format_id': '22', 'ext': 'mp4', 'height': 720, 'vcodec': 'avc1', 'acodec': 'mp4a'},
+        ])
+        YouTubeExtractor.get_video_info("https://www.youtube.com/watch?v=test_id")
+        self.assertEqual(list(VideoFormat.objects.values_list('format_id', flat=True)), ['22'])